@@ -0,0 +1,106 @@
+from fastapi import APIRouter, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
+from starlette.datastructures import Headers
+from datetime import datetime
+from typing import Literal
+from api.http_cache import etag_matches
+import anyio
+import services.audio as audio_service
+import services.data as data_service
+
+router = APIRouter(prefix="/api/audio")
+
+
+class ClipFileResponse(FileResponse):
+    # Whole files are handed to the server with the ASGI zero copy send extension when the server offers it.
+    # Otherwise, and for Range requests, FileResponse reads the file in chunks
+    chunk_size = audio_service.download_chunk_size
+
+    async def __call__(self, scope, receive, send):
+        if ("http.response.zerocopysend" not in scope.get("extensions", {})
+                or scope["method"].upper() == "HEAD" or "range" in Headers(scope=scope)):
+            await super().__call__(scope, receive, send)
+            return
+        await send({"type": "http.response.start", "status": self.status_code, "headers": self.raw_headers})
+        with open(self.path, "rb") as file:
+            await send({"type": "http.response.zerocopysend", "file": file, "more_body": False})
+
+
+@router.get("/clips")
+async def get_clips(device_id: str | None = None,
+                    node_id: str | None = None,
+                    start: datetime | None = None,
+                    end: datetime | None = None,
+                    limit: int = Query(audio_service.default_clip_limit, ge=1, le=audio_service.max_clip_limit)):
+    # Clips overlapping the time range, oldest first
+    return await audio_service.get_clips(device_id, node_id, start, end, limit)
+
+@router.get("/clips/{clip_id}")
+async def get_clip(clip_id: int):
+    clip = await audio_service.get_clip(clip_id)
+    if clip is None:
+        raise HTTPException(status_code=404, detail=f"Clip {clip_id} not found")
+    return clip
+
+@router.get("/clips/{clip_id}/file")
+async def download_clip(clip_id: int, request: Request):
+    # The stored file of the clip, with Range requests for seeking and resuming
+    clip = await audio_service.get_clip(clip_id)
+    if clip is None:
+        raise HTTPException(status_code=404, detail=f"Clip {clip_id} not found")
+    path = audio_service.get_clip_path(clip["sha256"], clip["format"])
+    try:
+        stat_result = await anyio.Path(path).stat()
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail=f"The file of clip {clip_id} is missing from the audio store")
+
+    # The files are content addressed, so the checksum is a strong ETag
+    etag = f'"{clip["sha256"]}"'
+    if etag_matches(request, etag):
+        return Response(status_code=304, headers={"ETag": etag})
+    return ClipFileResponse(path, media_type=audio_service.get_media_type(clip["format"]),
+                            filename=audio_service.get_download_name(clip), stat_result=stat_result,
+                            headers={"ETag": etag})
+
+@router.get("/download")
+async def download_range(device_id: str | None = None,
+                         node_id: str | None = None,
+                         start: datetime | None = None,
+                         end: datetime | None = None,
+                         format: Literal["zip", "wav"] = "zip"):
+    # The clips of a time range (default the last hour) in one download, streamed while the clips are read.
+    # zip holds every clip as stored, wav joins the clips of one device cut to the time range
+    if format == "wav" and device_id is None:
+        raise HTTPException(status_code=400, detail="device_id is required to join the clips into one WAV file")
+    try:
+        start, end = data_service.get_time_range(start, end)
+        clips = await audio_service.get_range_clips(device_id, node_id, start, end)
+        if not clips:
+            raise HTTPException(status_code=404, detail="No clips in the time range")
+        name = f"{device_id or node_id or 'audio'}_{start:%Y%m%d_%H%M%S}"
+
+        if format == "zip":
+            return StreamingResponse(audio_service.stream_zip(clips), media_type="application/zip",
+                                     headers={"Content-Disposition": f'attachment; filename="{name}.zip"'})
+
+        size, wav_bytes = await audio_service.prepare_wav_range(clips, start, end)
+        return StreamingResponse(wav_bytes, media_type="audio/wav",
+                                 headers={"Content-Disposition": f'attachment; filename="{name}.wav"',
+                                          "Content-Length": str(size)})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+
+@router.get("/process_runs/{node_id}/{device_id}")
+async def get_process_run_clips(node_id: str, device_id: str,
+                                start: datetime | None = None,
+                                end: datetime | None = None,
+                                audio_device_id: str | None = None):
+    # Process runs of the device in the time range (default the last hour) with the clips recorded during each run.
+    # Without audio_device_id the clips of every microphone of the node are returned.
+    try:
+        start, end = data_service.get_time_range(start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    return await audio_service.get_process_run_clips(node_id, device_id, start, end, audio_device_id)
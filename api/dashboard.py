@@ -1,13 +1,13 @@
 from fastapi import APIRouter
+import services.dashboard as dashboard_service
 
 router = APIRouter(prefix="/api/dashboard")
 
 @router.get("/status")
 async def get_status():
-    # Dummy data
-    return {"status": "online"}
+    return await dashboard_service.get_status()
 
 @router.get("/node_status")
 async def get_node_status():
 
-    return
\ No newline at end of file
+    return await dashboard_service.get_node_status()
\ No newline at end of file
@@ -0,0 +1,38 @@
+from fastapi import APIRouter, HTTPException, Query
+from fastapi.responses import StreamingResponse
+from fastapi.encoders import jsonable_encoder
+from datetime import datetime
+from typing import Literal
+from db.schema_registry import schema_registry
+import services.data as data_service
+import json
+
+router = APIRouter(prefix="/api/data")
+
+
+@router.get("/{group_id}")
+async def get_data(group_id: str,
+                   device_id: str,
+                   sensor_id: list[str] | None = Query(None),
+                   start: datetime | None = None,
+                   end: datetime | None = None,
+                   points: int = Query(data_service.default_points, ge=1, le=data_service.max_points),
+                   format: Literal["json", "ndjson"] = "json"):
+    # Sensor data of a device, downsampled to at most points per sensor.
+    # Each point is the average of a time bucket with the min and max of the bucket.
+    if not await schema_registry.group_table_exists(group_id):
+        raise HTTPException(status_code=404, detail=f"Group {group_id} not found")
+    try:
+        start, end = data_service.get_time_range(start, end)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    if format == "json":
+        return await data_service.get_series(group_id, device_id, sensor_id, start, end, points)
+
+    # One point per line, written while the rows are read from the database
+    async def ndjson_lines():
+        async for point in data_service.stream_series(group_id, device_id, sensor_id, start, end, points):
+            yield json.dumps(jsonable_encoder(point)) + "\n"
+
+    return StreamingResponse(ndjson_lines(), media_type="application/x-ndjson")
@@ -1,7 +1,15 @@
-from fastapi import APIRouter, HTTPException, UploadFile, File, Form
+from fastapi import APIRouter, HTTPException, UploadFile, File, Form, Request, Header, Query
 from pathlib import Path
+from datetime import datetime
+from services.audio import mounted_dir, store_clip
+from services.metrics import audio_upload_bytes
+import anyio
+import hashlib
 import logging
 import sys
+import os
+import re
+import uuid
 
 router = APIRouter(prefix="/api/data_saver")
 
@@ -13,30 +21,124 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-#Directory for running locally
-#local_dir = ""
-#mounted_dir = Path(local_dir)
-#Directory for docker container
-mounted_dir = Path("/mounted_dir")
+# Upload limits, can be tuned through the environment
+upload_chunk_size = int(os.getenv("UPLOAD_CHUNK_SIZE", str(1024 * 1024)))
+max_upload_bytes = int(os.getenv("AUDIO_MAX_UPLOAD_BYTES", str(512 * 1024 * 1024)))
 
-@router.post("/upload_audio")
-async def upload_audio(file: UploadFile = File(...), device_id: str = Form(...)):
-    # Create the directory for the audiodata if it does not exist
-    audio_data_dir = mounted_dir.joinpath("data/audio_data")
-    # Creating the direction for the audio files for the device if it does not exist
-    audio_file_dir = audio_data_dir.joinpath(device_id)
-    audio_file_dir.mkdir(exist_ok=True, parents=True)
-    # File name
-    filename = file.filename
-    file_path = audio_file_dir.joinpath(file.filename)
-
-    # Creates the file
-    with open(file_path, "wb") as out_file:
-        content = await file.read()
-        out_file.write(content)
-    logger.info(f"Saved audio file from: {device_id} under directory {audio_file_dir} as {filename}")
+content_range_pattern = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+
+def get_audio_file_dir(device_id: str) -> Path:
+    # Directory for the uploads of the device that are still in progress, finished clips go to the audio store
+    return mounted_dir.joinpath("data/audio_data", safe_name(device_id))
+
+def safe_name(name: str) -> str:
+    # Only keep the final path component so uploads can not escape the data directory
+    name = Path(name or "").name
+    if name in ("", ".", ".."):
+        raise HTTPException(status_code=400, detail=f"Invalid name: {name!r}")
+    return name
+
+async def stream_to_file(chunks, file_path: Path, mode: str, offset: int, limit: int, sha256=None) -> int:
+    # Write the chunks to the file in a worker thread, returns the total size of the file.
+    # The checksum is updated while writing when a hash object is given
+    size = offset
+    async with await anyio.open_file(file_path, mode) as out_file:
+        async for chunk in chunks:
+            size += len(chunk)
+            if size > limit:
+                raise HTTPException(status_code=413, detail=f"Upload exceeds the limit of {limit} bytes")
+            if sha256 is not None:
+                sha256.update(chunk)
+            await out_file.write(chunk)
+            audio_upload_bytes.inc(amount=len(chunk))
+    return size
+
+async def upload_file_chunks(file: UploadFile):
+    # Read the uploaded file in chunks instead of loading it all into memory
+    while chunk := await file.read(upload_chunk_size):
+        yield chunk
+
+def upload_response(clip: dict) -> dict:
     return {
-        "message": "Upload successful",
-        "saved_as": filename,
-        "device_id": device_id
+        "message": "Clip already stored" if clip["duplicate"] else "Upload successful",
+        "saved_as": clip["filename"],
+        **clip
     }
+
+@router.post("/upload_audio")
+async def upload_audio(file: UploadFile = File(...), device_id: str = Form(...),
+                       start_time: datetime | None = Form(None), node_id: str | None = Form(None)):
+    # The start time of the recording is taken from the form or the file name,
+    # otherwise the recording is taken to have ended at the upload
+    audio_file_dir = get_audio_file_dir(device_id)
+    await anyio.Path(audio_file_dir).mkdir(exist_ok=True, parents=True)
+    # File name
+    filename = safe_name(file.filename)
+    # Write to a temporary file first, so a failed upload never leaves a half written file behind
+    tmp_path = audio_file_dir.joinpath(f".{filename}.{uuid.uuid4().hex}.tmp")
+
+    sha256 = hashlib.sha256()
+    try:
+        size = await stream_to_file(upload_file_chunks(file), tmp_path, "wb", 0, max_upload_bytes, sha256)
+    except BaseException:
+        await anyio.Path(tmp_path).unlink(missing_ok=True)
+        raise
+    clip = await store_clip(tmp_path, device_id, filename, start_time, node_id, sha256.hexdigest())
+
+    logger.info(f"Saved audio file from: {device_id} as {filename} ({size} bytes, clip {clip['clip_id']})")
+    return upload_response(clip)
+
+@router.get("/upload_audio/{device_id}/{filename}")
+async def get_upload_status(device_id: str, filename: str):
+    # Get how many bytes of a resumable upload have been received, so the client knows where to resume
+    part_path = get_audio_file_dir(device_id).joinpath(f"{safe_name(filename)}.part")
+    if await anyio.Path(part_path).exists():
+        received = (await anyio.Path(part_path).stat()).st_size
+    else:
+        received = 0
+    return {"device_id": device_id, "filename": filename, "received": received}
+
+@router.put("/upload_audio/{device_id}/{filename}")
+async def upload_audio_chunk(device_id: str, filename: str, request: Request,
+                             content_range: str | None = Header(None), start_time: datetime | None = Query(None),
+                             node_id: str | None = Query(None)):
+    # Resumable upload, each request carries one chunk with a "Content-Range: bytes start-end/total" header.
+    # The start time and node of the recording are only used with the last chunk
+    audio_file_dir = get_audio_file_dir(device_id)
+    await anyio.Path(audio_file_dir).mkdir(exist_ok=True, parents=True)
+    filename = safe_name(filename)
+    part_path = audio_file_dir.joinpath(f"{filename}.part")
+
+    # Without a Content-Range header the whole file is sent in one request
+    if content_range is None:
+        start, total = 0, None
+    else:
+        match = content_range_pattern.match(content_range)
+        if not match:
+            raise HTTPException(status_code=400, detail=f"Invalid Content-Range header: {content_range}")
+        start, end, total = (int(value) for value in match.groups())
+        if end < start or end >= total:
+            raise HTTPException(status_code=400, detail=f"Invalid Content-Range header: {content_range}")
+        if total > max_upload_bytes:
+            raise HTTPException(status_code=413, detail=f"Upload exceeds the limit of {max_upload_bytes} bytes")
+
+    # The chunk has to continue where the previous one stopped
+    received = (await anyio.Path(part_path).stat()).st_size if await anyio.Path(part_path).exists() else 0
+    if start != received:
+        raise HTTPException(status_code=416, detail={
+            "message": f"Expected chunk starting at byte {received}",
+            "received": received
+        })
+
+    # The body may not be larger than the range it claims to be
+    limit = end + 1 if content_range is not None else max_upload_bytes
+    mode = "ab" if start else "wb"
+    received = await stream_to_file(request.stream(), part_path, mode, start, limit)
+
+    if total is not None and received < total:
+        return {"message": "Chunk received", "received": received, "total": total}
+
+    clip = await store_clip(part_path, device_id, filename, start_time, node_id)
+    logger.info(f"Saved audio file from: {device_id} as {filename} ({received} bytes, clip {clip['clip_id']})")
+    return upload_response(clip)
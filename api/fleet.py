@@ -0,0 +1,35 @@
+from fastapi import APIRouter, HTTPException, UploadFile, File
+from pydantic import ValidationError
+from models.fleet import FleetManifest
+import services.fleet as fleet_service
+
+router = APIRouter(prefix="/api/fleet")
+
+
+@router.post("/provision")
+async def provision_fleet(manifest: FleetManifest):
+    # Configure and add all gateways in the manifest at the same time
+    job = await fleet_service.start_provisioning(manifest)
+    return {"job_id": job.job_id, "gateways": len(manifest.gateways)}
+
+@router.post("/provision/upload")
+async def provision_fleet_from_file(file: UploadFile = File(...)):
+    # Same as /provision, with the manifest uploaded as a YAML, JSON or CSV file
+    try:
+        manifest = fleet_service.parse_manifest(await file.read(), file.filename or "")
+    except (ValueError, ValidationError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid manifest: {str(e)}")
+
+    job = await fleet_service.start_provisioning(manifest)
+    return {"job_id": job.job_id, "gateways": len(manifest.gateways)}
+
+@router.get("/jobs")
+async def get_jobs():
+    return await fleet_service.get_jobs()
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await fleet_service.get_job(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
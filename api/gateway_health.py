@@ -0,0 +1,17 @@
+from fastapi import APIRouter, HTTPException
+from services.gateway_health import gateway_health_monitor
+
+router = APIRouter(prefix="/api/gateway_health")
+
+
+@router.get("")
+async def get_all_health():
+    # State, latency and probe history of every gateway
+    return gateway_health_monitor.get_all_health()
+
+@router.get("/{node_id}")
+async def get_health(node_id: str):
+    health = gateway_health_monitor.get_health(node_id)
+    if health is None:
+        raise HTTPException(status_code=404, detail=f"Node {node_id} is not probed")
+    return health
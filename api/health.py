@@ -0,0 +1,28 @@
+from fastapi import APIRouter
+from fastapi.responses import JSONResponse
+from services.startup import startup
+
+router = APIRouter(prefix="/api/health")
+
+
+@router.get("")
+async def get_health():
+    # 200 once the database is ready, 503 while the manager is still starting.
+    # Also returns how long each startup step took
+    return JSONResponse(startup.get_status(), status_code=200 if startup.db_ready else 503)
+
+
+class DatabaseReadyMiddleware:
+    # The API needs the database, so until it is ready the API requests are answered with 503 at once
+    # instead of waiting for a database connection. The pages and /metrics are served as usual.
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or startup.db_ready or not scope["path"].startswith("/api/")
+                or scope["path"].startswith("/api/health")):
+            await self.app(scope, receive, send)
+            return
+        response = JSONResponse({"detail": "The database is not ready yet", **startup.get_status()},
+                                status_code=503, headers={"Retry-After": "5"})
+        await response(scope, receive, send)
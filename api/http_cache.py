@@ -0,0 +1,63 @@
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+from typing import Any, Awaitable, Callable
+import time
+import os
+
+# Responses of the polled read APIs are cached for a short time and tagged with the version of the data
+# they were built from, so unchanged data is answered without touching the database
+cache_ttl = float(os.getenv("HTTP_CACHE_TTL", "2"))
+max_entries = 1000
+
+
+class ResponseCache:
+    # Encoded JSON bodies per URL, valid while their version is unchanged and for at most ttl seconds
+    def __init__(self, ttl: float, max_entries: int):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # path and query -> (version, created, body)
+        self.entries: dict[str, tuple[str | None, float, bytes]] = {}
+
+    def get(self, key: str, version: str | None) -> bytes | None:
+        entry = self.entries.get(key)
+        if entry is None:
+            return None
+        entry_version, created, body = entry
+        if entry_version != version or time.monotonic() - created > self.ttl:
+            return None
+        return body
+
+    def set(self, key: str, version: str | None, body: bytes):
+        self.entries.pop(key, None)
+        self.entries[key] = (version, time.monotonic(), body)
+        while len(self.entries) > self.max_entries:
+            # Oldest entry first
+            self.entries.pop(next(iter(self.entries)))
+
+
+response_cache = ResponseCache(cache_ttl, max_entries)
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    if_none_match = request.headers.get("if-none-match")
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+async def cached_json_response(request: Request, version: str | None,
+                               load: Callable[[], Awaitable[Any]]) -> Response:
+    # version is None when changes to the data are not tracked, the response is then only cached for the TTL
+    headers = {"Cache-Control": "no-cache"}
+    if version is not None:
+        etag = headers["ETag"] = f'W/"{version}"'
+        if etag_matches(request, etag):
+            return Response(status_code=304, headers=headers)
+
+    key = f"{request.url.path}?{request.url.query}"
+    body = response_cache.get(key, version)
+    if body is None:
+        body = JSONResponse(jsonable_encoder(await load())).body
+        response_cache.set(key, version, body)
+    return Response(content=body, media_type="application/json", headers=headers)
@@ -0,0 +1,28 @@
+from fastapi import APIRouter, HTTPException
+from models.ingest import TelemetrySample
+from db.telemetry_ingest import telemetry_ingest, IngestBackpressureError
+from db.schema_registry import schema_registry
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/api/ingest")
+
+
+@router.post("/{group_id}")
+async def ingest_samples(group_id: str, samples: list[TelemetrySample]):
+    # Buffer the samples for the group table, they are written in batches in the background
+    if not await schema_registry.group_table_exists(group_id):
+        raise HTTPException(status_code=404, detail=f"No table exists for group {group_id}")
+
+    try:
+        await telemetry_ingest.add_samples(group_id, samples)
+    except IngestBackpressureError as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+    return {"status": "accepted", "rows": len(samples)}
+
+@router.get("/metrics")
+async def get_ingest_metrics():
+    return telemetry_ingest.get_metrics()
@@ -1,12 +1,9 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.params import Depends
-from sqlalchemy.orm import Session
-from db.db_session import get_db
-from db.db_operations import get_all_nodes, get_latest_node_state
-from models.add_nodes import Trigger
-import db.db_operations as db_op
+from fastapi import APIRouter, HTTPException, Request, Query
+from typing import Literal
 from pydantic import BaseModel
 from models.manage_nodes import AddDeviceSchema
+import services.nodes as nodes_service
+from api.http_cache import cached_json_response
 import logging
 
 # Set up logging
@@ -49,15 +46,38 @@ class DeviceServiceTestParameters(BaseModel):
 router = APIRouter(prefix="/api/manage_nodes")
 
 @router.get("/get_all_nodes")
-async def get_all_nodes_info(db: Session = Depends(get_db)):
+async def get_all_nodes_info(request: Request,
+                             limit: int = Query(nodes_service.default_page_size, ge=1,
+                                                le=nodes_service.max_page_size),
+                             cursor: str | None = None,
+                             group_id: str | None = None,
+                             state: Literal["online", "offline", "unknown"] | None = None,
+                             app_service: str | None = None,
+                             search: str | None = None):
     #Get all nodes from the database
-
-    return get_all_nodes(db)
+    # A page of nodes ordered by node_id, pass next_cursor as cursor to get the next page
+    # Unchanged nodes are answered with 304 or from cache
+    if cursor:
+        try:
+            nodes_service.decode_cursor(cursor)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    return await cached_json_response(
+        request, nodes_service.get_nodes_version(state),
+        lambda: nodes_service.get_nodes(limit, cursor, group_id, state, app_service, search)
+    )
+
+@router.get("/node_filters")
+async def get_node_filters():
+    # Groups and app services the nodes can be filtered on
+    return await nodes_service.get_node_filter_options()
 
 @router.get("/get_node_state")
-async def get_node_state(db: Session = Depends(get_db)):
+async def get_node_state(request: Request):
     # Get the latest state of the nodes
-    return get_latest_node_state(db)
+    return await cached_json_response(request, nodes_service.get_node_states_version(),
+                                      nodes_service.get_node_states)
 
 @router.post("/activate_device_service")
 async def activate_device_service():
@@ -68,44 +88,19 @@ async def activate_device_service():
 
 
 @router.get("/{node_id}")
-async def get_node_details(node_id: str, db: Session = Depends(get_db)):
+async def get_node_details(node_id: str, request: Request):
     try:
-        #logger.debug(f"Fetching data for node {node_id}")
-
-        node_data = db_op.get_specific_node(node_id, db)
-        #logger.debug(f"Node data: {node_data}")
-
-        device_data = db_op.get_device_data(node_id, db)
-        #logger.debug(f"Device data: {len(device_data)} devices")
-
-        triggers_data = db_op.get_triggers(node_id, db)
-        #logger.debug(f"Triggers data: {len(triggers_data)} triggers")
-
-        return {
-            "node_data": node_data,
-            "device_data": device_data,
-            "triggers_data": triggers_data
-        }
+        return await cached_json_response(request, nodes_service.get_node_details_version(),
+                                          lambda: nodes_service.get_node_details(node_id))
     except Exception as e:
         #logger.error(f"Error in get_node_details: {str(e)}", exc_info=True)
         raise HTTPException(status_code=500, detail=str(e))
 
 
 @router.post("/add_devicedata_db")
-async def add_devicedata_db(request: AddDeviceSchema, db: Session = Depends(get_db)):
+async def add_devicedata_db(request: AddDeviceSchema):
     try:
-        with db.begin():  # Transaction context manager
-            #Add to edge_nodes
-            db_op.add_device_to_node(request.device_data.node_id, request.device_data.device_id, db)
-
-            #Add to devices
-            db_op.insert_device_data(request.device_data.model_dump(), db)
-
-            #Bulk insert triggers
-            trigger_dicts = [trigger.model_dump() for trigger in request.triggers]
-            db.execute(Trigger.__table__.insert(), trigger_dicts)
-
-        return {"status": "success"}
+        return await nodes_service.add_device(request)
 
     except ValueError as e:
         raise HTTPException(status_code=400, detail={
@@ -120,11 +115,11 @@ async def add_devicedata_db(request: AddDeviceSchema, db: Session = Depends(get_
         })
 
 @router.post("/delete_node")
-async def delete_node(node_id: str, db: Session = Depends(get_db)):
+async def delete_node(node_id: str):
     #Delete the edge node and all its devices from the database
     #Remeber to delete triggers from triggers table
     try:
-        status = db_op.delete_node(node_id, db)
+        status = await nodes_service.delete_node(node_id)
 
         return status
 
@@ -132,10 +127,10 @@ async def delete_node(node_id: str, db: Session = Depends(get_db)):
         raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/delete_device")
-async def delete_device(node_id:str, device_id: str, db: Session = Depends(get_db)):
+async def delete_device(node_id:str, device_id: str):
     # Delete a specific device on an edge node and its triggers
     try:
-        status = db_op.delete_device(device_id, node_id, db)
+        status = await nodes_service.delete_device(node_id, device_id)
 
         return status
 
@@ -0,0 +1,77 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from services.metrics import metrics, http_request_duration, http_requests_in_progress
+import time
+
+# Not under /api, Prometheus scrapes /metrics by default
+router = APIRouter()
+
+
+@router.get("/metrics", include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+def get_router_name(scope) -> str:
+    # Name of the API router from the matched route (/api/manage_nodes/{node_id} -> manage_nodes),
+    # so unknown paths do not add labels
+    route = scope.get("route")
+    path = getattr(route, "path", None)
+    if path is None:
+        return "unmatched"
+    parts = path.split("/")
+    if len(parts) > 2 and parts[1] == "api":
+        return parts[2]
+    return "metrics" if path == "/metrics" else "ui"
+
+def get_router_names(app) -> set[str]:
+    # Names of the API routers of the app, the labels a request can have before its route is matched
+    names = set()
+    for route in getattr(app, "routes", []):
+        parts = getattr(route, "path", "").split("/")
+        if len(parts) > 2 and parts[1] == "api":
+            names.add(parts[2])
+    return names
+
+
+class MetricsMiddleware:
+    # Latency of the API requests per router, until the last byte of the response is sent
+    def __init__(self, app):
+        self.app = app
+        # Filled on the first request, the routers are included after the middleware is added
+        self.router_names: set[str] | None = None
+
+    def get_prefix(self, scope) -> str:
+        # Router of the path by its prefix, the route is only matched inside the app
+        if not scope["path"].startswith("/api/"):
+            return "metrics"
+        if self.router_names is None:
+            self.router_names = get_router_names(scope.get("app"))
+        prefix = scope["path"].split("/")[2]
+        return prefix if prefix in self.router_names else "unmatched"
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(("/api/", "/metrics")):
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+        prefix = self.get_prefix(scope)
+        in_progress = http_requests_in_progress.values
+        in_progress[(prefix,)] = in_progress.get((prefix,), 0) + 1
+
+        async def send_with_status(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            in_progress[(prefix,)] -= 1
+            if not in_progress[(prefix,)]:
+                del in_progress[(prefix,)]
+            http_request_duration.observe(time.perf_counter() - start, get_router_name(scope), scope["method"],
+                                          str(status_code))
@@ -0,0 +1,32 @@
+from fastapi import APIRouter, HTTPException
+from models.storage import StoragePolicy
+from db.storage_policies import StoragePolicyError
+import services.storage as storage_service
+
+router = APIRouter(prefix="/api/storage")
+
+
+@router.get("/groups")
+async def get_storage_overview():
+    # Size, chunks, compression ratio and policies of every group table
+    return await storage_service.get_storage_overview()
+
+@router.get("/groups/{group_id}")
+async def get_group_storage(group_id: str):
+    # Same as /groups for one group table, with the size and compression of every chunk
+    storage = await storage_service.get_group_storage(group_id)
+    if storage is None:
+        raise HTTPException(status_code=404, detail=f"Group {group_id} not found")
+    return storage
+
+@router.put("/groups/{group_id}/policy")
+async def set_storage_policy(group_id: str, policy: StoragePolicy):
+    # Replace the compression, retention and rollups of the group table, returns the applied policy
+    try:
+        return await storage_service.set_storage_policy(group_id, policy)
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except StoragePolicyError as e:
+        raise HTTPException(status_code=409, detail=str(e))
@@ -0,0 +1,151 @@
+# Benchmark of the latest state lookups as device_states grows.
+# Fills a copy of device_states (same columns, indexes and hypertable settings) with generated states, through
+# the trigger that keeps a copy of latest_device_state up to date, and times the lookups the manager runs and
+# the inserts after each step. Run from the repository root:
+#   python -m benchmarks.device_states_benchmark --sizes 1000000,10000000,100000000
+from sqlalchemy import MetaData, text
+from db.db_session import db_engine
+from db.timescale import chunk_interval, compress_after
+from db.latest_state import trigger_function, create_trigger
+from models.add_nodes import NodeState, LatestDeviceState
+import argparse
+import asyncio
+import statistics
+import time
+
+# Latest birth, death and state key lookups of a node and device, and the node listing, read from the copy of
+# latest_device_state that the trigger keeps up to date
+queries = {
+    "latest node state": """
+        SELECT time, state FROM {latest} WHERE node_id = 'node-0' AND device_id = '' AND state_key = ''
+    """,
+    "latest device state": """
+        SELECT time, state FROM {latest} WHERE node_id = 'node-0' AND device_id = 'device-0' AND state_key = ''
+    """,
+    "latest state key": """
+        SELECT time, state FROM {latest}
+        WHERE node_id = 'node-0' AND device_id = 'device-0' AND state_key = 'process_trigger'
+    """,
+    "all node states": """
+        SELECT node_id, time, state FROM {latest} WHERE device_id = '' AND state_key = ''
+    """,
+}
+
+# Generated states: one in every 1000 rows is a birth or death, the rest are state changes
+fill = """
+INSERT INTO {table} (time, node_id, device_id, message_type, state_key, state)
+SELECT
+    TIMESTAMPTZ '2020-01-01' + (n * INTERVAL '1 second'),
+    'node-' || (CASE WHEN n % 1000 <> 0 THEN n ELSE n / 1000 END % :nodes),
+    CASE WHEN n % 3000 = 0 THEN NULL ELSE 'device-' || ((n / :nodes) % :devices) END,
+    CASE WHEN n % 1000 <> 0 THEN 'STATE'
+         WHEN n % 3000 = 0 THEN (CASE WHEN (n / 3000) % 2 = 0 THEN 'NBIRTH' ELSE 'NDEATH' END)
+         WHEN (n / 1000) % 2 = 0 THEN 'DBIRTH' ELSE 'DDEATH' END,
+    CASE WHEN n % 1000 <> 0 THEN (CASE WHEN n % 4 < 2 THEN 'process_trigger' ELSE 'data_trigger' END) END,
+    CASE WHEN (n / 7) % 2 = 0 THEN 'True' ELSE 'False' END
+FROM generate_series(CAST(:start AS BIGINT), CAST(:stop AS BIGINT) - 1) n
+"""
+
+
+def get_latest_table_name(table_name: str) -> str:
+    return f"{table_name}_latest"
+
+async def create_table(table_name: str, compress: bool):
+    table = NodeState.__table__.to_metadata(MetaData(), name=table_name)
+    for index in table.indexes:
+        index.name = index.name.replace(NodeState.__tablename__, table_name)
+    latest_table_name = get_latest_table_name(table_name)
+    latest_table = LatestDeviceState.__table__.to_metadata(MetaData(), name=latest_table_name)
+
+    async with db_engine.begin() as conn:
+        await conn.run_sync(table.drop, checkfirst=True)
+        await conn.run_sync(latest_table.drop, checkfirst=True)
+        await conn.run_sync(table.create)
+        await conn.run_sync(latest_table.create)
+        # Same trigger as on device_states, writing to the copy of latest_device_state
+        await conn.exec_driver_sql(trigger_function.replace(LatestDeviceState.__tablename__, latest_table_name))
+        await conn.exec_driver_sql(create_trigger.replace(LatestDeviceState.__tablename__, latest_table_name)
+                                   .replace(f"ON {NodeState.__tablename__}", f"ON {table_name}"))
+        timescaledb = await conn.scalar(text("SELECT true FROM pg_extension WHERE extname = 'timescaledb'"))
+        if timescaledb:
+            await conn.execute(text(
+                "SELECT create_hypertable(:table_name, 'time', chunk_time_interval => CAST(:chunk_interval AS INTERVAL))"
+            ).bindparams(table_name=table_name, chunk_interval=chunk_interval))
+            if compress:
+                # Same settings as setup_device_states
+                await conn.exec_driver_sql(
+                    f"ALTER TABLE {table_name} SET (timescaledb.compress, timescaledb.compress_segmentby = "
+                    f"'node_id, device_id', timescaledb.compress_orderby = 'time DESC')"
+                )
+    return bool(timescaledb)
+
+async def compress_chunks(table_name: str):
+    # Compress the chunks older than the compression policy, like the policy job would
+    async with db_engine.begin() as conn:
+        await conn.execute(text(
+            "SELECT compress_chunk(chunk, if_not_compressed => TRUE) "
+            "FROM show_chunks(:table_name, older_than => now() - CAST(:compress_after AS INTERVAL)) chunk"
+        ).bindparams(table_name=table_name, compress_after=compress_after))
+
+async def time_query(query: str, repeats: int) -> float:
+    timings = []
+    async with db_engine.connect() as conn:
+        for _ in range(repeats):
+            start = time.perf_counter()
+            await conn.execute(text(query))
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings) * 1000
+
+async def main():
+    parser = argparse.ArgumentParser(description="Latest state lookups as device_states grows")
+    parser.add_argument("--sizes", default="100000,1000000,10000000",
+                        help="Comma separated row counts to measure at")
+    parser.add_argument("--nodes", type=int, default=50)
+    parser.add_argument("--devices", type=int, default=4)
+    parser.add_argument("--batch", type=int, default=1000000, help="Rows inserted per statement")
+    parser.add_argument("--repeats", type=int, default=50)
+    parser.add_argument("--compress", action="store_true", help="Compress old chunks before measuring")
+    parser.add_argument("--table", default="device_states_benchmark")
+    parser.add_argument("--keep", action="store_true", help="Keep the table afterwards")
+    args = parser.parse_args()
+
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    timescaledb = await create_table(args.table, args.compress)
+    print(f"Table {args.table} ({'hypertable' if timescaledb else 'plain table'})")
+    print(f"{'rows':>12} {'inserts/s':>12} " + " ".join(f"{name:>22}" for name in queries))
+
+    rows = 0
+    try:
+        for size in sizes:
+            inserted, insert_time = size - rows, 0.0
+            while rows < size:
+                start = time.perf_counter()
+                stop = min(size, rows + args.batch)
+                async with db_engine.begin() as conn:
+                    await conn.execute(text(fill.format(table=args.table)).bindparams(
+                        nodes=args.nodes, devices=args.devices, start=rows, stop=stop
+                    ))
+                insert_time += time.perf_counter() - start
+                rows = stop
+
+            async with db_engine.begin() as conn:
+                await conn.exec_driver_sql(f"ANALYZE {args.table}")
+                await conn.exec_driver_sql(f"ANALYZE {get_latest_table_name(args.table)}")
+            if args.compress and timescaledb:
+                await compress_chunks(args.table)
+
+            latest_table_name = get_latest_table_name(args.table)
+            timings = [await time_query(query.format(latest=latest_table_name), args.repeats)
+                       for query in queries.values()]
+            print(f"{rows:>12} {inserted / insert_time:>12.0f} " + " ".join(f"{timing:>19.3f} ms" for timing in timings))
+    finally:
+        if not args.keep:
+            async with db_engine.begin() as conn:
+                await conn.exec_driver_sql(f"DROP TABLE IF EXISTS {args.table}")
+                await conn.exec_driver_sql(f"DROP TABLE IF EXISTS {get_latest_table_name(args.table)}")
+                await conn.exec_driver_sql(f"DROP FUNCTION IF EXISTS update_{get_latest_table_name(args.table)}()")
+        await db_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
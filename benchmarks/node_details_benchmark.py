@@ -0,0 +1,88 @@
+# Benchmark of the node details behind GET /api/manage_nodes/{node_id} and the node page.
+# Adds a node with many devices and triggers, times the single statement against the separate
+# node, device and trigger queries, and removes the node again. Run from the repository root:
+#   python -m benchmarks.node_details_benchmark --devices 20 --triggers 500
+from sqlalchemy import delete
+from db.db_session import db_SessionLocal, db_engine
+from models.add_nodes import EdgeNode, DeviceData, Trigger
+import db.db_operations as db_op
+import argparse
+import asyncio
+import statistics
+import time
+
+node_id = "benchmark-node"
+
+
+async def add_node(devices: int, triggers: int):
+    async with db_SessionLocal() as db:
+        async with db.begin():
+            db.add(EdgeNode(node_id=node_id, group_id="benchmark", ip="127.0.0.1", app_services=["MQTT"],
+                            device_services=[f"device-{i}" for i in range(devices)]))
+            db.add_all(DeviceData(group_id="benchmark", node_id=node_id, device_id=f"device-{i}",
+                                  protocol_type="S7Comm", device_ip="127.0.0.1", device_port=102)
+                       for i in range(devices))
+            await db.execute(Trigger.__table__.insert(), [{
+                "trigger_type": "data_trigger",
+                "node_id": node_id,
+                "device_id": f"device-{i % devices}",
+                "topic": f"spBv1.0/benchmark/DDATA/{node_id}/device-{i % devices}",
+                "source": {"db": 1, "offset": i, "datatype": "Bool"},
+                "condition": "True"
+            } for i in range(triggers)])
+
+async def remove_node():
+    async with db_SessionLocal() as db:
+        async with db.begin():
+            await db.execute(delete(Trigger).where(Trigger.node_id == node_id))
+            await db.execute(delete(DeviceData).where(DeviceData.node_id == node_id))
+            await db.execute(delete(EdgeNode).where(EdgeNode.node_id == node_id))
+
+async def single_statement():
+    async with db_SessionLocal() as db:
+        return await db_op.get_node_details(node_id, db)
+
+async def separate_queries():
+    # The node details as they were loaded before the single statement
+    async with db_SessionLocal() as db:
+        node = await db_op.get_specific_node(node_id, db)
+        return {
+            "node_data": node.node_id,
+            "device_data": await db_op.get_device_data(node_id, db),
+            "triggers_data": await db_op.get_triggers(node_id, db)
+        }
+
+async def measure(load, repeats: int) -> tuple[float, float]:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        await load()
+        timings.append((time.perf_counter() - start) * 1000)
+    timings.sort()
+    return statistics.median(timings), timings[int(len(timings) * 0.99) - 1]
+
+async def main():
+    parser = argparse.ArgumentParser(description="Node details load time")
+    parser.add_argument("--devices", type=int, default=20)
+    parser.add_argument("--triggers", type=int, default=500)
+    parser.add_argument("--repeats", type=int, default=500)
+    args = parser.parse_args()
+
+    await remove_node()
+    await add_node(args.devices, args.triggers)
+    try:
+        # Warm up the pool and the statement caches
+        await single_statement()
+        await separate_queries()
+
+        print(f"Node with {args.devices} devices and {args.triggers} triggers, {args.repeats} loads")
+        for name, load in (("single statement", single_statement), ("separate queries", separate_queries)):
+            p50, p99 = await measure(load, args.repeats)
+            print(f"{name:>18}: p50 {p50:.2f} ms, p99 {p99:.2f} ms")
+    finally:
+        await remove_node()
+        await db_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
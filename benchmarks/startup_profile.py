@@ -0,0 +1,54 @@
+# Import time profile of the manager. Imports main in a new interpreter with -X importtime and adds up
+# the time per top level package, and per module of this repository. Run from the repository root:
+#   python -m benchmarks.startup_profile --top 15
+from collections import defaultdict
+from pathlib import Path
+import argparse
+import subprocess
+import sys
+
+repository_packages = ("main", "api", "db", "models", "pages", "services")
+
+
+def run_importtime() -> list[tuple[str, int, int]]:
+    # (module, self microseconds, cumulative microseconds) of every import, in import order
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import main"],
+                            capture_output=True, text=True, cwd=Path(__file__).resolve().parent.parent)
+    if result.returncode != 0:
+        raise SystemExit(f"Importing main failed:\n{result.stderr[-2000:]}")
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_time, cumulative, module = line.removeprefix("import time:").split("|")
+        imports.append((module.strip(), int(self_time), int(cumulative)))
+    return imports
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--top", type=int, default=15, help="Packages and modules to show")
+    args = parser.parse_args()
+
+    imports = run_importtime()
+    total = next(cumulative for module, _, cumulative in imports if module == "main")
+
+    # Self time per top level package, so the time of a package includes the packages it pulls in only once
+    packages = defaultdict(int)
+    for module, self_time, _ in imports:
+        packages[module.split(".")[0]] += self_time
+
+    print(f"Importing main takes {total / 1000:.0f} ms ({len(imports)} modules)\n")
+    print(f"{'Package':<30} {'ms':>8} {'share':>7}")
+    for package, self_time in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"{package:<30} {self_time / 1000:>8.1f} {self_time / total:>7.1%}")
+
+    own = sum(self_time for package, self_time in packages.items() if package in repository_packages)
+    print(f"\nModules of this repository: {own / 1000:.1f} ms ({own / total:.1%}), slowest:")
+    own_modules = [(module, self_time) for module, self_time, _ in imports
+                   if module.split(".")[0] in repository_packages]
+    for module, self_time in sorted(own_modules, key=lambda item: item[1], reverse=True)[:args.top]:
+        print(f"  {module:<38} {self_time / 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+# Benchmark of the storage layouts of the group tables (jsonb, typed and narrow, see db/storage_layout.py).
+# Fills one table per layout with the same generated Real, Int and Bool samples, inserted through metric_value
+# like the gateways do, and reports the insert time, the table size (optionally after compression) and the
+# time of the downsampled queries behind /api/data. Run from the repository root:
+#   python -m benchmarks.storage_layout_benchmark --samples 10000000 --compress
+from sqlalchemy import text
+from db.db_session import db_engine
+from db.storage_layout import storage_layouts, create_group_table, quote_identifier
+from db.timescale import chunk_interval
+import services.data as data_service
+import argparse
+import asyncio
+import statistics
+import time
+
+# Generated samples, every device has a Real, an Int and a Bool variable sampled once per second
+fill = """
+INSERT INTO {table} (time, device_id, sensor_id, metric_value)
+SELECT
+    TIMESTAMPTZ '2020-01-01' + ((n / (:devices * 3)) * INTERVAL '1 second'),
+    'device-' || ((n / 3) % :devices),
+    CASE n % 3 WHEN 0 THEN 'temperature' WHEN 1 THEN 'counter' ELSE 'running' END,
+    CASE n % 3
+        WHEN 0 THEN to_jsonb(round((20 + 5 * sin(n / 1000.0))::numeric, 3))
+        WHEN 1 THEN to_jsonb(n / 100)
+        ELSE to_jsonb((n / 7000) % 2 = 0)
+    END
+FROM generate_series(CAST(:start AS BIGINT), CAST(:stop AS BIGINT) - 1) n
+"""
+
+
+async def create_table(table_name: str, layout: str, compress: bool) -> bool:
+    async with db_engine.begin() as conn:
+        await conn.exec_driver_sql(f"DROP TABLE IF EXISTS {quote_identifier(table_name)}")
+        await create_group_table(conn, table_name, layout)
+        timescaledb = await conn.scalar(text("SELECT true FROM pg_extension WHERE extname = 'timescaledb'"))
+        if timescaledb:
+            await conn.execute(text(
+                "SELECT create_hypertable(:table_name, 'time', chunk_time_interval => CAST(:chunk_interval AS INTERVAL))"
+            ).bindparams(table_name=table_name, chunk_interval=chunk_interval))
+            if compress:
+                await conn.exec_driver_sql(
+                    f"ALTER TABLE {quote_identifier(table_name)} SET (timescaledb.compress, "
+                    f"timescaledb.compress_segmentby = 'device_id, sensor_id', "
+                    f"timescaledb.compress_orderby = 'time DESC')"
+                )
+    return bool(timescaledb)
+
+async def get_table_size(table_name: str, timescaledb: bool) -> tuple[int, int]:
+    # Size of the rows and of the indexes, for a hypertable including the chunks and their compressed copies
+    if timescaledb:
+        query = "SELECT table_bytes + coalesce(toast_bytes, 0), index_bytes FROM hypertable_detailed_size(:table_name)"
+    else:
+        query = "SELECT pg_table_size(:table_name), pg_indexes_size(:table_name)"
+    async with db_engine.connect() as conn:
+        return (await conn.execute(text(query).bindparams(table_name=table_name))).one()
+
+async def compress_chunks(table_name: str):
+    async with db_engine.begin() as conn:
+        await conn.execute(text(
+            "SELECT compress_chunk(chunk, if_not_compressed => TRUE) FROM show_chunks(:table_name) chunk"
+        ).bindparams(table_name=table_name))
+
+async def time_series_query(table_name: str, layout: str, sensor_ids: list[str] | None, start, end,
+                            repeats: int) -> float:
+    # The query of /api/data for one device, downsampled to the default number of points
+    timings = []
+    async with db_engine.connect() as conn:
+        function = "time_bucket" if await conn.scalar(text(
+            "SELECT true FROM pg_extension WHERE extname = 'timescaledb'"
+        )) else "date_bin"
+        stmt = data_service.series_stmt(table_name, function, sensor_ids, layout).bindparams(
+            bucket_width=data_service.get_bucket_width(start, end, data_service.default_points),
+            start=start, end=end, device_id="device-0"
+        )
+        for _ in range(repeats):
+            begin = time.perf_counter()
+            await conn.execute(stmt)
+            timings.append(time.perf_counter() - begin)
+    return statistics.median(timings) * 1000
+
+async def main():
+    parser = argparse.ArgumentParser(description="Size and query time of the group table storage layouts")
+    parser.add_argument("--samples", type=int, default=3000000)
+    parser.add_argument("--devices", type=int, default=10)
+    parser.add_argument("--batch", type=int, default=1000000, help="Samples inserted per statement")
+    parser.add_argument("--repeats", type=int, default=20)
+    parser.add_argument("--compress", action="store_true", help="Compress all chunks before measuring")
+    parser.add_argument("--layouts", default=",".join(storage_layouts))
+    parser.add_argument("--keep", action="store_true", help="Keep the tables afterwards")
+    args = parser.parse_args()
+
+    layouts = args.layouts.split(",")
+    tables = {layout: f"storage_benchmark_{layout}" for layout in layouts}
+    # The generated samples cover this range, the queries read all of it
+    async with db_engine.connect() as conn:
+        start, end = (await conn.execute(text(
+            "SELECT TIMESTAMPTZ '2020-01-01', TIMESTAMPTZ '2020-01-01' + CAST(:seconds AS BIGINT) * INTERVAL '1 second'"
+        ).bindparams(seconds=args.samples // (args.devices * 3) + 1))).one()
+
+    print(f"{args.samples} samples of {args.devices} devices from {start} to {end}")
+    print(f"{'layout':>8} {'insert':>12} {'rows':>12} {'indexes':>12} {'bytes/sample':>13} "
+          f"{'one sensor':>12} {'all sensors':>12}")
+    try:
+        for layout in layouts:
+            table_name = tables[layout]
+            timescaledb = await create_table(table_name, layout, args.compress)
+
+            insert_start = time.perf_counter()
+            for batch_start in range(0, args.samples, args.batch):
+                async with db_engine.begin() as conn:
+                    await conn.execute(text(fill.format(table=quote_identifier(table_name))).bindparams(
+                        devices=args.devices, start=batch_start, stop=min(args.samples, batch_start + args.batch)
+                    ))
+            insert_seconds = time.perf_counter() - insert_start
+
+            if args.compress and timescaledb:
+                await compress_chunks(table_name)
+            async with db_engine.begin() as conn:
+                await conn.exec_driver_sql(f"ANALYZE {quote_identifier(table_name)}")
+            row_bytes, index_bytes = await get_table_size(table_name, timescaledb)
+
+            one_sensor = await time_series_query(table_name, layout, ["temperature"], start, end, args.repeats)
+            all_sensors = await time_series_query(table_name, layout, None, start, end, args.repeats)
+            print(f"{layout:>8} {insert_seconds:>10.2f} s {row_bytes / 2 ** 20:>9.1f} MB {index_bytes / 2 ** 20:>9.1f} MB "
+                  f"{(row_bytes + index_bytes) / args.samples:>13.1f} "
+                  f"{one_sensor:>9.1f} ms {all_sensors:>9.1f} ms")
+    finally:
+        if not args.keep:
+            async with db_engine.begin() as conn:
+                for table_name in tables.values():
+                    await conn.exec_driver_sql(f"DROP TABLE IF EXISTS {quote_identifier(table_name)}")
+        await db_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
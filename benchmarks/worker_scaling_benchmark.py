@@ -0,0 +1,184 @@
+# Load test of the API worker processes. Starts the API with MANAGER_ROLE=api and 1, 2, 4... uvicorn workers,
+# sends the polled read APIs and audio uploads from several client processes and compares the throughput per
+# worker count. Every upload is the same clip, so only the first one is stored and the audio store does not fill
+# up; the benchmark clip is removed again at the end. The client processes need CPU as well, so measure on a
+# machine with more cores than workers plus clients. Run from the repository root:
+#   python -m benchmarks.worker_scaling_benchmark --workers 1 2 4 --clients 4 --duration 20
+from sqlalchemy import select, delete
+from db.db_session import db_SessionLocal, db_engine
+from models.add_nodes import AudioClip
+from services.audio import get_clip_path
+from pathlib import Path
+import multiprocessing
+import subprocess
+import argparse
+import statistics
+import asyncio
+import logging
+import random
+import struct
+import wave
+import time
+import sys
+import io
+import os
+import httpx
+
+device_id = "benchmark-device"
+upload_path = "/api/data_saver/upload_audio"
+read_paths = ("/api/manage_nodes/get_all_nodes", "/api/manage_nodes/get_node_state", "/api/dashboard/status",
+              "/api/audio/clips?limit=100")
+scenarios = ("read", "upload")
+
+# httpx logs every request at the level set up by the imported modules
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def make_clip(seconds: float) -> bytes:
+    # Mono 16 kHz 16 bit WAV with noise
+    samples = int(16000 * seconds)
+    buffer = io.BytesIO()
+    with wave.open(buffer, "wb") as clip:
+        clip.setnchannels(1)
+        clip.setsampwidth(2)
+        clip.setframerate(16000)
+        clip.writeframes(struct.pack(f"<{samples}h", *(random.randint(-3000, 3000) for _ in range(samples))))
+    return buffer.getvalue()
+
+def start_api(workers: int, port: int, env: list[str]) -> subprocess.Popen:
+    process_env = dict(os.environ, MANAGER_ROLE="api", **dict(variable.split("=", 1) for variable in env))
+    return subprocess.Popen([sys.executable, "-m", "uvicorn", "main:app", "--port", str(port),
+                             "--workers", str(workers), "--log-level", "warning"],
+                            cwd=Path(__file__).resolve().parent.parent, env=process_env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+def stop_api(process: subprocess.Popen):
+    process.terminate()
+    try:
+        process.wait(timeout=20)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.wait()
+
+def wait_for_workers(port: int, workers: int, timeout: float, process: subprocess.Popen) -> bool:
+    # Every worker answers /api/health with its pid once its database is ready. A new connection
+    # each time, so the requests are spread over the workers.
+    pids = set()
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline and process.poll() is None:
+        try:
+            response = httpx.get(f"http://127.0.0.1:{port}/api/health", timeout=1.0)
+            if response.status_code == 200:
+                pids.add(response.json()["pid"])
+                if len(pids) >= workers:
+                    return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.02)
+    return False
+
+async def send_requests(base_url: str, scenario: str, connections: int, duration: float,
+                        clip: bytes) -> tuple[list[float], int]:
+    latencies, errors = [], 0
+    deadline = time.perf_counter() + duration
+
+    async def connection(client: httpx.AsyncClient, index: int):
+        nonlocal errors
+        sent = 0
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                if scenario == "upload":
+                    response = await client.post(upload_path, data={"device_id": device_id},
+                                                 files={"file": ("benchmark.wav", clip, "audio/wav")})
+                else:
+                    response = await client.get(read_paths[(index + sent) % len(read_paths)])
+                ok = response.status_code == 200
+            except httpx.HTTPError:
+                ok = False
+            sent += 1
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=connections, max_keepalive_connections=connections)
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=30.0) as client:
+        await asyncio.gather(*(connection(client, index) for index in range(connections)))
+    return latencies, errors
+
+def run_client(base_url: str, scenario: str, connections: int, duration: float, clip: bytes):
+    return asyncio.run(send_requests(base_url, scenario, connections, duration, clip))
+
+def run_load(port: int, scenario: str, clients: int, connections: int, duration: float,
+             clip: bytes) -> tuple[float, float, float, int]:
+    # Requests per second, p50 and p99 in ms, errors over all client processes
+    base_url = f"http://127.0.0.1:{port}"
+    with multiprocessing.get_context("spawn").Pool(clients) as pool:
+        results = pool.starmap(run_client, [(base_url, scenario, connections, duration, clip)] * clients)
+    latencies = sorted(latency for client_latencies, _ in results for latency in client_latencies)
+    errors = sum(client_errors for _, client_errors in results)
+    if not latencies:
+        return 0.0, 0.0, 0.0, errors
+    return (len(latencies) / duration, statistics.median(latencies) * 1000,
+            latencies[max(0, int(len(latencies) * 0.99) - 1)] * 1000, errors)
+
+async def remove_clips():
+    # Remove the benchmark clip from the catalog, and from the audio store when no other clip uses it
+    async with db_SessionLocal() as db:
+        async with db.begin():
+            clips = (await db.scalars(select(AudioClip).where(AudioClip.device_id == device_id))).all()
+            await db.execute(delete(AudioClip).where(AudioClip.device_id == device_id))
+        for clip in clips:
+            if await db.scalar(select(AudioClip.clip_id).where(AudioClip.sha256 == clip.sha256).limit(1)) is None:
+                get_clip_path(clip.sha256, clip.format).unlink(missing_ok=True)
+    await db_engine.dispose()
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, nargs="+", default=[1, 2, 4], help="Worker counts to compare")
+    parser.add_argument("--scenarios", nargs="+", choices=scenarios, default=list(scenarios))
+    parser.add_argument("--clients", type=int, default=os.cpu_count(), help="Client processes")
+    parser.add_argument("--connections", type=int, default=16, help="Connections per client process")
+    parser.add_argument("--duration", type=float, default=20, help="Seconds per worker count and scenario")
+    parser.add_argument("--warmup", type=float, default=3, help="Seconds of load before measuring")
+    parser.add_argument("--clip-seconds", type=float, default=5, help="Length of the uploaded clip")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--timeout", type=float, default=60, help="Seconds to wait for the workers")
+    parser.add_argument("--env", action="append", default=[], help="KEY=VALUE passed to the API, "
+                                                                    "for example DB_POOL_SIZE=5")
+    args = parser.parse_args()
+
+    clip = make_clip(args.clip_seconds)
+    print(f"{args.clients} client processes with {args.connections} connections each, {args.duration:.0f} s "
+          f"per run, {len(clip) // 1024} KiB clip on {os.cpu_count()} CPUs\n")
+    print(f"{'Workers':<8} {'Scenario':<9} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7} "
+          f"{'scaling':>8} {'per worker':>11}")
+
+    baseline = {}
+    try:
+        for workers in args.workers:
+            process = start_api(workers, args.port, args.env)
+            try:
+                if not wait_for_workers(args.port, workers, args.timeout, process):
+                    print(f"{workers:<8} the workers did not get ready within {args.timeout:.0f} s")
+                    continue
+                for scenario in args.scenarios:
+                    run_load(args.port, scenario, args.clients, args.connections, args.warmup, clip)
+                    rate, p50, p99, errors = run_load(args.port, scenario, args.clients, args.connections,
+                                                      args.duration, clip)
+                    # Throughput relative to the smallest worker count, and how much of it each worker adds
+                    first_workers, first_rate = baseline.setdefault(scenario, (workers, rate))
+                    scaling = rate / first_rate if first_rate else 0.0
+                    efficiency = scaling / (workers / first_workers)
+                    print(f"{workers:<8} {scenario:<9} {rate:>9.0f} {p50:>8.1f} {p99:>8.1f} {errors:>7} "
+                          f"{scaling:>7.2f}x {efficiency:>10.0%}")
+            finally:
+                stop_api(process)
+    finally:
+        if "upload" in args.scenarios:
+            asyncio.run(remove_clips())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+from collections import defaultdict
+from typing import Callable
+import secrets
+
+# Scopes of the data the read APIs are built from
+# Nodes, devices and triggers (edge_nodes, devices and triggers tables)
+NODES = "nodes"
+# Birth and death states of the nodes
+NODE_STATES = "node_states"
+# Birth and death states of the devices
+DEVICE_STATES = "device_states"
+
+
+class ChangeTracker:
+    # Version per scope, changed after every change made through the manager.
+    # Responses built from unchanged versions are still up to date, so they can be served from cache.
+    def __init__(self, shared_scopes: set[str]):
+        # Versions start with a random token, so a version of another process or of the time before a restart
+        # never matches a version of this process by accident
+        self.instance = secrets.token_hex(4)
+        self.counter = 0
+        self.versions: dict[str, str] = defaultdict(lambda: f"{self.instance}-0")
+        # Scopes changed through the API, which other processes of a multi-process deployment have to know about.
+        # The state scopes are followed by every process from the MQTT broker itself.
+        self.shared_scopes = shared_scopes
+        # Sends the new version of the shared scopes to the other processes, set by the pub/sub
+        self.forward: Callable[[list[str], str], None] | None = None
+
+    def bump(self, *scopes: str):
+        self.counter += 1
+        version = f"{self.instance}-{self.counter}"
+        for scope in scopes:
+            self.versions[scope] = version
+        shared = [scope for scope in scopes if scope in self.shared_scopes]
+        if shared and self.forward is not None:
+            self.forward(shared, version)
+
+    def apply(self, scopes: list[str], version: str):
+        # Version received from the pub/sub. Every process applies the changes in the order Postgres delivered
+        # them, its own included, so all processes end up with the same version
+        for scope in scopes:
+            self.versions[scope] = version
+
+    def get_version(self, *scopes: str) -> str:
+        return ".".join(self.versions[scope] for scope in scopes)
+
+
+change_tracker = ChangeTracker(shared_scopes={NODES})
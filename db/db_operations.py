@@ -1,9 +1,13 @@
-from sqlalchemy.orm import Session
-from sqlalchemy import inspect, select, MetaData, Table, desc, null, text
-from models.add_nodes import EdgeNode, Base, NodeConfig, NodeState, DeviceData, Trigger
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import inspect, select, delete, MetaData, Table, desc, null, text
+from models.add_nodes import EdgeNode, Base, NodeConfig, NodeState, DeviceData, Trigger, DeviceStateInterval, LatestDeviceState, AudioClip, ProvisioningJobRecord
+from db.state_intervals import create_state_interval_trigger
+from db.latest_state import create_latest_state_trigger
+from db.timescale import setup_device_states
+from db.schema_registry import schema_registry
+from db.change_tracking import change_tracker, NODES
 from models.manage_nodes import DeviceDataSchema
 from fastapi import HTTPException, status
-from db.db_session import db_engine
 from sqlalchemy import Column, String, TIMESTAMP, func
 from sqlalchemy.exc import SQLAlchemyError, IntegrityError
 from sqlalchemy.dialects.postgresql import JSONB
@@ -13,31 +17,70 @@ import logging
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.DEBUG)
 
-def check_database_tables(db:Session):
+async def check_database_tables(db: AsyncSession):
     # Check if all the necessary tables exist
-    inspector = inspect(db_engine)
-    tables_to_check = [EdgeNode, NodeState, DeviceData, Trigger]
-
-    # Get existing table names from the database
-    existing_tables = inspector.get_table_names()
-
-    for table_class in tables_to_check:
-        table_name = table_class.__tablename__
-        if table_name not in existing_tables:
-            try:
-                Base.metadata.create_all(bind=db.bind, tables=[table_class.__table__])
-                db.commit()
-            except SQLAlchemyError as e:
-                db.rollback()
-                raise HTTPException(
-                    status_code=500,
-                    detail=f"Failed to create {table_name} table: {str(e)}"
-                )
-
-def create_edge_node(db: Session, node_data: NodeConfig):
+    conn = await db.connection()
+    tables_to_check = [EdgeNode, NodeState, DeviceData, Trigger, DeviceStateInterval, LatestDeviceState, AudioClip,
+                       ProvisioningJobRecord]
+
+    # Get existing table names from the database, kept in the schema registry afterwards
+    await schema_registry.load(db)
+    existing_tables = set(schema_registry.tables)
+
+    # The missing tables are created together, in one transaction
+    missing_tables = [table_class.__table__ for table_class in tables_to_check
+                      if table_class.__tablename__ not in existing_tables]
+    if missing_tables:
+        try:
+            await conn.run_sync(Base.metadata.create_all, tables=missing_tables)
+            await db.commit()
+            for table in missing_tables:
+                schema_registry.add(table.name)
+        except SQLAlchemyError as e:
+            await db.rollback()
+            raise HTTPException(
+                status_code=500,
+                detail=f"Failed to create the tables {', '.join(table.name for table in missing_tables)}: {str(e)}"
+            )
+
+    # Indexes, hypertable and policies of device_states
+    try:
+        await setup_device_states(db)
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to set up the device_states table: {str(e)}"
+        )
+
+    # Keep device_state_intervals up to date with device_states
+    try:
+        await create_state_interval_trigger(
+            db, backfill_intervals=DeviceStateInterval.__tablename__ not in existing_tables
+        )
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to create the device_state_intervals trigger: {str(e)}"
+        )
+
+    # Keep latest_device_state up to date with device_states
+    try:
+        await create_latest_state_trigger(
+            db, backfill_states=LatestDeviceState.__tablename__ not in existing_tables
+        )
+    except SQLAlchemyError as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=500,
+            detail=f"Failed to create the latest_device_state trigger: {str(e)}"
+        )
+
+async def create_edge_node(db: AsyncSession, node_data: NodeConfig):
     # Create an edgenode
     # Check for duplicate node_id
-    if db.query(EdgeNode).filter(EdgeNode.node_id == node_data.node_id).first():
+    if await db.scalar(select(EdgeNode).where(EdgeNode.node_id == node_data.node_id)):
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Node ID {node_data.node_id} already exists"
@@ -45,32 +88,9 @@ def create_edge_node(db: Session, node_data: NodeConfig):
 
     try:
         # Create table for the group if needed
-        inspector = inspect(db_engine)
-        group_table_name = f"{node_data.group_id}"
-
-        if group_table_name not in inspector.get_table_names():
-            # Create a temporary metadata
-            temp_metadata = MetaData()
-
-            group_table = Table(
-                group_table_name,
-                temp_metadata,
-                Column("time", TIMESTAMP(timezone=True), primary_key=True),
-                Column("device_id", String, primary_key=True),
-                Column("sensor_id", String, primary_key=True),
-                Column("metric_value", JSONB)
-            )
-
-            # Create the table
-            temp_metadata.create_all(bind=db.bind)
-
-            # Convert to TimescaleDB hypertable
-            with db_engine.connect() as conn:
-                conn.execute(text(
-                    "SELECT create_hypertable(:table_name, 'time', if_not_exists => TRUE)"
-                ).bindparams(table_name=group_table_name))
-                conn.commit()
+        await schema_registry.ensure_group_table(db, node_data.group_id, node_data.storage_layout)
     except Exception as e:
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to create group table: {str(e)}")
 
     try:
@@ -84,17 +104,18 @@ def create_edge_node(db: Session, node_data: NodeConfig):
             app_services=node_data.app_services
         )
         db.add(db_node)
-        db.commit()
-        db.refresh(db_node)
+        await db.commit()
+        change_tracker.bump(NODES)
+        await db.refresh(db_node)
         return db_node
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(status_code=500, detail=f"Failed to create node: {str(e)}")
 
-def add_device_to_node(node_id: str,device: str,db: Session):
+async def add_device_to_node(node_id: str,device: str,db: AsyncSession):
     try:
-        node = db.get(EdgeNode, node_id)
+        node = await db.get(EdgeNode, node_id)
         if not node:
             raise ValueError(f"Node {node_id} not found")
 
@@ -111,57 +132,140 @@ def add_device_to_node(node_id: str,device: str,db: Session):
     except Exception as e:
         raise ValueError(f"Error adding device: {str(e)}") from e
 
-def get_all_nodes(db: Session):
-    # Get all nodes
-    # Select statement - Selecting the Edgenode model
-    stmt = select(EdgeNode)
+# Node states that can be filtered on, matched against the latest NBIRTH or NDEATH state
+node_state_filters = {"online": "True", "offline": "False"}
 
-    return list(db.scalars(stmt))
+async def get_all_nodes(db: AsyncSession, limit: int | None = None, after: str | None = None,
+                        group_id: str | None = None, state: str | None = None,
+                        app_service: str | None = None, search: str | None = None):
+    # Get all nodes, or a page of the nodes ordered by node_id starting after the node_id in after
+    # Select statement - Selecting the Edgenode model
+    stmt = select(EdgeNode).order_by(EdgeNode.node_id)
+
+    if after is not None:
+        stmt = stmt.where(EdgeNode.node_id > after)
+    if group_id:
+        stmt = stmt.where(EdgeNode.group_id == group_id)
+    if app_service:
+        stmt = stmt.where(EdgeNode.app_services.contains([app_service]))
+    if search:
+        stmt = stmt.where(
+            EdgeNode.node_id.icontains(search, autoescape=True) |
+            EdgeNode.group_id.icontains(search, autoescape=True) |
+            EdgeNode.ip.icontains(search, autoescape=True) |
+            EdgeNode.description.icontains(search, autoescape=True)
+        )
+    if state:
+        latest_state = (
+            select(LatestDeviceState.state)
+            .where(
+                (LatestDeviceState.node_id == EdgeNode.node_id) &
+                (LatestDeviceState.device_id == '') &
+                (LatestDeviceState.state_key == '')
+            )
+            .scalar_subquery()
+        )
+        if state in node_state_filters:
+            stmt = stmt.where(latest_state == node_state_filters[state])
+        else:
+            # Nodes without a known state
+            stmt = stmt.where(latest_state.is_(None) | latest_state.not_in(list(node_state_filters.values())))
+    if limit is not None:
+        stmt = stmt.limit(limit)
+
+    return list(await db.scalars(stmt))
+
+async def get_node_filter_options(db: AsyncSession):
+    # Groups and app services in use, to filter the nodes on
+    group_ids = await db.scalars(select(EdgeNode.group_id).distinct().order_by(EdgeNode.group_id))
+    app_services = await db.scalars(
+        select(func.unnest(EdgeNode.app_services).label("app_service")).distinct().order_by("app_service")
+    )
+    return {"group_ids": list(group_ids), "app_services": list(app_services)}
 
 
-def get_specific_node(node_id:str, db: Session):
+async def get_specific_node(node_id:str, db: AsyncSession):
     # Get specific node
     # Select statement - Selecting the Edgenode model
     stmt = select(EdgeNode).where(EdgeNode.node_id == node_id)
 
-    node = db.scalar(stmt)
+    node = await db.scalar(stmt)
 
     if not node:
         raise HTTPException(status_code=404, detail=f"Node not found")
     return node
 
-def get_latest_node_state(db: Session):
-    # Get each node latest statement from device_states
+async def get_latest_node_state(db: AsyncSession):
+    # Get each node latest NBIRTH or NDEATH state from latest_device_state
     stmt = (
         select(
-            NodeState.node_id,
-            NodeState.time,
-            NodeState.state
+            LatestDeviceState.node_id,
+            LatestDeviceState.time,
+            LatestDeviceState.state
         )
-        .where(NodeState.device_id.is_(None))  # Proper NULL check
-        .distinct(NodeState.node_id)  # Get one record per node
-        .order_by(
-            NodeState.node_id,
-            NodeState.time.desc()  # Most recent first
+        .where(
+            (LatestDeviceState.device_id == '') &
+            (LatestDeviceState.state_key == '')
         )
     )
-    latest_rows = db.execute(stmt)
+    latest_rows = await db.execute(stmt)
 
     result = {}
     for node_id, time, state in latest_rows:
         result[node_id] = {"time": time.timestamp(), "state": state}
     return result
 
-def insert_device_data(device_data: DeviceDataSchema, db: Session):
+async def get_latest_device_states(db: AsyncSession):
+    # Get each device latest DBIRTH or DDEATH state from latest_device_state
+    stmt = (
+        select(
+            LatestDeviceState.node_id,
+            LatestDeviceState.device_id,
+            LatestDeviceState.message_type,
+            LatestDeviceState.time,
+            LatestDeviceState.state
+        )
+        .where(
+            (LatestDeviceState.device_id != '') &
+            (LatestDeviceState.state_key == '')
+        )
+    )
+    latest_rows = await db.execute(stmt)
+
+    result = {}
+    for node_id, device_id, message_type, time, state in latest_rows:
+        result[(node_id, device_id)] = {"time": time.timestamp(), "state": state, "message_type": message_type}
+    return result
+
+async def get_latest_state_values(db: AsyncSession):
+    # Get the latest value of each state key (process_trigger, data_trigger, ...) from latest_device_state
+    stmt = (
+        select(
+            LatestDeviceState.node_id,
+            LatestDeviceState.device_id,
+            LatestDeviceState.state_key,
+            LatestDeviceState.time,
+            LatestDeviceState.state
+        )
+        .where(LatestDeviceState.state_key != '')
+    )
+    latest_rows = await db.execute(stmt)
+
+    result = {}
+    for node_id, device_id, state_key, time, state in latest_rows:
+        result[(node_id, device_id or None, state_key)] = {"time": time.timestamp(), "state": state}
+    return result
+
+async def insert_device_data(device_data: DeviceDataSchema, db: AsyncSession):
     try:
 
         # Check for existing device more efficiently
-        exists = db.query(DeviceData).filter(
+        exists = await db.scalar(select(DeviceData).where(
             DeviceData.group_id == device_data['group_id'],
             DeviceData.node_id == device_data['node_id'],
             DeviceData.device_id == device_data['device_id'],
             DeviceData.protocol_type == device_data['protocol_type']
-        ).first() is not None
+        ).limit(1)) is not None
 
         if exists:
             raise ValueError("Device already exists")
@@ -174,19 +278,19 @@ def insert_device_data(device_data: DeviceDataSchema, db: Session):
     except Exception as e:
         raise ValueError(f"Database error: {str(e)}") from e
 
-def insert_trigger_data(triggers: list, db: Session):
+async def insert_trigger_data(triggers: list, db: AsyncSession):
     try:
-        db.execute(Trigger.__table__.insert(), triggers)
+        await db.execute(Trigger.__table__.insert(), triggers)
         return f"Triggers prepared for insertion"
 
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         return f"Database error: {str(e)}"
 
 
-def get_device_data(node_id: str, db: Session):
+async def get_device_data(node_id: str, db: AsyncSession):
     # Get all devices for the node
-    devices = db.query(DeviceData).filter(DeviceData.node_id == node_id).all()
+    devices = (await db.scalars(select(DeviceData).where(DeviceData.node_id == node_id))).all()
 
     # If there are no devices return empty list
     if not devices:
@@ -195,22 +299,18 @@ def get_device_data(node_id: str, db: Session):
     # Get latest DBIRTH or DDEATH state for each device
     stmt = (
         select(
-            NodeState.device_id,
-            NodeState.state,
-            NodeState.time
+            LatestDeviceState.device_id,
+            LatestDeviceState.state,
+            LatestDeviceState.time
         )
         .where(
-            (NodeState.node_id == node_id) &
-            (NodeState.message_type.in_(['DBIRTH', 'DDEATH']))
-        )
-        .distinct(NodeState.device_id)
-        .order_by(
-            NodeState.device_id,
-            NodeState.time.desc()  # Most recent first per device
+            (LatestDeviceState.node_id == node_id) &
+            (LatestDeviceState.device_id != '') &
+            (LatestDeviceState.state_key == '')
         )
     )
 
-    latest_states = db.execute(stmt).all()
+    latest_states = (await db.execute(stmt)).all()
     state_map = {device_id: (state, time) for device_id, state, time in latest_states}
 
     # Prepare results with raw state values
@@ -233,50 +333,101 @@ def get_device_data(node_id: str, db: Session):
         })
     return results
 
-def get_triggers(node_id: str, db: Session):
+# The node with its devices, their latest DBIRTH or DDEATH state and its triggers, built as JSON in one statement
+node_details_stmt = text("""
+SELECT
+    json_build_object(
+        'node_id', n.node_id,
+        'group_id', n.group_id,
+        'description', n.description,
+        'ip', n.ip,
+        'app_services', coalesce(to_json(n.app_services), '[]'::json),
+        'device_services', coalesce(to_json(n.device_services), '[]'::json)
+    ) AS node_data,
+    coalesce((
+        SELECT json_agg(json_build_object(
+            'group_id', d.group_id,
+            'node_id', d.node_id,
+            'device_id', d.device_id,
+            'alias', d.alias,
+            'manufacturer', d.manufacturer,
+            'model', d.model,
+            'protocol_type', d.protocol_type,
+            'state', l.state,
+            'last_updated', coalesce(to_json(l.time) #>> '{}', '-'),
+            'device_ip', d.device_ip,
+            'device_port', d.device_port
+        ) ORDER BY d.device_id)
+        FROM devices d
+        LEFT JOIN latest_device_state l
+            ON l.node_id = d.node_id AND l.device_id = d.device_id AND l.state_key = ''
+        WHERE d.node_id = n.node_id
+    ), '[]'::json) AS device_data,
+    coalesce((
+        SELECT json_agg(t ORDER BY t.trigger_id) FROM triggers t WHERE t.node_id = n.node_id
+    ), '[]'::json) AS triggers_data
+FROM edge_nodes n
+WHERE n.node_id = :node_id
+""")
+
+async def get_node_details(node_id: str, db: AsyncSession):
+    # Get the node, its devices and triggers in a single round trip
+    row = (await db.execute(node_details_stmt.bindparams(node_id=node_id))).first()
+
+    if not row:
+        raise HTTPException(status_code=404, detail=f"Node not found")
+    return {
+        "node_data": row.node_data,
+        "device_data": row.device_data,
+        "triggers_data": row.triggers_data
+    }
+
+async def get_triggers(node_id: str, db: AsyncSession):
     # Get all the triggers on the node
     stmt = select(Trigger).where(Trigger.node_id == node_id)
-    triggers = db.execute(stmt).scalars().all()
+    triggers = (await db.execute(stmt)).scalars().all()
     # Turns it into a list of dictionaries
     result = [t.to_dict() for t in triggers]
     return result
 
-def delete_node(node_id: str, db: Session):
+async def delete_node(node_id: str, db: AsyncSession):
     # Delete the node
     try:
-        with db.begin():
-            devices_deleted = db.query(DeviceData).filter(DeviceData.node_id == node_id).delete()
-            triggers_deleted = db.query(Trigger).filter(Trigger.node_id == node_id).delete()
-            edge_nodes_deleted = db.query(EdgeNode).filter(EdgeNode.node_id == node_id).delete()
+        async with db.begin():
+            devices_deleted = await db.execute(delete(DeviceData).where(DeviceData.node_id == node_id))
+            triggers_deleted = await db.execute(delete(Trigger).where(Trigger.node_id == node_id))
+            edge_nodes_deleted = await db.execute(delete(EdgeNode).where(EdgeNode.node_id == node_id))
 
-            return f"Successfully deleted edge node {node_id} and its devices from the database"
+        change_tracker.bump(NODES)
+        return f"Successfully deleted edge node {node_id} and its devices from the database"
 
     except SQLAlchemyError as e:
-        db.rollback()
+        await db.rollback()
         raise SQLAlchemyError(f"Failed to delete node {node_id}: {str(e)}")
 
-def delete_device(device_id: str, node_id: str, db: Session):
+async def delete_device(device_id: str, node_id: str, db: AsyncSession):
     try:
-        with db.begin():
-            db.query(DeviceData).filter(
+        async with db.begin():
+            await db.execute(delete(DeviceData).where(
                 DeviceData.device_id == device_id,
                 DeviceData.node_id == node_id
-            ).delete()
+            ))
 
-            db.query(Trigger).filter(
+            await db.execute(delete(Trigger).where(
                 Trigger.device_id == device_id,
                 Trigger.node_id == node_id
-            ).delete()
+            ))
 
             # Get the node
-            node = db.get(EdgeNode, node_id)
+            node = await db.get(EdgeNode, node_id)
 
             # Remove device if it exists
-            if device_id in node.device_services:
+            if node and node.device_services and device_id in node.device_services:
                 node.device_services.remove(device_id)
 
-            return f"Successfully deleted device:{device_id} frome node:{node_id}"
+        change_tracker.bump(NODES)
+        return f"Successfully deleted device:{device_id} frome node:{node_id}"
 
     except SQLAlchemyError as e:
-        db.rollback()
+        await db.rollback()
         raise SQLAlchemyError(f"Failed to delete device: {device_id} from node: {node_id}: {str(e)}")
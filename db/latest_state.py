@@ -0,0 +1,73 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# latest_device_state holds the newest state of each node, device and state key,
+# so listing the nodes and devices reads one row each instead of searching device_states.
+# device_states is written by the gateways, so the table is kept up to date by a trigger in the database.
+
+# Key of a row in latest_device_state: node births and deaths are stored with device_id '',
+# births and deaths with state_key '' and the states (STATE messages) with their state key
+trigger_function = """
+CREATE OR REPLACE FUNCTION update_latest_device_state() RETURNS TRIGGER AS $$
+BEGIN
+    IF NOT (NEW.message_type IN ('NBIRTH', 'NDEATH', 'DBIRTH', 'DDEATH')
+            OR (NEW.message_type = 'STATE' AND NEW.state_key IS NOT NULL)) THEN
+        RETURN NULL;
+    END IF;
+
+    INSERT INTO latest_device_state AS latest (node_id, device_id, state_key, time, message_type, state)
+    VALUES (
+        NEW.node_id,
+        coalesce(NEW.device_id, ''),
+        CASE WHEN NEW.message_type = 'STATE' THEN NEW.state_key ELSE '' END,
+        NEW.time, NEW.message_type, NEW.state
+    )
+    ON CONFLICT (node_id, device_id, state_key) DO UPDATE
+    SET time = EXCLUDED.time, message_type = EXCLUDED.message_type, state = EXCLUDED.state
+    -- A state that arrives late does not replace a newer one
+    WHERE latest.time <= EXCLUDED.time;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+drop_trigger = "DROP TRIGGER IF EXISTS latest_device_state_trigger ON device_states"
+
+create_trigger = """
+CREATE TRIGGER latest_device_state_trigger
+AFTER INSERT ON device_states
+FOR EACH ROW EXECUTE FUNCTION update_latest_device_state()
+"""
+
+# Fills latest_device_state from the states already in device_states
+backfill = """
+INSERT INTO latest_device_state (node_id, device_id, state_key, time, message_type, state)
+SELECT DISTINCT ON (node_id, device_id, state_key) node_id, device_id, state_key, time, message_type, state
+FROM (
+    SELECT node_id, coalesce(device_id, '') AS device_id,
+           CASE WHEN message_type = 'STATE' THEN state_key ELSE '' END AS state_key,
+           time, message_type, state
+    FROM device_states
+    WHERE message_type IN ('NBIRTH', 'NDEATH', 'DBIRTH', 'DDEATH')
+       OR (message_type = 'STATE' AND state_key IS NOT NULL)
+) states
+ORDER BY node_id, device_id, state_key, time DESC
+ON CONFLICT DO NOTHING
+"""
+
+
+async def create_latest_state_trigger(db: AsyncSession, backfill_states: bool = False):
+    # Create or update the function and the trigger, backfill when the table is new
+    conn = await db.connection()
+    # Several managers starting at the same time would otherwise replace the function concurrently
+    await conn.exec_driver_sql("SELECT pg_advisory_xact_lock(hashtext('latest_device_state'))")
+    for statement in (trigger_function, drop_trigger, create_trigger):
+        await conn.exec_driver_sql(statement)
+
+    if backfill_states:
+        logger.info("Building latest_device_state from device_states")
+        await conn.exec_driver_sql(backfill)
+    await db.commit()
@@ -0,0 +1,168 @@
+# Migrate a group table to another storage layout (jsonb, typed or narrow, see db/storage_layout.py).
+# The samples are copied into a new table in batches while the gateways keep writing, a trigger on the
+# old table mirrors the new samples. Afterwards the tables are swapped in one short transaction.
+# Run from the repository root:
+#   python -m db.migrate_storage_layout <group_id> typed --batch-interval 24
+# The compression and retention policies are moved to the new table. Rollups (continuous aggregates) depend on
+# the old table and have to be removed first. The manager reads the layout of the group tables at startup,
+# restart it after the migration.
+from sqlalchemy import text
+from db.db_session import db_SessionLocal, db_engine
+from db.storage_layout import storage_layouts, json_value, create_group_table, get_layout_from_columns, quote_identifier
+from db.timescale import timescaledb_installed
+from db.storage_policies import get_policy, get_rollups, set_policy
+from datetime import timedelta
+import argparse
+import asyncio
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+mirror_trigger_name = "group_table_migration_mirror"
+
+# Inserts into the table being migrated are copied into the new table, TG_ARGV holds the new table
+# and the expression for the JSONB value in the layout of the old table
+mirror_function = """
+CREATE OR REPLACE FUNCTION group_table_migration_mirror() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format(
+        'INSERT INTO %I (time, device_id, sensor_id, metric_value) '
+        'SELECT time, device_id, sensor_id, %s FROM (SELECT ($1).*) new_row ON CONFLICT DO NOTHING',
+        TG_ARGV[0], TG_ARGV[1]
+    ) USING NEW;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql
+"""
+
+
+def quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+async def get_layout(conn, table_name: str) -> str | None:
+    columns = set((await conn.execute(text(
+        "SELECT column_name FROM information_schema.columns "
+        "WHERE table_schema = current_schema() AND table_name = :table_name"
+    ).bindparams(table_name=table_name))).scalars())
+    return get_layout_from_columns(columns) if columns else None
+
+async def get_chunk_interval(conn, table_name: str) -> timedelta | None:
+    # Chunk interval of a hypertable, None for a plain table
+    return await conn.scalar(text(
+        "SELECT time_interval FROM timescaledb_information.dimensions "
+        "WHERE hypertable_name = :table_name AND column_name = 'time'"
+    ).bindparams(table_name=table_name))
+
+async def rename_indexes(conn, table_name: str, old_prefix: str, new_prefix: str):
+    # Index names are unique per schema, the indexes of the new table get the names of the old one
+    index_names = (await conn.execute(text(
+        "SELECT indexname FROM pg_indexes WHERE schemaname = current_schema() AND tablename = :table_name"
+    ).bindparams(table_name=table_name))).scalars().all()
+    for index_name in index_names:
+        if index_name.startswith(old_prefix):
+            await conn.exec_driver_sql(
+                f"ALTER INDEX {quote_identifier(index_name)} "
+                f"RENAME TO {quote_identifier(new_prefix + index_name[len(old_prefix):])}"
+            )
+
+async def migrate_group_table(group_id: str, layout: str, batch_interval: timedelta = timedelta(days=1),
+                              drop_old: bool = False):
+    if layout not in storage_layouts:
+        raise ValueError(f"Unknown storage layout: {layout}")
+    new_table = f"{group_id}__{layout}"
+
+    async with db_SessionLocal() as db:
+        conn = await db.connection()
+        old_layout = await get_layout(conn, group_id)
+        if old_layout is None:
+            raise ValueError(f"Group table {group_id} does not exist")
+        if old_layout == layout:
+            logger.info(f"Group table {group_id} already uses the {layout} layout")
+            return
+        backup_table = f"{group_id}__{old_layout}_old"
+        if not drop_old and await get_layout(conn, backup_table) is not None:
+            raise ValueError(f"Backup table {backup_table} of an earlier migration still exists")
+        timescaledb = await timescaledb_installed(db)
+        policy = None
+        if timescaledb:
+            if await get_rollups(conn, group_id):
+                raise ValueError(f"Group table {group_id} has rollups, remove them from its storage policy first")
+            policy = await get_policy(conn, group_id)
+
+        # Leftovers of an interrupted migration are started over, the old table is still complete
+        await conn.exec_driver_sql(f"DROP TRIGGER IF EXISTS {mirror_trigger_name} ON {quote_identifier(group_id)}")
+        await conn.exec_driver_sql(f"DROP TABLE IF EXISTS {quote_identifier(new_table)}")
+        await create_group_table(conn, new_table, layout)
+        if timescaledb:
+            await conn.execute(text(
+                "SELECT create_hypertable(:table_name, 'time', chunk_time_interval => :chunk_interval)"
+            ).bindparams(table_name=new_table,
+                         chunk_interval=await get_chunk_interval(conn, group_id) or timedelta(days=7)))
+
+        # From here on every new sample of the old table is written to the new table as well
+        await conn.exec_driver_sql(mirror_function)
+        await conn.exec_driver_sql(
+            f"CREATE TRIGGER {mirror_trigger_name} AFTER INSERT ON {quote_identifier(group_id)} FOR EACH ROW "
+            f"EXECUTE FUNCTION group_table_migration_mirror({quote_literal(new_table)}, "
+            f"{quote_literal(json_value[old_layout])})"
+        )
+        await db.commit()
+
+        # Copy the existing samples, one transaction per batch so the gateways are never blocked for long
+        first_time, last_time = (await db.execute(text(
+            f"SELECT min(time), max(time) FROM {quote_identifier(group_id)}"
+        ))).one()
+        batch_start = first_time
+        while batch_start is not None and batch_start <= last_time:
+            batch_end = batch_start + batch_interval
+            result = await db.execute(text(f"""
+                INSERT INTO {quote_identifier(new_table)} (time, device_id, sensor_id, metric_value)
+                SELECT time, device_id, sensor_id, {json_value[old_layout]}
+                FROM {quote_identifier(group_id)}
+                WHERE time >= :batch_start AND time < :batch_end
+                ON CONFLICT DO NOTHING
+            """).bindparams(batch_start=batch_start, batch_end=batch_end))
+            await db.commit()
+            logger.info(f"Copied {result.rowcount} samples from {batch_start} to {batch_end}")
+            batch_start = batch_end
+
+        # Swap the tables, the lock waits for running inserts and holds back new ones until the commit
+        conn = await db.connection()
+        await conn.exec_driver_sql(f"LOCK TABLE {quote_identifier(group_id)} IN ACCESS EXCLUSIVE MODE")
+        await conn.exec_driver_sql(f"DROP TRIGGER {mirror_trigger_name} ON {quote_identifier(group_id)}")
+        if drop_old:
+            await conn.exec_driver_sql(f"DROP TABLE {quote_identifier(group_id)}")
+        else:
+            await conn.exec_driver_sql(
+                f"ALTER TABLE {quote_identifier(group_id)} RENAME TO {quote_identifier(backup_table)}"
+            )
+            await rename_indexes(conn, backup_table, f"{group_id}_", f"{backup_table}_")
+        await conn.exec_driver_sql(f"ALTER TABLE {quote_identifier(new_table)} RENAME TO {quote_identifier(group_id)}")
+        await rename_indexes(conn, group_id, f"{new_table}_", f"{group_id}_")
+        await db.commit()
+
+    if policy is not None and (policy.compress_after or policy.drop_after):
+        await set_policy(group_id, policy)
+    logger.info(f"Migrated group table {group_id} from the {old_layout} to the {layout} layout")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Migrate a group table to another storage layout")
+    parser.add_argument("group_id")
+    parser.add_argument("layout", choices=storage_layouts)
+    parser.add_argument("--batch-interval", type=float, default=24.0,
+                        help="Hours of samples copied per transaction")
+    parser.add_argument("--drop-old", action="store_true",
+                        help="Drop the old table instead of keeping it as <group_id>__<old layout>_old")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    try:
+        await migrate_group_table(args.group_id, args.layout, timedelta(hours=args.batch_interval), args.drop_old)
+    finally:
+        await db_engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,106 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import inspect, text
+from db.db_session import db_engine
+from db.storage_layout import get_layout_from_columns, is_group_table_columns, create_group_table, default_layout
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class SchemaRegistry:
+    # Names of the tables in the database, loaded once at startup and updated by the tables the manager creates,
+    # so adding a node does not list every table in the database
+    def __init__(self):
+        self.tables: set[str] = set()
+        # The tables among them that are group tables, only these take samples
+        self.group_tables: set[str] = set()
+        # Storage layout of the group tables that do not use the default layout
+        self.layouts: dict[str, str] = {}
+
+    async def load(self, db: AsyncSession):
+        conn = await db.connection()
+        self.tables = set(await conn.run_sync(lambda sync_conn: inspect(sync_conn).get_table_names()))
+        # Sample and value columns that tell the group tables and their storage layouts apart,
+        # see db/storage_layout.py
+        columns = await conn.execute(text(
+            "SELECT table_name, column_name FROM information_schema.columns "
+            "WHERE table_schema = current_schema() "
+            "AND column_name IN ('time', 'device_id', 'sensor_id', 'metric_value', 'value', 'value_double')"
+        ))
+        table_columns = {}
+        for table_name, column_name in columns:
+            table_columns.setdefault(table_name, set()).add(column_name)
+        self.group_tables = {table_name for table_name, names in table_columns.items()
+                             if is_group_table_columns(names)}
+        layouts = {table_name: get_layout_from_columns(table_columns[table_name]) for table_name in self.group_tables}
+        self.layouts = {table_name: layout for table_name, layout in layouts.items() if layout != default_layout}
+        logger.info(f"Loaded {len(self.tables)} tables into the schema registry")
+
+    def has_table(self, table_name: str) -> bool:
+        return table_name in self.tables
+
+    def get_layout(self, table_name: str) -> str:
+        return self.layouts.get(table_name, default_layout)
+
+    def add(self, table_name: str, layout: str = default_layout, group_table: bool = False):
+        self.tables.add(table_name)
+        if group_table:
+            self.group_tables.add(table_name)
+        else:
+            self.group_tables.discard(table_name)
+        if layout != default_layout:
+            self.layouts[table_name] = layout
+        else:
+            self.layouts.pop(table_name, None)
+
+    def invalidate(self, table_name: str):
+        # Called when a table turns out to be missing or changed, for example dropped outside the manager
+        self.tables.discard(table_name)
+        self.group_tables.discard(table_name)
+        self.layouts.pop(table_name, None)
+
+    async def table_exists(self, table_name: str) -> bool:
+        # Tables created by another manager are not in the registry yet, so a miss is checked in the database
+        if table_name in self.tables:
+            return True
+        async with db_engine.connect() as conn:
+            columns = set((await conn.execute(text(
+                "SELECT column_name FROM information_schema.columns "
+                "WHERE table_schema = current_schema() AND table_name = :table_name"
+            ).bindparams(table_name=table_name))).scalars())
+        if columns:
+            self.add(table_name, get_layout_from_columns(columns), is_group_table_columns(columns))
+        return bool(columns)
+
+    async def group_table_exists(self, table_name: str) -> bool:
+        # Whether the table exists and is a group table, the APIs taking a group id check this so they do not
+        # work on the other tables of the database
+        return await self.table_exists(table_name) and table_name in self.group_tables
+
+    async def ensure_group_table(self, db: AsyncSession, group_id: str, layout: str = default_layout) -> bool:
+        # Create the group table as a hypertable if needed, returns True when it was checked in the database.
+        # Managers adding nodes of the same new group at the same time wait on the advisory lock,
+        # the statements themselves do nothing when the table already exists.
+        # The layout only applies to a new table, an existing group keeps the layout it was created with.
+        if group_id in self.tables:
+            return False
+
+        conn = await db.connection()
+        await conn.execute(text("SELECT pg_advisory_xact_lock(hashtext(:lock_name))")
+                           .bindparams(lock_name=f"group_table/{group_id}"))
+        await create_group_table(conn, group_id, layout)
+
+        # Convert to TimescaleDB hypertable
+        await conn.execute(text(
+            "SELECT create_hypertable(:table_name, 'time', if_not_exists => TRUE)"
+        ).bindparams(table_name=group_id))
+        await db.commit()
+
+        # The table may have been created by another manager with a different layout
+        self.invalidate(group_id)
+        await self.table_exists(group_id)
+        return True
+
+
+schema_registry = SchemaRegistry()
@@ -0,0 +1,118 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# device_state_intervals holds one row per period in which a state key kept the same state,
+# so the Grafana state timelines read a few intervals instead of searching device_states for every timestamp.
+# device_states is written by the gateways, so the intervals are kept up to date by a trigger in the database.
+
+# Rebuilds the intervals of one state key from device_states, starting at since.
+# since has to be the start of an interval (or -infinity), so the interval before it already ends at since.
+rebuild_function = """
+CREATE OR REPLACE FUNCTION rebuild_device_state_intervals(
+    p_node_id TEXT, p_device_id TEXT, p_state_key TEXT, p_since TIMESTAMPTZ
+) RETURNS VOID AS $$
+BEGIN
+    DELETE FROM device_state_intervals
+    WHERE node_id = p_node_id AND device_id = p_device_id AND state_key = p_state_key
+      AND start_time >= p_since;
+
+    -- Keep the rows where the state changed, each of them lasts until the next change
+    INSERT INTO device_state_intervals (node_id, device_id, state_key, state, start_time, end_time)
+    SELECT p_node_id, p_device_id, p_state_key, state, time, lead(time) OVER (ORDER BY time)
+    FROM (
+        SELECT time, state, lag(state) OVER (ORDER BY time) AS previous_state
+        FROM device_states
+        WHERE node_id = p_node_id
+          AND (device_id = p_device_id OR (p_device_id = '' AND device_id IS NULL))
+          AND message_type = 'STATE'
+          AND state_key = p_state_key
+          AND state IS NOT NULL
+          AND time >= p_since
+    ) changes
+    WHERE previous_state IS DISTINCT FROM state;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+trigger_function = """
+CREATE OR REPLACE FUNCTION update_device_state_intervals() RETURNS TRIGGER AS $$
+DECLARE
+    v_device_id TEXT := coalesce(NEW.device_id, '');
+    v_current device_state_intervals%ROWTYPE;
+BEGIN
+    IF NEW.message_type <> 'STATE' OR NEW.state_key IS NULL OR NEW.state IS NULL THEN
+        RETURN NULL;
+    END IF;
+
+    -- States of the same key are handled one at a time
+    PERFORM pg_advisory_xact_lock(hashtext('device_state_intervals/' || NEW.node_id || '/' || v_device_id
+                                           || '/' || NEW.state_key));
+
+    SELECT * INTO v_current FROM device_state_intervals
+    WHERE node_id = NEW.node_id AND device_id = v_device_id AND state_key = NEW.state_key
+      AND end_time IS NULL;
+
+    IF NOT FOUND OR NEW.time > v_current.start_time THEN
+        -- Newest state of the key, only a change closes the current interval and opens a new one
+        IF FOUND AND v_current.state = NEW.state THEN
+            RETURN NULL;
+        END IF;
+        IF FOUND THEN
+            UPDATE device_state_intervals SET end_time = NEW.time
+            WHERE node_id = NEW.node_id AND device_id = v_device_id AND state_key = NEW.state_key
+              AND start_time = v_current.start_time;
+        END IF;
+        INSERT INTO device_state_intervals (node_id, device_id, state_key, state, start_time, end_time)
+        VALUES (NEW.node_id, v_device_id, NEW.state_key, NEW.state, NEW.time, NULL);
+        RETURN NULL;
+    END IF;
+
+    -- State arrived late, rebuild the intervals from the one it falls into
+    PERFORM rebuild_device_state_intervals(
+        NEW.node_id, v_device_id, NEW.state_key,
+        coalesce(
+            (SELECT max(start_time) FROM device_state_intervals
+             WHERE node_id = NEW.node_id AND device_id = v_device_id AND state_key = NEW.state_key
+               AND start_time <= NEW.time),
+            '-infinity'::TIMESTAMPTZ
+        )
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+"""
+
+drop_trigger = "DROP TRIGGER IF EXISTS device_state_intervals_trigger ON device_states"
+
+create_trigger = """
+CREATE TRIGGER device_state_intervals_trigger
+AFTER INSERT ON device_states
+FOR EACH ROW EXECUTE FUNCTION update_device_state_intervals()
+"""
+
+# Builds the intervals of every state key already in device_states
+backfill = """
+SELECT rebuild_device_state_intervals(node_id, device_id, state_key, '-infinity'::TIMESTAMPTZ)
+FROM (
+    SELECT DISTINCT node_id, coalesce(device_id, '') AS device_id, state_key
+    FROM device_states
+    WHERE message_type = 'STATE' AND state_key IS NOT NULL
+) state_keys
+"""
+
+
+async def create_state_interval_trigger(db: AsyncSession, backfill_intervals: bool = False):
+    # Create or update the functions and the trigger, backfill when the interval table is new
+    conn = await db.connection()
+    # Several managers starting at the same time would otherwise replace the functions concurrently
+    await conn.exec_driver_sql("SELECT pg_advisory_xact_lock(hashtext('device_state_intervals'))")
+    for statement in (rebuild_function, trigger_function, drop_trigger, create_trigger):
+        await conn.exec_driver_sql(statement)
+
+    if backfill_intervals:
+        logger.info("Building device_state_intervals from device_states")
+        await conn.exec_driver_sql(backfill)
+    await db.commit()
@@ -0,0 +1,143 @@
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy import MetaData, Table, Column, String, TIMESTAMP, BigInteger, Boolean, text
+from sqlalchemy.dialects.postgresql import JSONB, DOUBLE_PRECISION
+from sqlalchemy.schema import CreateTable
+from typing import Literal
+
+# Storage layouts of the group tables, chosen per group when the group table is created.
+# jsonb:  every sample in metric_value (the original layout)
+# typed:  numbers in value_double or value_int, booleans in value_bool, other values stay in metric_value
+# narrow: only numeric samples in value (booleans as 0 and 1), other values are not stored
+# The typed and narrow tables keep metric_value as input column, a trigger moves the value into the
+# typed columns. Gateways and tools that insert metric_value keep working without changes.
+StorageLayout = Literal["jsonb", "typed", "narrow"]
+storage_layouts: tuple[str, ...] = StorageLayout.__args__
+default_layout = "jsonb"
+
+# Name of the trigger on the typed and narrow tables, trigger names only have to be unique per table
+trigger_name = "group_table_value"
+
+# Columns written per layout, the trigger does not run for rows without metric_value
+layout_columns = {
+    "jsonb": ("time", "device_id", "sensor_id", "metric_value"),
+    "typed": ("time", "device_id", "sensor_id", "value_double", "value_int", "value_bool", "metric_value"),
+    "narrow": ("time", "device_id", "sensor_id", "value")
+}
+
+# Sample value as double precision for aggregating, NULL when the sample is not numeric
+numeric_value = {
+    "jsonb": """
+        CASE jsonb_typeof(metric_value)
+            WHEN 'number' THEN (metric_value #>> '{}')::double precision
+            WHEN 'boolean' THEN CASE WHEN metric_value = 'true'::jsonb THEN 1.0 ELSE 0.0 END
+        END
+    """,
+    "typed": "coalesce(value_double, value_int::double precision, value_bool::int::double precision)",
+    "narrow": "value"
+}
+
+# Sample value as JSONB, the same value the jsonb layout stores in metric_value
+json_value = {
+    "jsonb": "metric_value",
+    "typed": "coalesce(to_jsonb(value_double), to_jsonb(value_int), to_jsonb(value_bool), metric_value)",
+    "narrow": "to_jsonb(value)"
+}
+
+# Trigger functions moving metric_value into the typed columns, shared by all tables of a layout
+layout_trigger_functions = {
+    "typed": """
+CREATE OR REPLACE FUNCTION group_table_typed_value() RETURNS trigger AS $$
+DECLARE
+    number_text text;
+BEGIN
+    CASE jsonb_typeof(NEW.metric_value)
+        WHEN 'number' THEN
+            number_text := NEW.metric_value #>> '{}';
+            -- Whole numbers without a fraction or exponent (Int, DInt, ...) fit in a bigint
+            IF number_text ~ '^-?[0-9]{1,18}$' THEN
+                NEW.value_int := number_text::bigint;
+            ELSE
+                NEW.value_double := number_text::double precision;
+            END IF;
+            NEW.metric_value := NULL;
+        WHEN 'boolean' THEN
+            NEW.value_bool := NEW.metric_value = 'true'::jsonb;
+            NEW.metric_value := NULL;
+        WHEN 'null' THEN
+            NEW.metric_value := NULL;
+        ELSE
+            -- Strings, arrays and objects are kept as JSONB
+            NULL;
+    END CASE;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql
+""",
+    "narrow": """
+CREATE OR REPLACE FUNCTION group_table_narrow_value() RETURNS trigger AS $$
+BEGIN
+    CASE jsonb_typeof(NEW.metric_value)
+        WHEN 'number' THEN
+            NEW.value := (NEW.metric_value #>> '{}')::double precision;
+        WHEN 'boolean' THEN
+            NEW.value := CASE WHEN NEW.metric_value = 'true'::jsonb THEN 1.0 ELSE 0.0 END;
+        ELSE
+            -- Only numeric samples are stored
+            RETURN NULL;
+    END CASE;
+    NEW.metric_value := NULL;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql
+"""
+}
+
+
+def get_group_table(group_id: str, layout: str = default_layout) -> Table:
+    # Table with the sensor data of all nodes in a group
+    columns = [
+        Column("time", TIMESTAMP(timezone=True), primary_key=True),
+        Column("device_id", String, primary_key=True),
+        Column("sensor_id", String, primary_key=True)
+    ]
+    if layout == "typed":
+        columns += [Column("value_double", DOUBLE_PRECISION), Column("value_int", BigInteger),
+                    Column("value_bool", Boolean)]
+    elif layout == "narrow":
+        columns += [Column("value", DOUBLE_PRECISION)]
+    return Table(group_id, MetaData(), *columns, Column("metric_value", JSONB))
+
+def get_layout_from_columns(columns) -> str:
+    # Layout of an existing group table, recognised by its value columns
+    if "value_double" in columns:
+        return "typed"
+    if "value" in columns:
+        return "narrow"
+    return "jsonb"
+
+def is_group_table_columns(columns) -> bool:
+    # Group tables have the sample columns and the value column of a layout (metric_value or value),
+    # other tables of the database (edge_nodes, device_states...) never take samples
+    return {"time", "device_id", "sensor_id"} <= set(columns) and bool({"metric_value", "value"} & set(columns))
+
+def quote_identifier(name: str) -> str:
+    return '"' + name.replace('"', '""') + '"'
+
+async def create_group_table(conn: AsyncConnection, table_name: str, layout: str = default_layout):
+    # Create the table and the trigger of its layout, does nothing for an existing table
+    if layout not in storage_layouts:
+        raise ValueError(f"Unknown storage layout: {layout}")
+    await conn.execute(CreateTable(get_group_table(table_name, layout), if_not_exists=True))
+    if layout in layout_trigger_functions:
+        # Replacing the function while another manager does the same fails with "tuple concurrently updated"
+        await conn.exec_driver_sql("SELECT pg_advisory_xact_lock(hashtext('group_table_functions'))")
+        await conn.exec_driver_sql(layout_trigger_functions[layout])
+        trigger_exists = await conn.scalar(text(
+            "SELECT true FROM pg_trigger WHERE tgrelid = to_regclass(quote_ident(:table_name)) "
+            "AND tgname = :trigger_name"
+        ).bindparams(table_name=table_name, trigger_name=trigger_name))
+        if not trigger_exists:
+            await conn.exec_driver_sql(
+                f"CREATE TRIGGER {trigger_name} BEFORE INSERT ON {quote_identifier(table_name)} "
+                f"FOR EACH ROW WHEN (NEW.metric_value IS NOT NULL) EXECUTE FUNCTION group_table_{layout}_value()"
+            )
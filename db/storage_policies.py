@@ -0,0 +1,240 @@
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+from db.db_session import db_engine
+from db.storage_layout import numeric_value, quote_identifier
+from db.schema_registry import schema_registry
+from db.timescale import timescaledb_installed
+from models.storage import StoragePolicy
+from datetime import timedelta
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Compression, retention and rollups of the group tables. The policies are TimescaleDB jobs,
+# so the settings are read back from TimescaleDB instead of being stored by the manager.
+# The rollups are continuous aggregates named <group_id>_<bucket width>, for example line1_1h.
+
+# Units of the rollup names and bucket widths, largest first
+rollup_units = (("d", "day", 86400), ("h", "hour", 3600), ("m", "minute", 60), ("s", "second", 1))
+# Rollups are refreshed for the last few buckets, older buckets only change when late samples arrive
+rollup_refresh_buckets = 3
+
+
+class StoragePolicyError(Exception):
+    # Raised when a policy can not be applied, for example without TimescaleDB
+    pass
+
+
+def get_rollup_name(group_id: str, bucket_width: timedelta) -> str:
+    seconds = int(bucket_width.total_seconds())
+    for unit, _, unit_seconds in rollup_units:
+        if seconds % unit_seconds == 0:
+            return f"{group_id}_{seconds // unit_seconds}{unit}"
+
+def get_rollup_width(group_id: str, view_name: str) -> timedelta | None:
+    # Bucket width of a rollup created by the manager, None for other continuous aggregates
+    suffix = view_name[len(group_id) + 1:] if view_name.startswith(f"{group_id}_") else ""
+    for unit, _, unit_seconds in rollup_units:
+        if suffix.endswith(unit) and suffix[:-1].isdigit():
+            return timedelta(seconds=int(suffix[:-1]) * unit_seconds)
+    return None
+
+def format_interval(interval: timedelta) -> str:
+    # Whole seconds as a PostgreSQL interval in the largest unit that fits, for example "15 minutes"
+    seconds = int(interval.total_seconds())
+    for _, name, unit_seconds in rollup_units:
+        if seconds % unit_seconds == 0:
+            count = seconds // unit_seconds
+            return f"{count} {name}{'s' if count != 1 else ''}"
+
+def quote_literal(value: str) -> str:
+    return "'" + value.replace("'", "''") + "'"
+
+async def execute_outside_transaction(conn: AsyncConnection, statement: str):
+    # Sent as a simple query, TimescaleDB refuses to refresh continuous aggregates in a transaction block
+    raw_conn = await conn.get_raw_connection()
+    await raw_conn.driver_connection.execute(statement)
+
+async def to_interval(conn: AsyncConnection, value: str) -> timedelta:
+    # Parse an interval the way PostgreSQL does, months are counted as 30 days. Raises ValueError when invalid
+    try:
+        interval = await conn.scalar(text("SELECT CAST(:value AS INTERVAL)").bindparams(value=value))
+    except DBAPIError:
+        raise ValueError(f"Invalid interval: {value!r}")
+    if interval <= timedelta(0):
+        raise ValueError(f"Interval has to be positive: {value!r}")
+    return interval
+
+async def get_policy(conn: AsyncConnection, group_id: str) -> StoragePolicy:
+    jobs = (await conn.execute(text(
+        "SELECT proc_name, config FROM timescaledb_information.jobs WHERE hypertable_name = :table_name"
+    ).bindparams(table_name=group_id))).all()
+    config = {proc_name: job_config or {} for proc_name, job_config in jobs}
+    rollups = await get_rollups(conn, group_id)
+    return StoragePolicy(
+        compress_after=config.get("policy_compression", {}).get("compress_after"),
+        drop_after=config.get("policy_retention", {}).get("drop_after"),
+        rollups=[format_interval(bucket_width) for bucket_width in rollups.values()]
+    )
+
+async def get_rollups(conn: AsyncConnection, group_id: str) -> dict[str, timedelta]:
+    # Rollup views of the group table and their bucket width
+    view_names = (await conn.execute(text(
+        "SELECT view_name FROM timescaledb_information.continuous_aggregates WHERE hypertable_name = :table_name"
+    ).bindparams(table_name=group_id))).scalars()
+    rollups = [(view_name, get_rollup_width(group_id, view_name)) for view_name in view_names]
+    return dict(sorted(((view_name, bucket_width) for view_name, bucket_width in rollups if bucket_width is not None),
+                       key=lambda rollup: rollup[1]))
+
+async def get_storage_stats(conn: AsyncConnection, group_id: str, chunks: bool = False) -> dict:
+    # Size of the group table, its chunks and how well they are compressed
+    stats = {"group_id": group_id, "layout": schema_registry.get_layout(group_id), "timescaledb": False}
+    regclass = "CAST(quote_ident(:table_name) AS REGCLASS)"
+
+    if not await timescaledb_installed(conn):
+        sizes = (await conn.execute(text(
+            f"SELECT pg_table_size({regclass}), pg_indexes_size({regclass}), pg_total_relation_size({regclass})"
+        ).bindparams(table_name=group_id))).one()
+        stats.update(table_bytes=sizes[0], index_bytes=sizes[1], total_bytes=sizes[2])
+        return stats
+
+    stats["timescaledb"] = True
+    sizes = (await conn.execute(text(
+        f"SELECT table_bytes, index_bytes, toast_bytes, total_bytes FROM hypertable_detailed_size({regclass})"
+    ).bindparams(table_name=group_id))).one()
+    stats.update(table_bytes=sizes.table_bytes, index_bytes=sizes.index_bytes, toast_bytes=sizes.toast_bytes,
+                 total_bytes=sizes.total_bytes)
+
+    chunk_counts = (await conn.execute(text(
+        "SELECT count(*), count(*) FILTER (WHERE is_compressed) FROM timescaledb_information.chunks "
+        "WHERE hypertable_name = :table_name"
+    ).bindparams(table_name=group_id))).one()
+    stats.update(chunks=chunk_counts[0], compressed_chunks=chunk_counts[1])
+
+    compression_enabled = await conn.scalar(text(
+        "SELECT compression_enabled FROM timescaledb_information.hypertables WHERE hypertable_name = :table_name"
+    ).bindparams(table_name=group_id))
+    stats.update(compression_enabled=bool(compression_enabled), before_compression_bytes=None,
+                 after_compression_bytes=None, compression_ratio=None)
+    if compression_enabled:
+        compression = (await conn.execute(text(
+            f"SELECT before_compression_total_bytes, after_compression_total_bytes "
+            f"FROM hypertable_compression_stats({regclass})"
+        ).bindparams(table_name=group_id))).first()
+        if compression is not None and compression[1]:
+            stats.update(before_compression_bytes=compression[0], after_compression_bytes=compression[1],
+                         compression_ratio=compression[0] / compression[1])
+
+    stats["policy"] = (await get_policy(conn, group_id)).model_dump()
+
+    if chunks:
+        # Per chunk, newest first
+        chunk_rows = await conn.execute(text(f"""
+            SELECT chunk.chunk_name, chunk.range_start, chunk.range_end, chunk.is_compressed,
+                   size.total_bytes, compression.before_compression_total_bytes,
+                   compression.after_compression_total_bytes
+            FROM timescaledb_information.chunks chunk
+            LEFT JOIN chunks_detailed_size({regclass}) size ON size.chunk_name = chunk.chunk_name
+            LEFT JOIN chunk_compression_stats({regclass}) compression ON compression.chunk_name = chunk.chunk_name
+            WHERE chunk.hypertable_name = :table_name
+            ORDER BY chunk.range_start DESC
+        """).bindparams(table_name=group_id))
+        stats["chunk_details"] = [{
+            "chunk_name": row.chunk_name,
+            "range_start": row.range_start,
+            "range_end": row.range_end,
+            "is_compressed": row.is_compressed,
+            "total_bytes": row.total_bytes,
+            "before_compression_bytes": row.before_compression_total_bytes,
+            "after_compression_bytes": row.after_compression_total_bytes
+        } for row in chunk_rows]
+
+    return stats
+
+async def set_policy(group_id: str, policy: StoragePolicy) -> StoragePolicy:
+    # Apply the compression, retention and rollups of the policy to the group table.
+    # Continuous aggregates can only be created and refreshed outside a transaction, so every statement
+    # is committed on its own.
+    async with db_engine.connect() as conn:
+        conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+        if not await timescaledb_installed(conn):
+            raise StoragePolicyError("Storage policies need TimescaleDB, which is not installed")
+        if not await conn.scalar(text(
+            "SELECT true FROM timescaledb_information.hypertables WHERE hypertable_name = :table_name"
+        ).bindparams(table_name=group_id)):
+            raise StoragePolicyError(f"Group table {group_id} is not a hypertable")
+
+        compress_after = await to_interval(conn, policy.compress_after) if policy.compress_after else None
+        drop_after = await to_interval(conn, policy.drop_after) if policy.drop_after else None
+        rollup_widths = sorted({await to_interval(conn, rollup) for rollup in policy.rollups})
+        table_name = quote_identifier(group_id)
+        regclass = "CAST(quote_ident(:table_name) AS REGCLASS)"
+
+        # Compression stays enabled when the policy is removed, already compressed chunks are kept as they are
+        await conn.execute(text(f"SELECT remove_compression_policy({regclass}, if_exists => TRUE)")
+                           .bindparams(table_name=group_id))
+        if compress_after is not None:
+            compression_enabled = await conn.scalar(text(
+                "SELECT compression_enabled FROM timescaledb_information.hypertables "
+                "WHERE hypertable_name = :table_name"
+            ).bindparams(table_name=group_id))
+            if not compression_enabled:
+                # The samples of a sensor are compressed together, so a query for one sensor only decompresses its own
+                await conn.exec_driver_sql(
+                    f"ALTER TABLE {table_name} SET (timescaledb.compress, "
+                    f"timescaledb.compress_segmentby = 'device_id, sensor_id', "
+                    f"timescaledb.compress_orderby = 'time DESC')"
+                )
+            await conn.execute(text(
+                f"SELECT add_compression_policy({regclass}, compress_after => CAST(:compress_after AS INTERVAL))"
+            ).bindparams(table_name=group_id, compress_after=compress_after))
+
+        await conn.execute(text(f"SELECT remove_retention_policy({regclass}, if_exists => TRUE)")
+                           .bindparams(table_name=group_id))
+        if drop_after is not None:
+            await conn.execute(text(
+                f"SELECT add_retention_policy({regclass}, drop_after => CAST(:drop_after AS INTERVAL))"
+            ).bindparams(table_name=group_id, drop_after=drop_after))
+
+        # Rollups that are no longer in the policy are dropped, new ones are filled from the existing samples
+        existing_rollups = await get_rollups(conn, group_id)
+        wanted_rollups = {get_rollup_name(group_id, bucket_width): bucket_width for bucket_width in rollup_widths}
+        for view_name in existing_rollups.keys() - wanted_rollups.keys():
+            await conn.exec_driver_sql(f"DROP MATERIALIZED VIEW {quote_identifier(view_name)}")
+            logger.info(f"Dropped rollup {view_name}")
+        for view_name, bucket_width in wanted_rollups.items():
+            if view_name in existing_rollups:
+                continue
+            await create_rollup(conn, group_id, view_name, bucket_width)
+
+        policy = await get_policy(conn, group_id)
+    logger.info(f"Storage policy of {group_id}: {policy.model_dump()}")
+    return policy
+
+async def create_rollup(conn: AsyncConnection, group_id: str, view_name: str, bucket_width: timedelta):
+    # Average, minimum, maximum and count of the numeric samples per sensor and bucket.
+    # materialized_only is off, so the buckets that are not refreshed yet are computed from the raw samples.
+    value = numeric_value[schema_registry.get_layout(group_id)]
+    seconds = int(bucket_width.total_seconds())
+    await execute_outside_transaction(conn, f"""
+        CREATE MATERIALIZED VIEW {quote_identifier(view_name)}
+        WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+        SELECT time_bucket(INTERVAL '{seconds} seconds', time) AS bucket, device_id, sensor_id,
+               avg({value}) AS value, min({value}) AS min, max({value}) AS max, count({value}) AS count
+        FROM {quote_identifier(group_id)}
+        GROUP BY bucket, device_id, sensor_id
+        WITH NO DATA
+    """)
+    await conn.execute(text(
+        "SELECT add_continuous_aggregate_policy(CAST(quote_ident(:view_name) AS REGCLASS), "
+        "start_offset => CAST(:start_offset AS INTERVAL), end_offset => CAST(:end_offset AS INTERVAL), "
+        "schedule_interval => CAST(:schedule_interval AS INTERVAL))"
+    ).bindparams(view_name=view_name, start_offset=bucket_width * (rollup_refresh_buckets + 1),
+                 end_offset=bucket_width, schedule_interval=bucket_width))
+    # Fill the rollup from the samples that are already stored
+    await execute_outside_transaction(
+        conn, f"CALL refresh_continuous_aggregate({quote_literal(quote_identifier(view_name))}, NULL, NULL)"
+    )
+    logger.info(f"Created rollup {view_name} with {bucket_width} buckets")
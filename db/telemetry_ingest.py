@@ -0,0 +1,243 @@
+from db.db_session import db_engine
+from db.schema_registry import schema_registry
+from db.storage_layout import layout_columns, quote_identifier
+from collections import defaultdict, deque
+from datetime import timezone
+import asyncpg
+import asyncio
+import json
+import logging
+import time
+import os
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+class IngestBackpressureError(Exception):
+    # Raised when the buffer stays full for longer than the backpressure timeout
+    pass
+
+
+class TelemetryIngestBuffer:
+    # Buffers samples per group table and writes them in batches with COPY
+    def __init__(self, batch_rows: int, flush_interval: float, max_buffered_rows: int,
+                 backpressure_timeout: float, max_concurrent_flushes: int, max_flush_retries: int):
+        self.batch_rows = batch_rows
+        self.flush_interval = flush_interval
+        self.max_buffered_rows = max_buffered_rows
+        self.backpressure_timeout = backpressure_timeout
+        self.max_flush_retries = max_flush_retries
+
+        self.buffers: dict[str, list[tuple]] = defaultdict(list)
+        self.buffered_rows = 0
+        # Failed flushes in a row per table, the rows are dropped when they keep failing
+        self.flush_retries: dict[str, int] = defaultdict(int)
+
+        self._space_available = asyncio.Condition()
+        self._flush_slots = asyncio.Semaphore(max_concurrent_flushes)
+        self._flush_tasks: set[asyncio.Task] = set()
+        self._flush_loop_task: asyncio.Task | None = None
+
+        # Metrics
+        self.rows_received = 0
+        self.rows_written = 0
+        self.rows_dropped = 0
+        self.flushes = 0
+        self.flush_errors = 0
+        self.last_flush_seconds = 0.0
+        self._rate_samples = deque(maxlen=60)
+
+    async def start(self):
+        # Start the background task that flushes on time
+        if self._flush_loop_task is None:
+            self._flush_loop_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        # Stop the background task and write everything that is still buffered
+        if self._flush_loop_task is not None:
+            self._flush_loop_task.cancel()
+            try:
+                await self._flush_loop_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_loop_task = None
+        await self.flush_all()
+        if self._flush_tasks:
+            await asyncio.gather(*self._flush_tasks, return_exceptions=True)
+
+    async def add_samples(self, table: str, samples: list):
+        # Add samples to the buffer of the table, waits while the buffer is full
+        rows = [
+            (
+                sample.time if sample.time.tzinfo else sample.time.replace(tzinfo=timezone.utc),
+                sample.device_id,
+                sample.sensor_id,
+                sample.value
+            )
+            for sample in samples
+        ]
+        await self._wait_for_space(len(rows))
+
+        buffer = self.buffers[table]
+        buffer.extend(rows)
+        self.buffered_rows += len(rows)
+        self.rows_received += len(rows)
+
+        # Flush on size
+        if len(buffer) >= self.batch_rows:
+            self._schedule_flush(table)
+
+    async def _wait_for_space(self, count: int):
+        async with self._space_available:
+            try:
+                await asyncio.wait_for(
+                    self._space_available.wait_for(
+                        # A batch larger than the buffer is let through once the buffer is empty
+                        lambda: self.buffered_rows + count <= self.max_buffered_rows or self.buffered_rows == 0
+                    ),
+                    timeout=self.backpressure_timeout
+                )
+            except asyncio.TimeoutError:
+                raise IngestBackpressureError(
+                    f"Ingest buffer is full ({self.buffered_rows} rows), retry later"
+                )
+
+    def _schedule_flush(self, table: str):
+        task = asyncio.create_task(self.flush(table))
+        self._flush_tasks.add(task)
+        task.add_done_callback(self._flush_tasks.discard)
+
+    async def _flush_loop(self):
+        # Flush on time
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush_all()
+            except Exception as e:
+                logger.error(f"Telemetry flush failed: {str(e)}")
+            self._rate_samples.append((time.monotonic(), self.rows_written))
+
+    async def flush_all(self):
+        tables = [table for table, rows in self.buffers.items() if rows]
+        await asyncio.gather(*(self.flush(table) for table in tables))
+
+    async def flush(self, table: str):
+        async with self._flush_slots:
+            # Take the rows out of the buffer, new samples go into a fresh list while writing
+            rows = self.buffers.pop(table, [])
+            if not rows:
+                return
+
+            start = time.perf_counter()
+            try:
+                await self._write_rows(table, rows)
+                self.rows_written += len(rows)
+                self.flushes += 1
+                self.flush_retries.pop(table, None)
+            except (asyncpg.DataError, asyncpg.SyntaxOrAccessError, asyncpg.IntegrityConstraintViolationError) as e:
+                # The rows can never be written (missing table or column, wrong values), so they are dropped
+                # instead of retried
+                self.flush_errors += 1
+                self.rows_dropped += len(rows)
+                self.flush_retries.pop(table, None)
+                schema_registry.invalidate(table)
+                logger.error(f"Dropped {len(rows)} rows for table {table}: {str(e)}")
+            except Exception as e:
+                self.flush_errors += 1
+                self.flush_retries[table] += 1
+                if self.flush_retries[table] > self.max_flush_retries:
+                    self.rows_dropped += len(rows)
+                    self.flush_retries.pop(table, None)
+                    logger.error(f"Dropped {len(rows)} rows for table {table} after {self.max_flush_retries} "
+                                 f"retries: {str(e)}")
+                else:
+                    # Put the rows back so they are retried on the next flush
+                    self.buffers[table][:0] = rows
+                    logger.error(f"Failed to write {len(rows)} rows to table {table}, retrying later: {str(e)}")
+                    return
+            finally:
+                self.last_flush_seconds = time.perf_counter() - start
+
+            await self._release_space(len(rows))
+
+    async def _release_space(self, count: int):
+        async with self._space_available:
+            self.buffered_rows -= count
+            self._space_available.notify_all()
+
+    async def _write_rows(self, table: str, rows: list[tuple]):
+        # The rows are converted to the storage layout of the table when they are written,
+        # so rows buffered while a group table is migrated end up in the new layout
+        layout = schema_registry.get_layout(table)
+        columns = layout_columns[layout]
+        records = to_records(rows, layout)
+        if not records:
+            return
+
+        async with db_engine.connect() as conn:
+            raw_conn = await conn.get_raw_connection()
+            driver_conn = raw_conn.driver_connection
+            try:
+                await driver_conn.copy_records_to_table(table, records=records, columns=columns)
+            except asyncpg.UniqueViolationError:
+                # COPY fails the whole batch on a duplicate sample, fall back to a multi-row insert that skips them
+                placeholders = ", ".join(f"${i}" for i in range(1, len(columns) + 1))
+                await driver_conn.executemany(
+                    f"INSERT INTO {quote_identifier(table)} ({', '.join(columns)}) VALUES ({placeholders}) "
+                    f"ON CONFLICT DO NOTHING",
+                    records
+                )
+
+    def get_metrics(self):
+        # Ingest rate is based on the rows written in the last minute
+        rate = 0.0
+        if len(self._rate_samples) >= 2:
+            (first_time, first_rows), (last_time, last_rows) = self._rate_samples[0], self._rate_samples[-1]
+            if last_time > first_time:
+                rate = (last_rows - first_rows) / (last_time - first_time)
+
+        return {
+            "rows_received": self.rows_received,
+            "rows_written": self.rows_written,
+            "rows_dropped": self.rows_dropped,
+            "rows_buffered": self.buffered_rows,
+            "buffered_per_table": {table: len(rows) for table, rows in self.buffers.items() if rows},
+            "flushes": self.flushes,
+            "flush_errors": self.flush_errors,
+            "last_flush_seconds": self.last_flush_seconds,
+            "rows_per_second": rate
+        }
+
+
+def to_records(rows: list[tuple], layout: str) -> list[tuple]:
+    # Buffered (time, device_id, sensor_id, value) rows as records with the columns of the layout,
+    # the same split the trigger of the layout makes for rows inserted with metric_value
+    if layout == "typed":
+        records = []
+        for sample_time, device_id, sensor_id, value in rows:
+            if isinstance(value, bool):
+                records.append((sample_time, device_id, sensor_id, None, None, value, None))
+            elif isinstance(value, int) and -2 ** 63 <= value < 2 ** 63:
+                records.append((sample_time, device_id, sensor_id, None, value, None, None))
+            elif isinstance(value, (int, float)):
+                records.append((sample_time, device_id, sensor_id, float(value), None, None, None))
+            else:
+                records.append((sample_time, device_id, sensor_id, None, None, None,
+                                None if value is None else json.dumps(value)))
+        return records
+    if layout == "narrow":
+        # Only numeric samples are stored
+        return [(sample_time, device_id, sensor_id, float(value))
+                for sample_time, device_id, sensor_id, value in rows if isinstance(value, (int, float))]
+    return [(sample_time, device_id, sensor_id, json.dumps(value)) for sample_time, device_id, sensor_id, value in rows]
+
+
+telemetry_ingest = TelemetryIngestBuffer(
+    batch_rows=int(os.getenv("INGEST_BATCH_ROWS", "5000")),
+    flush_interval=float(os.getenv("INGEST_FLUSH_INTERVAL", "1.0")),
+    max_buffered_rows=int(os.getenv("INGEST_MAX_BUFFERED_ROWS", "200000")),
+    backpressure_timeout=float(os.getenv("INGEST_BACKPRESSURE_TIMEOUT", "5.0")),
+    max_concurrent_flushes=int(os.getenv("INGEST_MAX_CONCURRENT_FLUSHES", "4")),
+    max_flush_retries=int(os.getenv("INGEST_MAX_FLUSH_RETRIES", "10"))
+)
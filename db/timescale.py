@@ -0,0 +1,71 @@
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import text
+from models.add_nodes import NodeState
+import logging
+import os
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Storage settings of device_states, an empty value disables compression or retention
+chunk_interval = os.getenv("DEVICE_STATES_CHUNK_INTERVAL", "7 days")
+compress_after = os.getenv("DEVICE_STATES_COMPRESS_AFTER", "30 days")
+retention = os.getenv("DEVICE_STATES_RETENTION", "")
+
+# Single column indexes created by earlier versions, replaced by the composite indexes of NodeState
+outdated_indexes = ("ix_device_states_node_id", "ix_device_states_message_type")
+
+
+async def timescaledb_installed(db: AsyncSession) -> bool:
+    return bool(await db.scalar(text("SELECT true FROM pg_extension WHERE extname = 'timescaledb'")))
+
+async def setup_device_states(db: AsyncSession):
+    # Bring an existing device_states table up to date: indexes, hypertable, compression and retention
+    conn = await db.connection()
+    # Several managers starting at the same time would otherwise migrate the table concurrently
+    await conn.exec_driver_sql("SELECT pg_advisory_xact_lock(hashtext('device_states'))")
+
+    for index in NodeState.__table__.indexes:
+        await conn.run_sync(lambda sync_conn: index.create(sync_conn, checkfirst=True))
+    for index_name in outdated_indexes:
+        await conn.exec_driver_sql(f"DROP INDEX IF EXISTS {index_name}")
+
+    if not await timescaledb_installed(db):
+        logger.warning("TimescaleDB is not installed, device_states is kept as a plain table")
+        await db.commit()
+        return
+
+    hypertable = (await db.execute(text(
+        "SELECT compression_enabled FROM timescaledb_information.hypertables "
+        "WHERE hypertable_name = :table_name"
+    ).bindparams(table_name=NodeState.__tablename__))).first()
+
+    if hypertable is None:
+        # Existing rows are moved into chunks, which locks the table while it runs
+        logger.info("Converting device_states to a hypertable, existing rows are migrated")
+        await db.execute(text(
+            "SELECT create_hypertable(:table_name, 'time', chunk_time_interval => CAST(:chunk_interval AS INTERVAL), "
+            "if_not_exists => TRUE, migrate_data => TRUE)"
+        ).bindparams(table_name=NodeState.__tablename__, chunk_interval=chunk_interval))
+        compression_enabled = False
+    else:
+        compression_enabled = hypertable.compression_enabled
+
+    if compress_after:
+        if not compression_enabled:
+            # The states of a device are stored together, so the lookups per device only decompress their own rows
+            await conn.exec_driver_sql(
+                "ALTER TABLE device_states SET (timescaledb.compress, "
+                "timescaledb.compress_segmentby = 'node_id, device_id', "
+                "timescaledb.compress_orderby = 'time DESC')"
+            )
+        await db.execute(text(
+            "SELECT add_compression_policy(:table_name, CAST(:compress_after AS INTERVAL), if_not_exists => TRUE)"
+        ).bindparams(table_name=NodeState.__tablename__, compress_after=compress_after))
+
+    if retention:
+        await db.execute(text(
+            "SELECT add_retention_policy(:table_name, CAST(:retention AS INTERVAL), if_not_exists => TRUE)"
+        ).bindparams(table_name=NodeState.__tablename__, retention=retention))
+
+    await db.commit()
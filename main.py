@@ -1,13 +1,16 @@
 from fastapi import FastAPI
-from nicegui import ui
 import uvicorn
-from db.db_session import get_db
-from db.db_operations import check_database_tables
+from db.db_session import db_engine
+from db.telemetry_ingest import telemetry_ingest
+from services.gateway_client import gateway_clients
+from services.gateway_health import gateway_health_monitor
+from services.startup import startup, manager_role, API
+from services.metrics import event_loop_monitor, instrument_engine, instrument_telemetry_ingest, \
+    instrument_gateway_clients, instrument_gateway_health
 from contextlib import asynccontextmanager
-from sqlalchemy.orm import Session
-from sqlalchemy.exc import SQLAlchemyError
 import sys
 import logging
+import os
 
 
 logging.basicConfig(
@@ -17,44 +20,83 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Number of worker processes started by python main.py with MANAGER_ROLE=api
+api_workers = int(os.getenv("API_WORKERS", "4"))
+# Port of the server, the UI and API processes on one host need different ports
+port = int(os.getenv("PORT", "8000"))
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # On startup check if the needed database tables has been created
-    try:
-        db = next(get_db())  # Get fresh DB session
-        check_database_tables(db)
-        logger.info("Database verified successfully")
-    except SQLAlchemyError as e:
-        logger.critical(f"Database connection failed: {str(e)}")
-        sys.exit(1)
-    except Exception as e:
-        logger.critical(f"Unexpected startup error: {str(e)}")
-        sys.exit(1)
+    # Measure the event loop lag for /metrics
+    await event_loop_monitor.start()
+    # Pooled clients for the calls to the gateways
+    gateway_clients.start()
+    # The database tables are checked in the background, the server answers while the database comes up.
+    # The telemetry ingest, gateway probes, MQTT state consumer and dashboard are started once it is ready.
+    startup.start()
     yield
+    await startup.stop()
+    await gateway_clients.close()
+    await event_loop_monitor.stop()
+    # Close the pooled database connections on shutdown
+    await db_engine.dispose()
 
 # Initialize FastAPI
 app = FastAPI(lifespan=lifespan)
 
+# Metrics of the API, the database and the gateway calls for /metrics
+from api.metrics import MetricsMiddleware
+from api.health import DatabaseReadyMiddleware
+app.add_middleware(DatabaseReadyMiddleware)
+app.add_middleware(MetricsMiddleware)
+instrument_engine(db_engine)
+instrument_telemetry_ingest(telemetry_ingest)
+instrument_gateway_clients(gateway_clients)
+instrument_gateway_health(gateway_health_monitor)
+
 # Import all API routers
 from api.dashboard import router as dashboard_router
 from api.add_nodes import router as add_nodes_router
 from api.manage_nodes import router as manage_nodes_router
 from api.data_saver import router as data_saver_router
+from api.ingest import router as ingest_router
+from api.fleet import router as fleet_router
+from api.data import router as data_router
+from api.storage import router as storage_router
+from api.audio import router as audio_router
+from api.metrics import router as metrics_router
+from api.gateway_health import router as gateway_health_router
+from api.health import router as health_router
 
 app.include_router(dashboard_router)
 app.include_router(add_nodes_router)
 app.include_router(manage_nodes_router)
 app.include_router(data_saver_router)
+app.include_router(ingest_router)
+app.include_router(fleet_router)
+app.include_router(data_router)
+app.include_router(storage_router)
+app.include_router(audio_router)
+app.include_router(metrics_router)
+app.include_router(gateway_health_router)
+app.include_router(health_router)
 
-# Import all pages
-from pages import dashboard, add_nodes, manage_nodes, node_page
+# Import all pages, the API workers only serve the API
+if manager_role != API:
+    from pages import dashboard, add_nodes, manage_nodes, node_page, storage
 
-# Run Both FastAPI and NiceGUI Together
 if __name__ == "__main__":
-    ui.run_with(
-        app,
-        mount_path="/",
-        title="Edge Node Manager"
-    )
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if manager_role == API:
+        # Only the API, in several worker processes. The workers share their changes with each other and
+        # the UI process through Postgres LISTEN/NOTIFY
+        uvicorn.run("main:app", host="0.0.0.0", port=port, workers=api_workers)
+    else:
+        # Run Both FastAPI and NiceGUI Together
+        from nicegui import ui
+        ui.run_with(
+            app,
+            mount_path="/",
+            title="Edge Node Manager"
+        )
+        uvicorn.run(app, host="0.0.0.0", port=port)
 
@@ -1,8 +1,8 @@
 from sqlalchemy.ext.mutable import MutableList
-from sqlalchemy import Column, String, TIMESTAMP, Integer, DateTime, func
-from sqlalchemy.inspection import inspect
-from sqlalchemy.dialects.postgresql import ARRAY, JSONB
+from sqlalchemy import Column, String, TIMESTAMP, Integer, BigInteger, Float, DateTime, Index, UniqueConstraint, func, text
+from sqlalchemy.dialects.postgresql import ARRAY, JSON, JSONB
 from db.db_session import Base
+from db.storage_layout import StorageLayout
 from pydantic import BaseModel
 
 # Define the structure for configuring the edge node
@@ -12,6 +12,8 @@ class NodeConfig(BaseModel):
     description: str | None = None
     ip: str
     app_services: list[str] = []
+    # Storage layout of the group table, only used when the node is the first of its group
+    storage_layout: StorageLayout = "jsonb"
 
 #Database class for the edge nodes
 class EdgeNode(Base):
@@ -29,12 +31,47 @@ class NodeState(Base):
     __tablename__ = "device_states"
 
     time = Column(TIMESTAMP(timezone=True), primary_key=True, index=True)
-    node_id = Column(String, primary_key=True, index=True)
+    node_id = Column(String, primary_key=True)
     device_id = Column(String, nullable=True)
-    message_type = Column(String, primary_key=True, index=True)
+    message_type = Column(String, primary_key=True)
     state_key = Column(String)
     state = Column(String)
 
+    # The states are looked up per node, device and message type (or state key), newest first
+    __table_args__ = (
+        Index("ix_device_states_latest", "node_id", "device_id", "message_type", text("time DESC")),
+        Index("ix_device_states_state_key", "node_id", "device_id", "state_key", text("time DESC"),
+              postgresql_where=text("message_type = 'STATE'")),
+    )
+
+# Periods in which a state key (process_trigger, data_trigger, ...) of a device kept the same state.
+# Maintained by a trigger on device_states, end_time is NULL for the current state
+class DeviceStateInterval(Base):
+    __tablename__ = "device_state_intervals"
+
+    node_id = Column(String, primary_key=True)
+    device_id = Column(String, primary_key=True)
+    state_key = Column(String, primary_key=True)
+    start_time = Column(TIMESTAMP(timezone=True), primary_key=True)
+    end_time = Column(TIMESTAMP(timezone=True), nullable=True)
+    state = Column(String)
+
+    __table_args__ = (
+        Index("ix_device_state_intervals_end_time", "node_id", "device_id", "state_key", "end_time"),
+    )
+
+# Latest state of each node, device and state key. Maintained by a trigger on device_states,
+# device_id is '' for the node itself and state_key is '' for the birth and death messages
+class LatestDeviceState(Base):
+    __tablename__ = "latest_device_state"
+
+    node_id = Column(String, primary_key=True)
+    device_id = Column(String, primary_key=True)
+    state_key = Column(String, primary_key=True)
+    time = Column(TIMESTAMP(timezone=True))
+    message_type = Column(String)
+    state = Column(String)
+
 # Device information for database
 class DeviceData(Base):
     __tablename__ = "devices"
@@ -62,7 +99,53 @@ class Trigger(Base):
     created_at = Column(DateTime, server_default=func.now())
     updated_at = Column(DateTime, onupdate=func.now())
 
+    def to_dict(self):
+        # The attributes are named after the columns, so the mapper does not have to be inspected per row
+        return {c.key: getattr(self, c.key)
+                for c in self.__table__.columns}
+
+# Progress of the fleet provisioning jobs, see services/fleet.py.
+# Stored in the database so every process of a multi-process deployment can report the jobs
+class ProvisioningJobRecord(Base):
+    __tablename__ = "provisioning_jobs"
+
+    job_id = Column(String, primary_key=True)
+    created = Column(TIMESTAMP(timezone=True), nullable=False, index=True)
+    finished = Column(TIMESTAMP(timezone=True), nullable=True)
+    # node_id -> status, step, error and devices of each gateway, json keeps the order of the manifest
+    gateways = Column(JSON, nullable=False)
+
+# Catalog of the audio clips uploaded by the microphone device services.
+# The audio is stored once per checksum, see services/audio.py
+class AudioClip(Base):
+    __tablename__ = "audio_clips"
+
+    clip_id = Column(Integer, primary_key=True)
+    device_id = Column(String, nullable=False)
+    node_id = Column(String, nullable=True)
+    filename = Column(String)
+    start_time = Column(TIMESTAMP(timezone=True), nullable=False)
+    end_time = Column(TIMESTAMP(timezone=True), nullable=False)
+    duration = Column(Float)
+    samplerate = Column(Integer, nullable=True)
+    channels = Column(Integer, nullable=True)
+    # Format of the stored file, wav or flac
+    format = Column(String)
+    # Size of the stored file and of the uploaded file
+    size = Column(BigInteger)
+    original_size = Column(BigInteger)
+    # SHA-256 of the uploaded file
+    sha256 = Column(String(64), nullable=False)
+    uploaded_at = Column(TIMESTAMP(timezone=True), server_default=func.now())
+
+    # The clips are looked up per device by time, an upload of the same clip is stored once
+    __table_args__ = (
+        Index("ix_audio_clips_device_time", "device_id", "start_time", "end_time"),
+        Index("ix_audio_clips_sha256", "sha256"),
+        UniqueConstraint("device_id", "sha256", name="uq_audio_clips_device_sha256"),
+    )
+
     def to_dict(self):
         return {c.key: getattr(self, c.key)
-                for c in inspect(self).mapper.column_attrs}
+                for c in self.__table__.columns}
 
@@ -0,0 +1,31 @@
+from pydantic import BaseModel, Field, field_validator
+from db.storage_layout import StorageLayout
+
+# Device service to add to a gateway, config is the same configuration the device dialogs send to the gateway
+class DeviceProvisioning(BaseModel):
+    protocol_type: str = Field(min_length=1)
+    config: dict
+
+# Gateway to configure and add to the database
+class GatewayProvisioning(BaseModel):
+    group_id: str = Field(min_length=1)
+    node_id: str = Field(min_length=1)
+    ip: str = Field(min_length=1)
+    description: str | None = None
+    app_services: list[str] = ["MQTT"]
+    # Storage layout of the group table, see NodeConfig
+    storage_layout: StorageLayout = "jsonb"
+    devices: list[DeviceProvisioning] = []
+
+class FleetManifest(BaseModel):
+    gateways: list[GatewayProvisioning]
+    # Number of gateways provisioned at the same time
+    concurrency: int | None = Field(None, ge=1)
+
+    @field_validator('gateways')
+    def unique_node_ids(cls, v):
+        node_ids = [gateway.node_id for gateway in v]
+        duplicates = {node_id for node_id in node_ids if node_ids.count(node_id) > 1}
+        if duplicates:
+            raise ValueError(f"Duplicate node IDs: {', '.join(sorted(duplicates))}")
+        return v
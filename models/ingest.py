@@ -0,0 +1,10 @@
+from pydantic import BaseModel, Field
+from datetime import datetime
+from typing import Any
+
+# One sample for a group table
+class TelemetrySample(BaseModel):
+    time: datetime
+    device_id: str = Field(min_length=1)
+    sensor_id: str = Field(min_length=1)
+    value: Any = None
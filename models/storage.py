@@ -0,0 +1,16 @@
+from pydantic import BaseModel, Field, field_validator
+
+# Storage policy of a group table. Intervals are PostgreSQL intervals such as "30 days", None disables the policy
+class StoragePolicy(BaseModel):
+    # Chunks older than this are compressed, segmented by device_id and sensor_id
+    compress_after: str | None = None
+    # Chunks older than this are dropped
+    drop_after: str | None = None
+    # Bucket widths of the continuous aggregates kept next to the raw samples, for example ["1 hour", "1 day"]
+    rollups: list[str] = Field(default_factory=list, max_length=5)
+
+    @field_validator('compress_after', 'drop_after')
+    def empty_disables(cls, v):
+        if v is not None and not v.strip():
+            return None
+        return v
@@ -1,5 +1,9 @@
 from nicegui import ui
 from pages.layout import create_layout
+from models.add_nodes import NodeConfig
+import services.nodes as nodes_service
+from services.gateway_client import gateway_clients
+import services.fleet as fleet_service
 import httpx
 import socket
 import netifaces
@@ -45,6 +49,11 @@ def add_node_page():
     group_id = ui.input("Group ID")
     description = ui.input("Description")
     node_ip = ui.input("Gateway IP address")
+    # Only used when the gateway is the first of its group
+    storage_layout = ui.select(
+        {"jsonb": "JSONB values", "typed": "Typed columns", "narrow": "Numeric values only"},
+        value="jsonb", label="Storage layout of a new group"
+    ).classes('w-64')
     ui.label('Connections:')
 
     async def add_node():
@@ -67,74 +76,64 @@ def add_node_page():
             # Configure timeout (e.g., 300 seconds = 5 minutes)
             timeout = httpx.Timeout(300.0, connect=10.0)
 
-            async with httpx.AsyncClient(timeout=timeout) as client:
-                # First try to connect to the node
-                try:
-                    api_url = f"http://{node_ip.value}:8000/api/configure_node/configure_node"
-                    node_response = await client.post(api_url, json=node_data)
-
-                    if node_response.status_code != 200:
-                        error_detail = node_response.text if node_response.text else "No error details provided"
-                        ui.notify(f"Failed to configure gateway (HTTP {node_response.status_code}): {error_detail}",
-                                  type="negative")
-                        return
-
-                except httpx.ConnectError:
-                    ui.notify(f"Cannot connect to gateway at: {node_ip.value}. Please check: "
-                              f"1. The IP address is correct\n"
-                              f"2. The gateway is powered on\n"
-                              f"3. The gateway is on the same network\n",
-                              type="negative", timeout=10000)
-                    return
-                except httpx.TimeoutException:
-                    ui.notify(
-                        f"Connection to node at {node_ip.value} timed out. The node might be busy or unresponsive.",
-                        type="negative")
-                    return
-                except httpx.RequestError as e:
-                    ui.notify(f"Network error while contacting node: {str(e)}", type="negative")
-                    return
-
-                # Second connect to the node for MQTT setup
-                try:
-                    MQTT_broker_ip = os.getenv("Backend_IP")
-
-                    if not MQTT_broker_ip:
-                        ui.notify("Backend IP is not configured in environment variables", type="negative")
-                        ui.notify("Setting it to standard 192.168.0.152")
-                        MQTT_broker_ip = "192.168.0.152"
+            # First try to connect to the node
+            try:
+                node_response = await gateway_clients.post(node_ip.value, "/api/configure_node/configure_node",
+                                                           json=node_data, timeout=timeout)
 
-                    api_url = f"http://{node_ip.value}:8000/api/configure_node/MQTT"
-                    node_response = await client.post(api_url, json={"ip": MQTT_broker_ip})
-
-                    if node_response.status_code != 200:
-                        error_detail = node_response.text if node_response.text else "No error details provided"
-                        ui.notify(f"Failed to configure MQTT (HTTP {node_response.status_code}): {error_detail}",
-                                  type="negative")
-                        return
+                if node_response.status_code != 200:
+                    error_detail = node_response.text if node_response.text else "No error details provided"
+                    ui.notify(f"Failed to configure gateway (HTTP {node_response.status_code}): {error_detail}",
+                              type="negative")
+                    return
 
-                except Exception as e:
-                    ui.notify(f"Error during MQTT configuration: {str(e)}", type="negative")
+            except httpx.ConnectError:
+                ui.notify(f"Cannot connect to gateway at: {node_ip.value}. Please check: "
+                          f"1. The IP address is correct\n"
+                          f"2. The gateway is powered on\n"
+                          f"3. The gateway is on the same network\n",
+                          type="negative", timeout=10000)
+                return
+            except httpx.TimeoutException:
+                ui.notify(
+                    f"Connection to node at {node_ip.value} timed out. The node might be busy or unresponsive.",
+                    type="negative")
+                return
+            except httpx.RequestError as e:
+                ui.notify(f"Network error while contacting node: {str(e)}", type="negative")
+                return
+
+            # Second connect to the node for MQTT setup
+            try:
+                MQTT_broker_ip = os.getenv("Backend_IP")
+
+                if not MQTT_broker_ip:
+                    ui.notify("Backend IP is not configured in environment variables", type="negative")
+                    ui.notify("Setting it to standard 192.168.0.152")
+                    MQTT_broker_ip = "192.168.0.152"
+
+                node_response = await gateway_clients.post(node_ip.value, "/api/configure_node/MQTT",
+                                                           json={"ip": MQTT_broker_ip}, timeout=timeout)
+
+                if node_response.status_code != 200:
+                    error_detail = node_response.text if node_response.text else "No error details provided"
+                    ui.notify(f"Failed to configure MQTT (HTTP {node_response.status_code}): {error_detail}",
+                              type="negative")
                     return
 
-                # Third add the node to the database
-                try:
-                    database_response = await client.post(
-                        "http://localhost:8000/api/add_nodes/create_node",
-                        json=node_data
-                    )
+            except Exception as e:
+                ui.notify(f"Error during MQTT configuration: {str(e)}", type="negative")
+                return
 
-                    if database_response.status_code != 200:
-                        error_detail = database_response.text if database_response.text else "No error details provided"
-                        ui.notify(f"Database error (HTTP {database_response.status_code}): {error_detail}",
-                                  type="negative")
-                        return
+            # Third add the node to the database
+            try:
+                await nodes_service.create_node(NodeConfig(**node_data, storage_layout=storage_layout.value))
 
-                    ui.notify("Node successfully configured and added", type="positive")
+                ui.notify("Node successfully configured and added", type="positive")
 
-                except Exception as e:
-                    ui.notify(f"Database operation failed: {str(e)}", type="negative")
-                    return
+            except Exception as e:
+                ui.notify(f"Database operation failed: {str(e)}", type="negative")
+                return
 
         except Exception as e:
             ui.notify(f"Unexpected error during node setup: {str(e)}", type="negative")
@@ -166,3 +165,42 @@ def add_node_page():
     add_button.disable()
     add_button.tooltip("Please select at least one service")
 
+    # Add many gateways at once from a manifest file
+    ui.separator().classes('mt-6')
+    ui.label('Add gateways from a manifest').classes('text-xl')
+    ui.label('YAML or JSON with a list of gateways and their device services, '
+             'or CSV with the columns group_id, node_id, ip, description, app_services and storage_layout')
+
+    job_columns = [
+        {'name': 'node_id', 'label': 'Gateway ID', 'field': 'node_id'},
+        {'name': 'status', 'label': 'Status', 'field': 'status'},
+        {'name': 'step', 'label': 'Step', 'field': 'step'},
+        {'name': 'error', 'label': 'Error', 'field': 'error'}
+    ]
+    job_table = ui.table(columns=job_columns, rows=[], row_key='node_id').classes('w-full')
+    job_table.visible = False
+
+    def show_job_progress(job):
+        job_table.rows = [{'node_id': node_id, **{k: v for k, v in progress.items() if k != 'devices'}}
+                          for node_id, progress in job.gateways.items()]
+        job_table.update()
+        if job.finished:
+            progress_timer.deactivate()
+            result = job.to_dict()
+            ui.notify(f"Provisioned {result['succeeded']} of {result['total']} gateways",
+                      type="positive" if not result['failed'] else "warning")
+
+    async def upload_manifest(e):
+        nonlocal current_job
+        try:
+            manifest = fleet_service.parse_manifest(e.content.read(), e.name)
+        except Exception as error:
+            ui.notify(f"Invalid manifest: {str(error)}", type="negative")
+            return
+        current_job = await fleet_service.start_provisioning(manifest)
+        job_table.visible = True
+        progress_timer.activate()
+
+    current_job = None
+    progress_timer = ui.timer(1.0, lambda: show_job_progress(current_job) if current_job else None, active=False)
+    ui.upload(label='Manifest', on_upload=upload_manifest, auto_upload=True).props('accept=".yaml,.yml,.json,.csv"')
@@ -1,8 +1,15 @@
 from nicegui import ui
-import httpx
 from pages.layout import create_layout
+from pages.storage import format_bytes
+import services.dashboard as dashboard_service
 
 
+def status_card(title: str):
+    # Card with a title and a value label that is updated on refresh
+    with ui.card().classes('w-48'):
+        ui.label(title).classes('text-gray-500')
+        return ui.label("-").classes('text-2xl')
+
 @ui.page("/")
 async def dashboard():
     create_layout()
@@ -10,25 +17,62 @@ async def dashboard():
     # Create containers for the data
     status_label = ui.label("Loading status...")
 
+    with ui.row().classes('gap-4'):
+        nodes_label = status_card("Gateways online")
+        devices_label = status_card("Devices online")
+        triggers_label = status_card("Active process triggers")
+        ingest_label = status_card("Telemetry rows/s")
+        audio_label = status_card("Audio uploads")
+
+    group_columns = [
+        {'name': 'group_id', 'label': 'Group', 'field': 'group_id', 'align': 'left'},
+        {'name': 'nodes_online', 'label': 'Online', 'field': 'nodes_online'},
+        {'name': 'nodes_offline', 'label': 'Offline', 'field': 'nodes_offline'},
+        {'name': 'nodes_unknown', 'label': 'No state', 'field': 'nodes_unknown'},
+        {'name': 'devices_birth', 'label': 'Devices (DBIRTH)', 'field': 'devices_birth'},
+        {'name': 'devices_death', 'label': 'Devices (DDEATH)', 'field': 'devices_death'},
+        {'name': 'active_process_triggers', 'label': 'Active process triggers', 'field': 'active_process_triggers'}
+    ]
+    ui.label('Gateways per group').classes('text-xl font-bold mt-4')
+    groups_table = ui.table(columns=group_columns, rows=[], row_key='group_id').classes('w-full')
+
     async def load_data():
         """Fetch and display data automatically"""
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get("http://localhost:8000/api/dashboard/status")
-                data = response.json()
+            data = await dashboard_service.get_status()
+            node_status = await dashboard_service.get_node_status()
+
+            # Update UI elements
+            status_label.text = f"System status: {data['status'].upper()}"
+
+            # Visual feedback
+            if data['status'] == "online":
+                status_label.classes(replace="text-positive")
+            else:
+                status_label.classes(replace="text-negative")
 
-                # Update UI elements
-                status_label.text = f"System status: {data['status'].upper()}"
+            if data['status'] != "online":
+                return
+            nodes = data["nodes"]
+            nodes_label.text = f"{nodes['online']} of {nodes['total']}"
+            devices = data["devices"]
+            devices_label.text = f"{devices['DBIRTH']} of {devices['DBIRTH'] + devices['DDEATH']}"
+            triggers_label.text = str(data["active_process_triggers"])
+            ingest_label.text = f"{data['ingest']['rows_per_second']:.0f}"
+            audio = data["audio_backlog"]
+            # Every running upload writes a .tmp or .part file, so these are counted by the files only
+            audio_label.text = (f"{audio['partial_uploads']} "
+                                f"({format_bytes(audio['upload_bytes_per_second'])}/s)")
 
-                # Visual feedback
-                if data['status'] == "online":
-                    status_label.classes(replace="text-positive")
-                else:
-                    status_label.classes(replace="text-negative")
+            groups_table.rows = [{"group_id": group_id, **counts}
+                                 for group_id, counts in node_status["groups"].items()]
+            groups_table.update()
 
         except Exception as e:
             ui.notify(f"Failed to load data: {e}", type="negative")
             status_label.text = "Error loading data"
             status_label.classes(replace="text-negative")
 
-    await load_data()
\ No newline at end of file
+    await load_data()
+    # The status is a snapshot kept by a background task, so polling it is cheap
+    ui.timer(dashboard_service.refresh_interval, load_data)
\ No newline at end of file
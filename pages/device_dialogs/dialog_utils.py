@@ -2,6 +2,8 @@ import httpx
 from nicegui import ui
 from models.manage_nodes import DeviceDataSchema, AddDeviceSchema
 from pydantic import ValidationError
+import services.nodes as nodes_service
+from services.gateway_client import gateway_clients
 
 async def add_service_action(dialog, config_dict, device_data, select_protocol, node_ip):
     # Common function to handle the add service action
@@ -37,33 +39,30 @@ async def add_service_action(dialog, config_dict, device_data, select_protocol,
             ui.notify("Validation errors:\n" + "\n".join(errors), type='negative')
             return
 
-        async with httpx.AsyncClient(timeout=timeout) as client:
-            # API call to gateway
-            response_node = await client.post(
-                f"http://{node_ip}:8000/api/add_devices/{endpoint}",
-                json=config_dict
-            )
-
-            if response_node.status_code == 200:
-                # API call to DB
-                response_db = await client.post(
-                    "http://localhost:8000/api/manage_nodes/add_devicedata_db",
-                    json={"device_data": device_data, "triggers": config_dict["triggers"]}
-                )
+        # API call to gateway
+        response_node = await gateway_clients.post(
+            node_ip,
+            f"/api/add_devices/{endpoint}",
+            json=config_dict,
+            timeout=timeout
+        )
 
-                if response_db.status_code == 200:
-                    ui.notify("Service added successfully!", type='positive')
-                    ui.navigate.to(f"{device_data['node_id']}")
-                else:
-                    ui.notify(f"DB error: {response_db.text}", type='negative')
+        if response_node.status_code == 200:
+            # Add to the DB
+            try:
+                await nodes_service.add_device(validated_config)
+                ui.notify("Service added successfully!", type='positive')
+                ui.navigate.to(f"{device_data['node_id']}")
+            except Exception as e:
+                ui.notify(f"DB error: {str(e)}", type='negative')
+        else:
+            # Custom friendly message for Docker container name conflict
+            error_text = response_node.text
+            if "Conflict. The container name" in error_text and "already in use" in error_text:
+                ui.notify("A device service with this ID already exists. Please change the 'Device ID'.",
+                          type='negative')
             else:
-                # Custom friendly message for Docker container name conflict
-                error_text = response_node.text
-                if "Conflict. The container name" in error_text and "already in use" in error_text:
-                    ui.notify("A device service with this ID already exists. Please change the 'Device ID'.",
-                              type='negative')
-                else:
-                    ui.notify(f"Gateway error: {error_text}", type='negative')
+                ui.notify(f"Gateway error: {error_text}", type='negative')
 
     except httpx.ReadTimeout:
         ui.notify(
@@ -1,5 +1,6 @@
 from nicegui import ui
 from .base_dialog import BaseDeviceDialog
+from services.gateway_client import gateway_clients
 import httpx
 import logging
 import sys
@@ -30,18 +31,19 @@ class USBMicrophoneDialog(BaseDeviceDialog):
                 # Configure timeout
                 timeout = httpx.Timeout(300.0, connect=10.0)
 
-                async with httpx.AsyncClient(timeout=timeout) as client:
-                    response = await client.get(
-                        f"http://{node_ip}:8000/api/add_devices/available_USB_microphones"
-                    )
-                    if response.status_code != 200:
-                        ui.notify("Failed to get microphone devices", type='negative')
-                        return
-
-                    # Update the reactive list
-                    mic_data.clear()
-                    mic_data.extend(response.json())
-                    mic_table.refresh()
+                response = await gateway_clients.get(
+                    node_ip,
+                    "/api/add_devices/available_USB_microphones",
+                    timeout=timeout
+                )
+                if response.status_code != 200:
+                    ui.notify("Failed to get microphone devices", type='negative')
+                    return
+
+                # Update the reactive list
+                mic_data.clear()
+                mic_data.extend(response.json())
+                mic_table.refresh()
 
             except Exception as e:
                 ui.notify(f"Unexpected error: {e}", type='negative')
@@ -9,4 +9,5 @@ def create_layout():
         with ui.row().classes('flex flex-col w-auto'):
             ui.button('Dashboard', on_click=lambda: ui.navigate.to('/')).classes('w-full')
             ui.button('Add gateway', on_click=lambda: ui.navigate.to('/add_node')).classes('w-full')
-            ui.button('Manage gateways', on_click=lambda: ui.navigate.to('/manage_nodes')).classes('w-full')
\ No newline at end of file
+            ui.button('Manage gateways', on_click=lambda: ui.navigate.to('/manage_nodes')).classes('w-full')
+            ui.button('Storage', on_click=lambda: ui.navigate.to('/storage')).classes('w-full')
\ No newline at end of file
@@ -1,6 +1,7 @@
 from nicegui import ui
 from pages.layout import create_layout
-import httpx
+from services.events import event_bus, NODE_STATE
+import services.nodes as nodes_service
 import datetime
 
 @ui.page("/manage_nodes")
@@ -8,55 +9,119 @@ async def manage_nodes():
     create_layout()
     ui.label('Manage a one of the existing gateways').classes('text-2xl')
 
-    async def get_nodes_data():
+    async def get_nodes_data(cursor=None):
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get("http://localhost:8000/api/manage_nodes/get_all_nodes")
-                data = response.json()
-                return data
+            return await nodes_service.get_nodes(
+                cursor=cursor,
+                group_id=group_filter.value,
+                state=state_filter.value,
+                app_service=app_service_filter.value,
+                search=search_input.value or None
+            )
         except Exception as e:
             ui.notify(f"Failed to load the nodes: {e}", type="negative")
+            return {"items": [], "next_cursor": None}
+
+    async def get_filter_options():
+        try:
+            return await nodes_service.get_node_filter_options()
+        except Exception as e:
+            ui.notify(f"Failed to load the node filters: {e}", type="negative")
+            return {"group_ids": [], "app_services": []}
 
     async def get_nodes_status():
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get("http://localhost:8000/api/manage_nodes/get_node_state")
-                data = response.json()
-                return data
+            return await nodes_service.get_node_states()
         except Exception as e:
             ui.notify(f"Failed to load the state of the nodes: {e}", type="negative")
+            return {}
 
     def open_node_manager(node_id):
         ui.navigate.to(f"/manage_nodes/{node_id}")
 
-    node_data = await get_nodes_data()
     # Fetch all the latest states from the different edge_nodes
     nodes_status = await get_nodes_status()
+    filter_options = await get_filter_options()
 
-    with ui.row().classes("w-full"):
-        with ui.column().classes("w-full grid grid-cols-3 gap-4"):
-            for node in node_data:
+    def render_node_state(node_status):
+        # Render the state part of a node card
+        if node_status:
+            node_state = node_status.get("state")
+            state_time = datetime.datetime.fromtimestamp(node_status.get("time"))
+            ui.label(f'Time of state: {state_time.strftime("%Y-%m-%d %H:%M:%S")}')
+            match node_state:
+                case "True":
+                    state = "Online"
+                case "False":
+                    state = "Offline"
+                case _:  # If there is no 'state' key or it's something unexpected
+                    state = f"Unknown node state: {node_state}"
+        else:
+            state = "Node not connected to the backend"
+        ui.label(f'State: {state}')
+
+    # State container of each node card, so a state change only re-renders that card
+    state_containers = {}
+    # Cursor of the next page of nodes, None when all nodes matching the filters are shown
+    next_cursor = None
+
+    async def load_nodes(reset=False):
+        # The nodes are loaded a page at a time, so large fleets do not build every card on load
+        nonlocal next_cursor
+        if reset:
+            node_grid.clear()
+            state_containers.clear()
+            next_cursor = None
+
+        nodes_page = await get_nodes_data(next_cursor)
+        next_cursor = nodes_page["next_cursor"]
+
+        with node_grid:
+            for node in nodes_page["items"]:
                 with ui.card().on("click", lambda _, n=node: open_node_manager(n["node_id"])) \
                         .classes("cursor-pointer hover:bg-blue-50 p-4"):
                     ui.label(f"{node['node_id']}").classes("text-lg font-bold")
                     ui.label(f"Group: {node['group_id']}")
                     ui.label(f"IP: {node['ip']}")
                     #Check if the node_id is within the node_state
-                    node_status = nodes_status.get(node["node_id"])
-                    if node_status:
-                        node_state = node_status.get("state")
-                        state_time = datetime.datetime.fromtimestamp(node_status.get("time"))
-                        ui.label(f'Time of state: {state_time.strftime("%Y-%m-%d %H:%M:%S")}')
-                        match node_state:
-                            case "True":
-                                state = "Online"
-                            case "False":
-                                state = "Offline"
-                            case _:  # If there is no 'state' key or it's something unexpected
-                                state = f"Unknown node state: {node_state}"
-                    else:
-                        state = "Node not connected to the backend"
-                    ui.label(f'State: {state}')
+                    with ui.column().classes("gap-0") as state_container:
+                        render_node_state(nodes_status.get(node["node_id"]))
+                    state_containers[node["node_id"]] = state_container
+
+        shown_label.set_text(f"Showing {len(state_containers)} gateways")
+        load_more_button.set_visibility(next_cursor is not None)
+
+    async def apply_filters():
+        await load_nodes(reset=True)
+
+    # Filters are applied in the database
+    with ui.row().classes("w-full items-center gap-4"):
+        search_input = ui.input("Search", on_change=apply_filters) \
+            .props("debounce=300 clearable").classes("w-64")
+        group_filter = ui.select({group_id: group_id for group_id in filter_options["group_ids"]},
+                                 label="Group", on_change=apply_filters).props("clearable").classes("w-48")
+        state_filter = ui.select({"online": "Online", "offline": "Offline", "unknown": "Unknown"},
+                                 label="State", on_change=apply_filters).props("clearable").classes("w-48")
+        app_service_filter = ui.select({service: service for service in filter_options["app_services"]},
+                                       label="App service", on_change=apply_filters) \
+            .props("clearable").classes("w-48")
+        shown_label = ui.label().classes("text-sm text-gray-500")
+
+    with ui.row().classes("w-full"):
+        node_grid = ui.column().classes("w-full grid grid-cols-3 gap-4")
+    load_more_button = ui.button("Load more", on_click=lambda: load_nodes())
 
+    await load_nodes()
 
+    def on_node_state(event):
+        # Pushed to the browser over the websocket of the page
+        state_container = state_containers.get(event["node_id"])
+        if state_container is None:
+            return
+        state_container.clear()
+        with state_container:
+            render_node_state(event)
 
+    # Follow the state changes while the page is open
+    unsubscribe = event_bus.subscribe(NODE_STATE, on_node_state)
+    ui.context.client.on_disconnect(unsubscribe)
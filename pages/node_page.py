@@ -4,25 +4,42 @@ from pages.layout import create_layout
 import httpx
 from datetime import datetime
 import pages.device_dialogs as device_dialogs
+from services.events import event_bus, DEVICE_STATE
+import services.nodes as nodes_service
+import services.data as data_service
+from services.gateway_client import gateway_clients, GatewayUnavailableError
+from services.gateway_health import gateway_health_monitor, UP, DEGRADED, DOWN
+
+health_classes = {UP: "text-positive", DEGRADED: "text-warning", DOWN: "text-negative"}
+
+
+def format_health(health: dict | None) -> str:
+    if health is None or health["state"] == "unknown":
+        return "Not probed yet"
+    text = health["state"].capitalize()
+    if health["median_latency"] is not None:
+        text += f", {health['median_latency'] * 1000:.0f} ms round trip"
+    if health["failed_probes"]:
+        text += f", {health['failed_probes']} of the last {health['probes']} probes failed"
+    if health["state"] == DOWN and health["last_seen"]:
+        text += f", last answer {datetime.fromtimestamp(health['last_seen']):%Y-%m-%d %H:%M:%S}"
+    return text
 
 @ui.page("/manage_nodes/{node_id}")
 async def node_manager(node_id: str):
     create_layout()
-    # Fetch node data from API
+    # Fetch node data
     async def fetch_node_data():
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.get(f"http://localhost:8000/api/manage_nodes/{node_id}")
-                if response.status_code == 200:
-                    return response.json()
-                else:
-                    ui.notify(f"Failed to fetch node data: {response.text}", type='negative')
-                    return None
+            return await nodes_service.get_node_details(node_id)
         except Exception as e:
             ui.notify(f"Error fetching node: {str(e)}", type='negative')
             return None
 
     data = await fetch_node_data()
+    if not data:
+        ui.label("Failed to load node data").classes('text-red-500')
+        return
     node_data = data["node_data"]
     device_services = data["device_data"]
     trigger_data = data["triggers_data"]
@@ -70,6 +87,18 @@ async def node_manager(node_id: str):
             ui.label("IP Address:").classes('font-semibold')
             ui.label(node_ip)
 
+            ui.label("Gateway health:").classes('font-semibold')
+            health_label = ui.label()
+
+        def update_health():
+            # Calls to a gateway that is down fail at once, so the state explains why
+            health = gateway_health_monitor.get_health(node_id)
+            health_label.text = format_health(health)
+            health_label.classes(replace=health_classes.get(health["state"], "") if health else "")
+
+        update_health()
+        ui.timer(gateway_health_monitor.interval, update_health)
+
         # Delete node function
         async def delete_node_action():
             try:
@@ -79,39 +108,33 @@ async def node_manager(node_id: str):
 
                 # Configure timeout - 30 seconds total, 30 seconds connect
                 node_timeout = httpx.Timeout(30.0, connect=30.0)
-                backend_timeout = httpx.Timeout(60.0, connect=10.0)
 
                 # First try to delete information on the node (with shorter timeout)
                 node_deletion_successful = False
                 try:
-                    async with httpx.AsyncClient(timeout=node_timeout) as client:
-                        node_response = await client.post(f"http://{node_ip}:8000/api/configure_node/delete_node")
-                        if node_response.status_code == 200:
-                            node_deletion_successful = True
-                        else:
-                            ui.notify(f"Node responded but with error: {node_response.text}", type='warning')
+                    node_response = await gateway_clients.post(node_ip, "/api/configure_node/delete_node",
+                                                               timeout=node_timeout)
+                    if node_response.status_code == 200:
+                        node_deletion_successful = True
+                    else:
+                        ui.notify(f"Node responded but with error: {node_response.text}", type='warning')
                 except (httpx.ConnectTimeout, httpx.ReadTimeout):
                     ui.notify("Could not connect to node within 30 seconds - proceeding with backend deletion",
                               type='warning')
+                except GatewayUnavailableError:
+                    ui.notify("Gateway is unreachable - proceeding with backend deletion", type='warning')
                 except Exception as e:
                     ui.notify(f"Error communicating with node: {str(e)}", type='warning')
 
                 # Second delete information about the node inside the db (regardless of node deletion result)
                 try:
-                    async with httpx.AsyncClient(timeout=backend_timeout) as client:
-                        response = await client.post(
-                            "http://localhost:8000/api/manage_nodes/delete_node",
-                            params={"node_id": node_id}
-                        )
-                        if response.status_code == 200:
-                            if node_deletion_successful:
-                                ui.notify(f"Successfully deleted node {node_id}", type='positive')
-                            else:
-                                ui.notify(f"Deleted node {node_id} from backend but couldn't confirm node deletion",
-                                          type='warning')
-                            ui.navigate.to("/manage_nodes")
-                        else:
-                            ui.notify(f"Failed to delete node from backend: {response.text}", type='negative')
+                    await nodes_service.delete_node(node_id)
+                    if node_deletion_successful:
+                        ui.notify(f"Successfully deleted node {node_id}", type='positive')
+                    else:
+                        ui.notify(f"Deleted node {node_id} from backend but couldn't confirm node deletion",
+                                  type='warning')
+                    ui.navigate.to("/manage_nodes")
                 except Exception as e:
                     ui.notify(f"Error deleting node from backend: {str(e)}", type='negative')
             finally:
@@ -148,24 +171,19 @@ async def node_manager(node_id: str):
                             # Configure timeout (e.g., 300 seconds = 5 minutes)
                             timeout = httpx.Timeout(300.0, connect=10.0)
 
-                            async with httpx.AsyncClient(timeout=timeout) as client:
-                                #First try to delete on node
-                                node_response = await  client.post(f"http://{node_ip}:8000/api/add_devices/delete_device_service",
-                                                                   params={"device_id": device['device_id']})
-
-                                if node_response.status_code != 200:
-                                    ui.notify(f"Failed to connect to gateway and delete device: {node_response.text}", type='negative')
-                                    raise node_response.text
-
-                                response = await client.post(
-                                    f"http://localhost:8000/api/manage_nodes/delete_device",
-                                    params={"node_id": node_id,"device_id": device['device_id']})
-                                if response.status_code == 200:
-                                    dialog.close()
-                                    # Refresh the page to show updated list
-                                    ui.notify(f"Successfully deleted device {device['device_id']}", type='positive')
-                                else:
-                                    ui.notify(f"Failed to delete device: {response.text}", type='negative')
+                            #First try to delete on node
+                            node_response = await gateway_clients.post(node_ip, "/api/add_devices/delete_device_service",
+                                                                       params={"device_id": device['device_id']},
+                                                                       timeout=timeout)
+
+                            if node_response.status_code != 200:
+                                ui.notify(f"Failed to connect to gateway and delete device: {node_response.text}", type='negative')
+                                raise node_response.text
+
+                            await nodes_service.delete_device(node_id, device['device_id'])
+                            dialog.close()
+                            # Refresh the page to show updated list
+                            ui.notify(f"Successfully deleted device {device['device_id']}", type='positive')
                         except Exception as e:
                             ui.notify(f"Error deleting device: {str(e)}", type='negative')
                         finally:
@@ -214,19 +232,20 @@ async def node_manager(node_id: str):
                             # Configure timeout
                             timeout = httpx.Timeout(300.0, connect=10.0)
 
-                            async with httpx.AsyncClient(timeout=timeout) as client:
-                                response = await client.post(
-                                    f"http://{node_ip}:8000/api/add_devices/get_container_logs",
-                                    params= {"device_id": device["device_id"]}
-                                )
-                                if response.status_code != 200:
-                                    ui.notify(f"Could not connect to device (Status: {response.status_code})",
-                                              type='negative',
-                                              position='top')
-                                    return None
-                                ui.notify(f"Succesfully fetched logs from device: {device["device_id"]}")
-                                data = response.json()
-                                return data.get("logs", "No logs found in response")
+                            response = await gateway_clients.post(
+                                node_ip,
+                                "/api/add_devices/get_container_logs",
+                                params= {"device_id": device["device_id"]},
+                                timeout=timeout
+                            )
+                            if response.status_code != 200:
+                                ui.notify(f"Could not connect to device (Status: {response.status_code})",
+                                          type='negative',
+                                          position='top')
+                                return None
+                            ui.notify(f"Succesfully fetched logs from device: {device["device_id"]}")
+                            data = response.json()
+                            return data.get("logs", "No logs found in response")
 
                         except httpx.RequestError as e:
                             ui.notify(f"Connection error: {str(e)}", type='negative', position='top')
@@ -371,6 +390,31 @@ async def node_manager(node_id: str):
 
         return dialog
 
+    def render_device_state(device_service_state, state_time):
+        # Status content of a device card
+        if device_service_state:
+            formatted_time = state_time.strftime("%Y-%m-%d %H:%M:%S")
+            match device_service_state:
+                case "True":
+                    state = "Online"
+                case "False":
+                    state = "Offline"
+                case _:  # If there is no state from the node in the db
+                    state = f"Unknow state"
+
+            # Service state information
+            ui.label(f"Status: {state}").classes('text-sm')
+            ui.label(f"Time of state: {formatted_time}").classes('text-xs text-gray-500')
+
+        else:
+            state = "Check device connection"
+            ui.label(f"Status: {state}").classes('text-sm')
+
+        ui.label(f"Last checked: {time.strftime("%Y-%m-%d %H:%M:%S")}").classes('text-xs text-gray-500')
+
+    # State container of each device card, so a state change only re-renders that card
+    state_containers = {}
+
     with ui.row().classes('flex-wrap gap-4'):
         # Display existing services
         for device in device_services:
@@ -381,30 +425,77 @@ async def node_manager(node_id: str):
                         ui.label(device["device_id"]).classes('text-lg font-bold')
 
                     # Status content
-                    device_service_state = device["state"]
-                    if device_service_state:
-                        state_time = datetime.fromisoformat(device['last_updated'])
-                        formatted_time = state_time.strftime("%Y-%m-%d %H:%M:%S")
-                        match device_service_state:
-                            case "True":
-                                state = "Online"
-                            case "False":
-                                state = "Offline"
-                            case _:  # If there is no state from the node in the db
-                                state = f"Unknow state"
-
-                        # Service state information
-                        ui.label(f"Status: {state}").classes('text-sm')
-                        ui.label(f"Time of state: {formatted_time}").classes('text-xs text-gray-500')
-
-                    else:
-                        state = "Check device connection"
-                        ui.label(f"Status: {state}").classes('text-sm')
-
-                    ui.label(f"Last checked: {time.strftime("%Y-%m-%d %H:%M:%S")}").classes('text-xs text-gray-500')
+                    with ui.column().classes('w-full gap-0') as state_container:
+                        state_time = datetime.fromisoformat(device['last_updated']) if device["state"] else None
+                        render_device_state(device["state"], state_time)
+                    state_containers[device["device_id"]] = state_container
 
         # Add new service card (always shown)
         with ui.card().classes('w-64 h-32 hover:shadow-lg cursor-pointer').on('click', create_add_service_dialog().open):
             with ui.column().classes('w-full h-full items-center justify-center'):
                 ui.icon('add', size='xl')
                 ui.label("Add New Device Service").classes('text-sm')
+
+    def on_device_state(event):
+        # Pushed to the browser over the websocket of the page
+        if event["node_id"] != node_id or event["device_id"] not in state_containers:
+            return
+        state_container = state_containers[event["device_id"]]
+        state_container.clear()
+        with state_container:
+            render_device_state(event["state"], datetime.fromtimestamp(event["time"]))
+
+    # Follow the device state changes while the page is open
+    unsubscribe = event_bus.subscribe(DEVICE_STATE, on_device_state)
+    ui.context.client.on_disconnect(unsubscribe)
+
+    # Live sensor data of each device, downsampled in the database
+    if device_services:
+        ui.label("Live data (last hour)").classes('text-xl font-bold mt-6')
+
+    sparkline_rows = {}
+    # (device_id, sensor_id) -> (latest value label, chart)
+    sparklines = {}
+
+    for device in device_services:
+        ui.label(device["device_id"]).classes('text-sm text-gray-500')
+        sparkline_rows[device["device_id"]] = ui.row().classes('flex-wrap gap-4')
+
+    def sparkline_options(points):
+        return {
+            'animation': False,
+            'grid': {'left': 0, 'right': 0, 'top': 4, 'bottom': 4},
+            'tooltip': {'trigger': 'axis'},
+            'xAxis': {'type': 'time', 'show': False},
+            'yAxis': {'type': 'value', 'show': False, 'scale': True},
+            'series': [{'type': 'line', 'showSymbol': False, 'data': points}]
+        }
+
+    async def update_sparklines():
+        for device_id, sparkline_row in sparkline_rows.items():
+            try:
+                data = await data_service.get_series(group_id, device_id, points=60)
+            except Exception:
+                # Tried again on the next refresh
+                continue
+
+            for sensor_id, points in data["series"].items():
+                chart_points = [[point["time"].isoformat(), point["value"]] for point in points]
+                latest_value = f"{points[-1]['value']:.4g}" if points else "-"
+                if (device_id, sensor_id) not in sparklines:
+                    with sparkline_row:
+                        with ui.card().classes('w-56 p-2 gap-0'):
+                            with ui.row().classes('w-full justify-between'):
+                                ui.label(sensor_id).classes('text-sm font-bold')
+                                value_label = ui.label(latest_value).classes('text-sm')
+                            chart = ui.echart(sparkline_options(chart_points)).classes('w-full h-12')
+                    sparklines[(device_id, sensor_id)] = (value_label, chart)
+                else:
+                    value_label, chart = sparklines[(device_id, sensor_id)]
+                    value_label.set_text(latest_value)
+                    chart.options['series'][0]['data'] = chart_points
+                    chart.update()
+
+    await update_sparklines()
+    # Stops by itself when the page is closed
+    ui.timer(10.0, update_sparklines, immediate=False)
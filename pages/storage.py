@@ -0,0 +1,133 @@
+from nicegui import ui
+from pages.layout import create_layout
+from models.storage import StoragePolicy
+from db.storage_policies import StoragePolicyError
+import services.storage as storage_service
+
+
+def format_bytes(size) -> str:
+    if size is None:
+        return "-"
+    for unit in ("B", "kB", "MB", "GB"):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+def storage_to_row(storage: dict) -> dict:
+    policy = storage.get("policy") or {}
+    ratio = storage.get("compression_ratio")
+    return {
+        "group_id": storage["group_id"],
+        "layout": storage["layout"],
+        "size": format_bytes(storage.get("total_bytes")),
+        "chunks": f"{storage['compressed_chunks']} of {storage['chunks']}" if "chunks" in storage else "-",
+        "ratio": f"{ratio:.1f}x" if ratio else "-",
+        "compress_after": policy.get("compress_after") or "-",
+        "drop_after": policy.get("drop_after") or "-",
+        "rollups": ", ".join(policy.get("rollups", [])) or "-"
+    }
+
+@ui.page("/storage")
+async def storage_page():
+    create_layout()
+    ui.label('Storage of the sensor data').classes('text-2xl')
+    ui.label('Compression, retention and rollups of the group tables. '
+             'Select a group to change its policy and see the size of its chunks.').classes('text-gray-500')
+
+    columns = [
+        {'name': 'group_id', 'label': 'Group', 'field': 'group_id', 'align': 'left'},
+        {'name': 'layout', 'label': 'Layout', 'field': 'layout'},
+        {'name': 'size', 'label': 'Size', 'field': 'size'},
+        {'name': 'chunks', 'label': 'Compressed chunks', 'field': 'chunks'},
+        {'name': 'ratio', 'label': 'Compression ratio', 'field': 'ratio'},
+        {'name': 'compress_after', 'label': 'Compress after', 'field': 'compress_after'},
+        {'name': 'drop_after', 'label': 'Drop after', 'field': 'drop_after'},
+        {'name': 'rollups', 'label': 'Rollups', 'field': 'rollups'}
+    ]
+    groups_table = ui.table(columns=columns, rows=[], row_key='group_id').classes('w-full cursor-pointer')
+
+    async def load_groups():
+        try:
+            overview = await storage_service.get_storage_overview()
+        except Exception as e:
+            ui.notify(f"Failed to load the storage of the groups: {e}", type="negative")
+            return
+        groups_table.rows = [storage_to_row(storage) for storage in overview]
+        groups_table.update()
+        if overview and not overview[0]["timescaledb"]:
+            timescaledb_label.set_visibility(True)
+
+    async def open_group(group_id: str):
+        storage = await storage_service.get_group_storage(group_id)
+        if storage is None:
+            ui.notify(f"Group {group_id} not found", type="negative")
+            return
+        policy = storage.get("policy") or {}
+
+        with ui.dialog().classes('w-full max-w-4xl') as dialog, ui.card().classes('w-full p-6'):
+            with ui.row().classes('w-full items-center justify-between'):
+                ui.label(f"Group: {group_id}").classes('text-2xl font-bold')
+                ui.button(icon='close', on_click=dialog.close).props('flat dense')
+
+            ui.label(f"Layout: {storage['layout']}, size: {format_bytes(storage.get('total_bytes'))} "
+                     f"(rows {format_bytes(storage.get('table_bytes'))}, "
+                     f"indexes {format_bytes(storage.get('index_bytes'))})")
+
+            # Intervals as PostgreSQL intervals, empty disables the policy
+            with ui.row().classes('w-full gap-4'):
+                compress_input = ui.input("Compress after", value=policy.get("compress_after") or "",
+                                          placeholder="7 days").classes('w-48')
+                drop_input = ui.input("Drop after", value=policy.get("drop_after") or "",
+                                      placeholder="1 year").classes('w-48')
+                rollups_input = ui.input("Rollups (bucket widths)", value=", ".join(policy.get("rollups", [])),
+                                         placeholder="1 hour, 1 day").classes('w-64')
+
+            async def save_policy():
+                new_policy = StoragePolicy(
+                    compress_after=compress_input.value or None,
+                    drop_after=drop_input.value or None,
+                    rollups=[rollup.strip() for rollup in rollups_input.value.split(",") if rollup.strip()]
+                )
+                save_button.disable()
+                try:
+                    await storage_service.set_storage_policy(group_id, new_policy)
+                    ui.notify(f"Storage policy of {group_id} saved", type="positive")
+                    dialog.close()
+                    await load_groups()
+                except (ValueError, StoragePolicyError) as e:
+                    ui.notify(str(e), type="negative")
+                except Exception as e:
+                    ui.notify(f"Failed to save the storage policy: {e}", type="negative")
+                finally:
+                    save_button.enable()
+
+            save_button = ui.button("Save policy", on_click=save_policy)
+            if not storage["timescaledb"]:
+                save_button.disable()
+                ui.label("TimescaleDB is not installed, the policies can not be set").classes('text-red-500')
+
+            chunk_columns = [
+                {'name': 'range', 'label': 'Time range', 'field': 'range', 'align': 'left'},
+                {'name': 'compressed', 'label': 'Compressed', 'field': 'compressed'},
+                {'name': 'size', 'label': 'Size', 'field': 'size'},
+                {'name': 'uncompressed', 'label': 'Before compression', 'field': 'uncompressed'}
+            ]
+            chunk_rows = [{
+                "chunk_name": chunk["chunk_name"],
+                "range": f"{chunk['range_start']:%Y-%m-%d %H:%M} - {chunk['range_end']:%Y-%m-%d %H:%M}",
+                "compressed": "Yes" if chunk["is_compressed"] else "No",
+                "size": format_bytes(chunk["total_bytes"]),
+                "uncompressed": format_bytes(chunk["before_compression_bytes"])
+            } for chunk in storage.get("chunk_details", [])]
+            ui.label(f"Chunks ({len(chunk_rows)})").classes('text-xl font-bold mt-4')
+            ui.table(columns=chunk_columns, rows=chunk_rows, row_key='chunk_name',
+                     pagination=10).classes('w-full')
+        dialog.open()
+
+    groups_table.on('rowClick', lambda e: open_group(e.args[1]['group_id']))
+    timescaledb_label = ui.label('TimescaleDB is not installed, the group tables are plain tables '
+                                 'without compression or retention').classes('text-red-500')
+    timescaledb_label.set_visibility(False)
+
+    await load_groups()
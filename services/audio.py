@@ -0,0 +1,416 @@
+from sqlalchemy import select, text
+from sqlalchemy.dialects.postgresql import insert
+from db.db_session import db_SessionLocal
+from models.add_nodes import AudioClip, DeviceData
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+import anyio
+import hashlib
+import importlib.util
+import logging
+import os
+import re
+import struct
+import wave
+import zipfile
+
+# Service layer for the audio clips uploaded by the microphone device services, shared by the data saver
+# and audio APIs. Every clip is stored once under its SHA-256 checksum and listed in the audio_clips table.
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+#Directory for running locally
+#local_dir = ""
+#mounted_dir = Path(local_dir)
+#Directory for docker container
+mounted_dir = Path("/mounted_dir")
+
+# WAV uploads are stored as FLAC when enabled, which needs the optional soundfile package
+flac_compression = os.getenv("AUDIO_FLAC_COMPRESSION", "false").lower() in ("1", "true", "yes")
+if flac_compression and importlib.util.find_spec("soundfile") is None:
+    logger.warning("AUDIO_FLAC_COMPRESSION is enabled but the soundfile package is not installed, storing WAV")
+    flac_compression = False
+# Sample formats FLAC stores without loss
+flac_subtypes = ("PCM_16", "PCM_24", "PCM_S8")
+
+hash_chunk_size = 1024 * 1024
+default_clip_limit = 1000
+max_clip_limit = 10000
+# Bytes read per step when clips are downloaded
+download_chunk_size = int(os.getenv("AUDIO_DOWNLOAD_CHUNK_SIZE", str(1024 * 1024)))
+# A WAV file can not hold more than 4 GiB of samples
+max_wav_data_bytes = 2 ** 32 - 1 - 36
+
+media_types = {"wav": "audio/wav", "flac": "audio/flac"}
+
+# Start time in the file name, for example mic_20250101_120000.wav or 2025-01-01T12-00-00.wav (UTC)
+filename_time_pattern = re.compile(r"(\d{4})-?(\d{2})-?(\d{2})[T_ -]?(\d{2})[:-]?(\d{2})[:-]?(\d{2})")
+
+
+def get_audio_store_dir() -> Path:
+    return mounted_dir.joinpath("data/audio_store")
+
+def get_clip_path(sha256: str, file_format: str) -> Path:
+    # Content addressed, the first two characters of the checksum spread the files over 256 directories
+    return get_audio_store_dir().joinpath(sha256[:2], f"{sha256}.{file_format}")
+
+def hash_file(path: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        while chunk := file.read(hash_chunk_size):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+def read_audio_info(path: Path) -> dict | None:
+    # Sample rate, channels and duration from the header, None when the file is not a readable audio file
+    try:
+        with wave.open(str(path), "rb") as wav_file:
+            return {
+                "format": "wav",
+                "samplerate": wav_file.getframerate(),
+                "channels": wav_file.getnchannels(),
+                "duration": wav_file.getnframes() / wav_file.getframerate(),
+                "subtype": f"PCM_{wav_file.getsampwidth() * 8}" if wav_file.getsampwidth() > 1 else "PCM_U8"
+            }
+    except (wave.Error, EOFError, ZeroDivisionError):
+        pass
+    if importlib.util.find_spec("soundfile") is not None:
+        import soundfile
+        try:
+            info = soundfile.info(str(path))
+            return {
+                "format": info.format.lower(),
+                "samplerate": info.samplerate,
+                "channels": info.channels,
+                "duration": info.duration,
+                "subtype": info.subtype
+            }
+        except (RuntimeError, soundfile.LibsndfileError):
+            pass
+    return None
+
+def parse_start_time(filename: str) -> datetime | None:
+    match = filename_time_pattern.search(filename or "")
+    if not match:
+        return None
+    try:
+        return datetime(*(int(part) for part in match.groups()), tzinfo=timezone.utc)
+    except ValueError:
+        return None
+
+def compress_to_flac(source: Path, target: Path):
+    # Block by block, so long recordings are never loaded into memory at once
+    import soundfile
+    with soundfile.SoundFile(str(source)) as wav_file:
+        with soundfile.SoundFile(str(target), "w", samplerate=wav_file.samplerate, channels=wav_file.channels,
+                                 format="FLAC", subtype=wav_file.subtype) as flac_file:
+            for block in wav_file.blocks(blocksize=65536, dtype="int32", always_2d=True):
+                flac_file.write(block)
+
+async def store_clip(upload_path: Path, device_id: str, filename: str, start_time: datetime | None = None,
+                     node_id: str | None = None, sha256: str | None = None) -> dict:
+    # Move an uploaded file into the audio store and add it to the catalog.
+    # An upload of a clip that is already stored for the device returns the existing clip.
+    # The upload file is always removed.
+    try:
+        if sha256 is None:
+            sha256 = await anyio.to_thread.run_sync(hash_file, upload_path)
+        original_size = (await anyio.Path(upload_path).stat()).st_size
+        info = await anyio.to_thread.run_sync(read_audio_info, upload_path) or {}
+
+        async with db_SessionLocal() as db:
+            existing = await db.scalar(select(AudioClip).where(AudioClip.device_id == device_id,
+                                                               AudioClip.sha256 == sha256))
+            if existing is not None:
+                return {**existing.to_dict(), "duplicate": True}
+
+            file_format = info.get("format") or Path(filename).suffix.lstrip(".").lower() or "bin"
+            stored_path = get_clip_path(sha256, file_format)
+            if file_format == "wav" and flac_compression and info.get("subtype") in flac_subtypes:
+                file_format = "flac"
+                stored_path = get_clip_path(sha256, file_format)
+            await anyio.Path(stored_path.parent).mkdir(parents=True, exist_ok=True)
+
+            # The same audio from another device is already stored
+            if file_format == "flac" and not await anyio.Path(stored_path).exists():
+                tmp_path = stored_path.with_suffix(".flac.tmp")
+                try:
+                    await anyio.to_thread.run_sync(compress_to_flac, upload_path, tmp_path)
+                    await anyio.to_thread.run_sync(os.replace, tmp_path, stored_path)
+                except Exception as e:
+                    logger.error(f"Failed to compress {filename} from {device_id} to FLAC, storing WAV: {str(e)}")
+                    file_format = "wav"
+                    stored_path = get_clip_path(sha256, file_format)
+                finally:
+                    await anyio.Path(tmp_path).unlink(missing_ok=True)
+            if not await anyio.Path(stored_path).exists():
+                await anyio.to_thread.run_sync(os.replace, upload_path, stored_path)
+            size = (await anyio.Path(stored_path).stat()).st_size
+
+            duration = info.get("duration") or 0.0
+            if start_time is None:
+                # Without a time in the file name the recording is taken to have ended at the upload
+                start_time = parse_start_time(filename) or datetime.now(timezone.utc) - timedelta(seconds=duration)
+            elif start_time.tzinfo is None:
+                start_time = start_time.replace(tzinfo=timezone.utc)
+            if node_id is None:
+                node_id = await get_node_of_device(db, device_id)
+
+            clip = {
+                "device_id": device_id,
+                "node_id": node_id,
+                "filename": filename,
+                "start_time": start_time,
+                "end_time": start_time + timedelta(seconds=duration),
+                "duration": duration,
+                "samplerate": info.get("samplerate"),
+                "channels": info.get("channels"),
+                "format": file_format,
+                "size": size,
+                "original_size": original_size,
+                "sha256": sha256
+            }
+            # Two uploads of the same clip at the same time add one row
+            clip_id = await db.scalar(
+                insert(AudioClip).values(**clip).on_conflict_do_nothing(constraint="uq_audio_clips_device_sha256")
+                .returning(AudioClip.clip_id)
+            )
+            await db.commit()
+            if clip_id is None:
+                existing = await db.scalar(select(AudioClip).where(AudioClip.device_id == device_id,
+                                                                   AudioClip.sha256 == sha256))
+                return {**existing.to_dict(), "duplicate": True}
+
+        logger.info(f"Stored audio clip {clip_id} from {device_id} ({filename}) as {stored_path.name}")
+        return {"clip_id": clip_id, **clip, "duplicate": False}
+    finally:
+        await anyio.Path(upload_path).unlink(missing_ok=True)
+
+async def get_node_of_device(db, device_id: str) -> str | None:
+    # Only when the device ID is used by one node
+    node_ids = (await db.scalars(select(DeviceData.node_id).where(DeviceData.device_id == device_id)
+                                 .distinct().limit(2))).all()
+    return node_ids[0] if len(node_ids) == 1 else None
+
+async def get_clip(clip_id: int) -> dict | None:
+    async with db_SessionLocal() as db:
+        clip = await db.get(AudioClip, clip_id)
+    return clip.to_dict() if clip else None
+
+async def get_clips(device_id: str | None = None, node_id: str | None = None, start: datetime | None = None,
+                    end: datetime | None = None, limit: int = default_clip_limit) -> list[dict]:
+    # Clips overlapping the time range, oldest first
+    query = select(AudioClip).order_by(AudioClip.start_time, AudioClip.clip_id).limit(limit)
+    if device_id:
+        query = query.where(AudioClip.device_id == device_id)
+    if node_id:
+        query = query.where(AudioClip.node_id == node_id)
+    if end:
+        query = query.where(AudioClip.start_time < end)
+    if start:
+        query = query.where(AudioClip.end_time > start)
+    async with db_SessionLocal() as db:
+        clips = await db.scalars(query)
+        return [clip.to_dict() for clip in clips]
+
+async def get_process_run_clips(node_id: str, device_id: str, start: datetime, end: datetime,
+                                audio_device_id: str | None = None) -> list[dict]:
+    # Process runs (process_trigger True) of a device in the time range, each with the clips recorded during it.
+    # Without audio_device_id the clips of every microphone of the node are included.
+    audio_condition = "clip.device_id = :audio_device_id" if audio_device_id else "clip.node_id = run.node_id"
+    stmt = text(f"""
+        SELECT run.start_time AS run_start, run.end_time AS run_end, clip.clip_id
+        FROM device_state_intervals run
+        LEFT JOIN audio_clips clip
+            ON clip.start_time < coalesce(run.end_time, 'infinity')
+            AND clip.end_time > run.start_time
+            AND {audio_condition}
+        WHERE run.node_id = :node_id AND run.device_id = :device_id AND run.state_key = 'process_trigger'
+          AND run.state = 'True'
+          AND run.start_time < :end AND (run.end_time IS NULL OR run.end_time > :start)
+        ORDER BY run.start_time, clip.start_time
+    """).bindparams(node_id=node_id, device_id=device_id, start=start, end=end)
+    if audio_device_id:
+        stmt = stmt.bindparams(audio_device_id=audio_device_id)
+
+    async with db_SessionLocal() as db:
+        rows = (await db.execute(stmt)).all()
+        clip_ids = {row.clip_id for row in rows if row.clip_id is not None}
+        clips = {clip.clip_id: clip.to_dict()
+                 for clip in await db.scalars(select(AudioClip).where(AudioClip.clip_id.in_(clip_ids)))}
+
+    runs = {}
+    for row in rows:
+        run = runs.setdefault(row.run_start, {"start_time": row.run_start, "end_time": row.run_end, "clips": []})
+        if row.clip_id is not None:
+            run["clips"].append(clips[row.clip_id])
+    return list(runs.values())
+
+
+def get_media_type(file_format: str) -> str:
+    return media_types.get(file_format, "application/octet-stream")
+
+def get_download_name(clip: dict) -> str:
+    # The uploaded file name with the extension of the stored format
+    return f"{Path(clip['filename']).stem}.{clip['format']}"
+
+async def get_range_clips(device_id: str | None, node_id: str | None, start: datetime, end: datetime) -> list[dict]:
+    # Clips of a time range that is downloaded at once, raises ValueError when the range holds too many clips
+    # and LookupError when the file of a clip is missing
+    clips = await get_clips(device_id, node_id, start, end, max_clip_limit + 1)
+    if len(clips) > max_clip_limit:
+        raise ValueError(f"The time range holds more than {max_clip_limit} clips, download a shorter range")
+    for clip in clips:
+        if not await anyio.Path(get_clip_path(clip["sha256"], clip["format"])).exists():
+            raise LookupError(f"The file of clip {clip['clip_id']} is missing from the audio store")
+    return clips
+
+
+class PcmReader:
+    # Reads the samples of a stored clip as little endian PCM frames, as they are written in a WAV file.
+    # WAV files are read with the wave module, FLAC files are decoded with soundfile
+    def __init__(self, path: Path, file_format: str):
+        self.wav_file = None
+        self.sound_file = None
+        if file_format == "wav":
+            self.wav_file = wave.open(str(path), "rb")
+            self.samplerate = self.wav_file.getframerate()
+            self.channels = self.wav_file.getnchannels()
+            self.sampwidth = self.wav_file.getsampwidth()
+            self.frames = self.wav_file.getnframes()
+        elif file_format == "flac" and importlib.util.find_spec("soundfile") is not None:
+            import soundfile
+            self.sound_file = soundfile.SoundFile(str(path))
+            self.samplerate = self.sound_file.samplerate
+            self.channels = self.sound_file.channels
+            self.sampwidth = {"PCM_S8": 1, "PCM_16": 2, "PCM_24": 3}.get(self.sound_file.subtype, 4)
+            self.frames = self.sound_file.frames
+        else:
+            raise ValueError(f"Clips stored as {file_format} can not be joined into a WAV file")
+
+    def seek(self, frame: int):
+        if self.wav_file:
+            self.wav_file.setpos(frame)
+        else:
+            self.sound_file.seek(frame)
+
+    def read(self, frames: int) -> bytes:
+        if self.wav_file:
+            return self.wav_file.readframes(frames)
+        # soundfile scales every sample format to the full int32 range, the top bytes are the samples
+        samples = self.sound_file.read(frames, dtype="int32")
+        if self.sampwidth == 1:
+            # 8 bit WAV samples are unsigned
+            return ((samples >> 24) + 128).astype("uint8").tobytes()
+        return samples.astype("<i4").view("uint8").reshape(-1, 4)[:, 4 - self.sampwidth:].tobytes()
+
+    def close(self):
+        if self.wav_file:
+            self.wav_file.close()
+        else:
+            self.sound_file.close()
+
+
+def get_wav_header(samplerate: int, channels: int, sampwidth: int, data_bytes: int) -> bytes:
+    block_align = channels * sampwidth
+    return (b"RIFF" + struct.pack("<I", 36 + data_bytes) + b"WAVE"
+            + b"fmt " + struct.pack("<IHHIIHH", 16, 1, channels, samplerate, samplerate * block_align,
+                                    block_align, sampwidth * 8)
+            + b"data" + struct.pack("<I", data_bytes))
+
+def get_wav_parts(clips: list[dict], start: datetime, end: datetime) -> tuple[tuple[int, int, int], list[tuple]]:
+    # Sample format and the frames of every clip inside the time range. Raises ValueError when the clips
+    # do not share one sample format or do not fit in one WAV file
+    sample_format = None
+    parts = []
+    for clip in clips:
+        path = get_clip_path(clip["sha256"], clip["format"])
+        reader = PcmReader(path, clip["format"])
+        reader.close()
+        clip_format = (reader.samplerate, reader.channels, reader.sampwidth)
+        if sample_format is None:
+            sample_format = clip_format
+        elif clip_format != sample_format:
+            raise ValueError("The clips have different sample rates, channels or sample widths, "
+                             "download them as a ZIP file")
+        first = max(0, round((start - clip["start_time"]).total_seconds() * reader.samplerate))
+        last = min(reader.frames, round((end - clip["start_time"]).total_seconds() * reader.samplerate))
+        if last > first:
+            parts.append((path, clip["format"], first, last))
+
+    if sample_format is None:
+        raise ValueError("No audio in the time range")
+    samplerate, channels, sampwidth = sample_format
+    data_bytes = sum(last - first for _, _, first, last in parts) * channels * sampwidth
+    if data_bytes > max_wav_data_bytes:
+        raise ValueError("The time range is too long for one WAV file, download it as a ZIP file")
+    return sample_format, parts
+
+async def prepare_wav_range(clips: list[dict], start: datetime, end: datetime) -> tuple[int, object]:
+    # Checks the clips before the response starts, returns the size of the WAV file and its byte stream.
+    # The clips are joined back to back, gaps between the recordings are not filled
+    sample_format, parts = await anyio.to_thread.run_sync(get_wav_parts, clips, start, end)
+    samplerate, channels, sampwidth = sample_format
+    block_align = channels * sampwidth
+    data_bytes = sum(last - first for _, _, first, last in parts) * block_align
+    frames_per_read = max(1, download_chunk_size // block_align)
+
+    async def wav_bytes():
+        yield get_wav_header(samplerate, channels, sampwidth, data_bytes)
+        for path, file_format, first, last in parts:
+            reader = await anyio.to_thread.run_sync(PcmReader, path, file_format)
+            try:
+                await anyio.to_thread.run_sync(reader.seek, first)
+                position = first
+                while position < last:
+                    frames = min(frames_per_read, last - position)
+                    yield await anyio.to_thread.run_sync(reader.read, frames)
+                    position += frames
+            finally:
+                reader.close()
+
+    return 44 + data_bytes, wav_bytes()
+
+
+class ZipStream:
+    # Write only file for zipfile. Without seek the entries are written with data descriptors,
+    # the written bytes are taken out after every step so the archive is never staged
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self.position
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+async def stream_zip(clips: list[dict]):
+    # One entry per clip in the stored format, named by device and start time. Audio is stored uncompressed
+    stream = ZipStream()
+    with zipfile.ZipFile(stream, "w", compression=zipfile.ZIP_STORED) as zip_file:
+        for clip in clips:
+            entry = zipfile.ZipInfo(f"{clip['device_id']}/{clip['start_time']:%Y%m%d_%H%M%S}_{clip['clip_id']}"
+                                    f".{clip['format']}",
+                                    date_time=clip["start_time"].timetuple()[:6])
+            path = get_clip_path(clip["sha256"], clip["format"])
+            with zip_file.open(entry, "w", force_zip64=True) as entry_file:
+                async with await anyio.open_file(path, "rb") as clip_file:
+                    while chunk := await clip_file.read(download_chunk_size):
+                        entry_file.write(chunk)
+                        yield stream.take()
+            # Data descriptor of the entry
+            yield stream.take()
+    # Central directory
+    yield stream.take()
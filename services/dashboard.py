@@ -0,0 +1,276 @@
+from sqlalchemy import select
+from db.db_session import db_SessionLocal
+from db.change_tracking import change_tracker, NODES
+from db.telemetry_ingest import telemetry_ingest
+from models.add_nodes import EdgeNode
+from services.events import event_bus, NODE_STATE, DEVICE_STATE, STATE_VALUE, PROCESS_REPORT
+from services.metrics import http_requests_in_progress, audio_upload_rate
+from services.mqtt_state import node_state_cache
+from services.audio import mounted_dir
+from datetime import datetime, timezone
+from pathlib import Path
+import anyio
+import asyncio
+import logging
+import time
+import os
+
+# Service layer for the dashboard, shared by the API router and the dashboard page.
+# The fleet aggregates are kept up to date from the state events and published as a snapshot by a background
+# task, so reading the status never depends on the size of the fleet.
+# The ingest and upload counters belong to the process that received the requests, so every process publishes
+# them with each snapshot and the snapshots add up the reports of all processes.
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Seconds between two snapshots of the fleet status
+refresh_interval = float(os.getenv("DASHBOARD_REFRESH_INTERVAL", "5"))
+
+# Counters kept per group
+group_counter_keys = ("nodes_online", "nodes_offline", "nodes_unknown", "devices_birth", "devices_death",
+                      "active_process_triggers")
+
+
+def get_node_key(state: str | None) -> str:
+    if state is None:
+        return "nodes_unknown"
+    return "nodes_online" if state == "True" else "nodes_offline"
+
+def get_device_key(message_type: str | None) -> str | None:
+    return {"DBIRTH": "devices_birth", "DDEATH": "devices_death"}.get(message_type)
+
+def get_partial_uploads(audio_data_dir: Path) -> tuple[int, int]:
+    # Resumable and running uploads that are not finished yet, as count and bytes
+    count = size = 0
+    if not audio_data_dir.is_dir():
+        return 0, 0
+    for device_dir in os.scandir(audio_data_dir):
+        if not device_dir.is_dir():
+            continue
+        # The upload handlers rename and remove the files while they are counted, those are skipped
+        try:
+            entries = list(os.scandir(device_dir.path))
+        except FileNotFoundError:
+            continue
+        for entry in entries:
+            if entry.name.endswith((".part", ".tmp")):
+                try:
+                    size += entry.stat().st_size
+                except FileNotFoundError:
+                    continue
+                count += 1
+    return count, size
+
+
+class FleetStatus:
+    # Nodes, devices and process triggers counted per group. The counters are changed by the state events,
+    # only a change to the nodes themselves (added, removed) counts everything again.
+    def __init__(self, interval: float):
+        self.interval = interval
+        # node_id -> group_id of the nodes added to the manager
+        self.node_groups: dict[str, str] = {}
+        self.nodes_version: str | None = None
+        # Last counted state, so an event moves the node or device from one counter to the other
+        self.node_keys: dict[str, str] = {}
+        self.device_keys: dict[tuple[str, str], str] = {}
+        self.active_triggers: set[tuple[str, str]] = set()
+        self.group_counts: dict[str, dict[str, int]] = {}
+
+        # Last report of the ingest and upload counters of each process, by the random instance token of the
+        # process (pids repeat across containers)
+        self.process_reports: dict[str, dict] = {}
+
+        self.snapshot: dict | None = None
+        self._task: asyncio.Task | None = None
+        self._unsubscribe: list = []
+
+    async def start(self):
+        if self._task is not None:
+            return
+        self._unsubscribe = [
+            event_bus.subscribe(NODE_STATE, self.on_node_state),
+            event_bus.subscribe(DEVICE_STATE, self.on_device_state),
+            event_bus.subscribe(STATE_VALUE, self.on_state_value),
+            event_bus.subscribe(PROCESS_REPORT, self.on_process_report)
+        ]
+        try:
+            await self.refresh()
+        except Exception as e:
+            logger.error(f"Failed to compute the fleet status: {str(e)}")
+        self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        for unsubscribe in self._unsubscribe:
+            unsubscribe()
+        self._unsubscribe = []
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.refresh()
+            except Exception as e:
+                logger.error(f"Failed to compute the fleet status: {str(e)}")
+
+    async def refresh(self):
+        # Count everything again when nodes were added or removed, then publish a new snapshot
+        nodes_version = change_tracker.get_version(NODES)
+        if nodes_version != self.nodes_version:
+            async with db_SessionLocal() as db:
+                rows = await db.execute(select(EdgeNode.node_id, EdgeNode.group_id))
+                node_groups = {node_id: group_id or "" for node_id, group_id in rows}
+            self.nodes_version = nodes_version
+            self.recount(node_groups)
+        event_bus.publish(PROCESS_REPORT, self.get_process_report())
+        self.snapshot = await self.build_snapshot()
+
+    def recount(self, node_groups: dict[str, str]):
+        self.node_groups = node_groups
+        self.group_counts = {group_id: dict.fromkeys(group_counter_keys, 0) for group_id in set(node_groups.values())}
+        self.node_keys = {}
+        self.device_keys = {}
+        self.active_triggers = set()
+
+        node_states = node_state_cache.node_states
+        for node_id in node_groups:
+            state = node_states.get(node_id)
+            self.set_node_key(node_id, get_node_key(state["state"] if state else None))
+        for (node_id, device_id), state in node_state_cache.device_states.items():
+            self.set_device_key(node_id, device_id, get_device_key(state["message_type"]))
+        for (node_id, device_id, state_key), state in node_state_cache.state_values.items():
+            if state_key == "process_trigger":
+                self.set_trigger(node_id, device_id, state["state"] == "True")
+
+    def change_count(self, node_id: str, key: str, amount: int):
+        group_id = self.node_groups.get(node_id)
+        # Nodes that are not added to the manager are not part of the fleet
+        if group_id is not None:
+            self.group_counts[group_id][key] += amount
+
+    def set_node_key(self, node_id: str, key: str):
+        previous = self.node_keys.get(node_id)
+        if previous == key:
+            return
+        if previous is not None:
+            self.change_count(node_id, previous, -1)
+        self.node_keys[node_id] = key
+        self.change_count(node_id, key, 1)
+
+    def set_device_key(self, node_id: str, device_id: str, key: str | None):
+        previous = self.device_keys.get((node_id, device_id))
+        if previous == key or key is None:
+            return
+        if previous is not None:
+            self.change_count(node_id, previous, -1)
+        self.device_keys[(node_id, device_id)] = key
+        self.change_count(node_id, key, 1)
+
+    def set_trigger(self, node_id: str, device_id: str, active: bool):
+        key = (node_id, device_id)
+        if active and key not in self.active_triggers:
+            self.active_triggers.add(key)
+            self.change_count(node_id, "active_process_triggers", 1)
+        elif not active and key in self.active_triggers:
+            self.active_triggers.discard(key)
+            self.change_count(node_id, "active_process_triggers", -1)
+
+    def on_node_state(self, event: dict):
+        if event["node_id"] in self.node_groups:
+            self.set_node_key(event["node_id"], get_node_key(event["state"]))
+
+    def on_device_state(self, event: dict):
+        self.set_device_key(event["node_id"], event["device_id"], get_device_key(event["message_type"]))
+
+    def on_state_value(self, event: dict):
+        if event["state_key"] == "process_trigger":
+            self.set_trigger(event["node_id"], event["device_id"], event["state"] == "True")
+
+    def get_process_report(self) -> dict:
+        ingest = telemetry_ingest.get_metrics()
+        return {
+            "process": change_tracker.instance,
+            "rows_per_second": ingest["rows_per_second"],
+            "rows_buffered": ingest["rows_buffered"],
+            "rows_dropped": ingest["rows_dropped"],
+            "uploads_in_progress": http_requests_in_progress.values.get(("data_saver",), 0),
+            "upload_bytes_per_second": audio_upload_rate.values.get((), 0.0)
+        }
+
+    def on_process_report(self, event: dict):
+        self.process_reports[event["process"]] = {**event, "received": time.monotonic()}
+
+    def get_process_totals(self) -> dict:
+        # Sum of the recent reports, processes that stopped reporting are forgotten
+        now = time.monotonic()
+        self.process_reports = {process: report for process, report in self.process_reports.items()
+                                if now - report["received"] < 3 * self.interval}
+        keys = ("rows_per_second", "rows_buffered", "rows_dropped", "uploads_in_progress", "upload_bytes_per_second")
+        totals = {key: sum(report[key] for report in self.process_reports.values()) for key in keys}
+        totals["processes"] = len(self.process_reports)
+        return totals
+
+    async def build_snapshot(self) -> dict:
+        groups = {group_id: dict(counts) for group_id, counts in sorted(self.group_counts.items())}
+        totals = dict.fromkeys(group_counter_keys, 0)
+        for counts in groups.values():
+            for key, count in counts.items():
+                totals[key] += count
+
+        processes = self.get_process_totals()
+        partial_uploads, partial_bytes = await anyio.to_thread.run_sync(
+            get_partial_uploads, mounted_dir.joinpath("data/audio_data"))
+
+        return {
+            "status": "online",
+            "updated_at": datetime.now(timezone.utc),
+            "nodes": {
+                "total": len(self.node_groups),
+                "online": totals["nodes_online"],
+                "offline": totals["nodes_offline"],
+                "unknown": totals["nodes_unknown"]
+            },
+            "devices": {
+                "DBIRTH": totals["devices_birth"],
+                "DDEATH": totals["devices_death"]
+            },
+            "active_process_triggers": totals["active_process_triggers"],
+            "processes": processes["processes"],
+            "ingest": {
+                "rows_per_second": processes["rows_per_second"],
+                "rows_buffered": processes["rows_buffered"],
+                "rows_dropped": processes["rows_dropped"]
+            },
+            "audio_backlog": {
+                "uploads_in_progress": processes["uploads_in_progress"],
+                "partial_uploads": partial_uploads,
+                "partial_bytes": partial_bytes,
+                "upload_bytes_per_second": processes["upload_bytes_per_second"]
+            },
+            "groups": groups
+        }
+
+
+fleet_status = FleetStatus(refresh_interval)
+
+
+async def get_status():
+    # Fleet totals from the last snapshot
+    snapshot = fleet_status.snapshot
+    if snapshot is None:
+        return {"status": "starting"}
+    return {key: value for key, value in snapshot.items() if key != "groups"}
+
+async def get_node_status():
+    # Nodes, devices and active process triggers per group from the last snapshot
+    snapshot = fleet_status.snapshot
+    if snapshot is None:
+        return {"updated_at": None, "groups": {}}
+    return {"updated_at": snapshot["updated_at"], "groups": snapshot["groups"]}
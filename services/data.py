@@ -0,0 +1,98 @@
+from sqlalchemy import text
+from db.db_session import db_SessionLocal
+from db.storage_layout import numeric_value, quote_identifier
+from db.schema_registry import schema_registry
+from db.timescale import timescaledb_installed
+from datetime import datetime, timedelta, timezone
+import math
+
+# Service layer for the sensor data in the group tables, shared by the data API and the node page
+
+default_points = 500
+max_points = 5000
+default_range = timedelta(hours=1)
+
+# time_bucket when TimescaleDB is installed, date_bin (same result) on plain PostgreSQL
+bucket_function: str | None = None
+
+
+def get_time_range(start: datetime | None, end: datetime | None) -> tuple[datetime, datetime]:
+    # Defaults to the last hour, times without a timezone are taken as UTC
+    end = end or datetime.now(timezone.utc)
+    start = start or end - default_range
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if start >= end:
+        raise ValueError("start has to be before end")
+    return start, end
+
+def get_bucket_width(start: datetime, end: datetime, points: int) -> timedelta:
+    # Rounded up to whole microseconds, so the range never holds more than points buckets
+    microseconds = math.ceil((end - start) / timedelta(microseconds=1) / points)
+    return timedelta(microseconds=max(microseconds, 1))
+
+async def get_bucket_function(db) -> str:
+    global bucket_function
+    if bucket_function is None:
+        bucket_function = "time_bucket" if await timescaledb_installed(db) else "date_bin"
+    return bucket_function
+
+def series_stmt(group_id: str, function: str, sensor_ids: list[str] | None, layout: str):
+    # One row per sensor and bucket, the buckets start at the start of the range.
+    # min and max are returned next to the average, so short peaks are still visible after downsampling.
+    # Booleans count as 0 and 1, other values that are not numeric are skipped.
+    sensor_condition = "AND sensor_id = ANY(:sensor_ids)" if sensor_ids else ""
+    stmt = text(f"""
+        SELECT sensor_id, {function}(CAST(:bucket_width AS INTERVAL), time, CAST(:start AS TIMESTAMPTZ)) AS bucket,
+               avg(value) AS value, min(value) AS min, max(value) AS max, count(value) AS count
+        FROM (
+            SELECT time, sensor_id, {numeric_value[layout]} AS value
+            FROM {quote_identifier(group_id)}
+            WHERE device_id = :device_id AND time >= :start AND time < :end {sensor_condition}
+        ) samples
+        GROUP BY sensor_id, bucket
+        HAVING count(value) > 0
+        ORDER BY sensor_id, bucket
+    """)
+    if sensor_ids:
+        stmt = stmt.bindparams(sensor_ids=sensor_ids)
+    return stmt
+
+async def stream_series(group_id: str, device_id: str, sensor_ids: list[str] | None,
+                        start: datetime, end: datetime, points: int):
+    # Downsampled points of each sensor, read with a server side cursor so large ranges are not buffered
+    bucket_width = get_bucket_width(start, end, points)
+    async with db_SessionLocal() as db:
+        layout = schema_registry.get_layout(group_id)
+        stmt = series_stmt(group_id, await get_bucket_function(db), sensor_ids, layout).bindparams(
+            bucket_width=bucket_width, start=start, end=end, device_id=device_id
+        )
+        result = await db.stream(stmt)
+        async for sensor_id, bucket, value, min_value, max_value, count in result:
+            yield {
+                "sensor_id": sensor_id,
+                "time": bucket,
+                "value": value,
+                "min": min_value,
+                "max": max_value,
+                "count": count
+            }
+
+async def get_series(group_id: str, device_id: str, sensor_ids: list[str] | None = None,
+                     start: datetime | None = None, end: datetime | None = None, points: int = default_points):
+    # Downsampled points grouped per sensor
+    start, end = get_time_range(start, end)
+    series = {}
+    async for point in stream_series(group_id, device_id, sensor_ids, start, end, points):
+        series.setdefault(point.pop("sensor_id"), []).append(point)
+
+    return {
+        "group_id": group_id,
+        "device_id": device_id,
+        "start": start,
+        "end": end,
+        "bucket_seconds": get_bucket_width(start, end, points).total_seconds(),
+        "series": series
+    }
@@ -0,0 +1,46 @@
+from collections import defaultdict
+from typing import Callable
+import logging
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Topics published on the event bus
+NODE_STATE = "node_state"
+DEVICE_STATE = "device_state"
+STATE_VALUE = "state_value"
+GATEWAY_HEALTH = "gateway_health"
+PROCESS_REPORT = "process_report"
+
+
+class EventBus:
+    # In-process publish/subscribe, used to push changes to the connected UI clients
+    def __init__(self, shared_topics: set[str]):
+        self.subscribers: dict[str, set[Callable]] = defaultdict(set)
+        # Topics that are also sent to the other processes of a multi-process deployment. The state topics are
+        # not, every process follows the states from the MQTT broker itself.
+        self.shared_topics = shared_topics
+        # Sends an event of a shared topic to the other processes, set by the pub/sub
+        self.forward: Callable[[str, dict], None] | None = None
+
+    def subscribe(self, topic: str, callback: Callable) -> Callable:
+        # Returns a function that removes the subscription again
+        self.subscribers[topic].add(callback)
+        return lambda: self.subscribers[topic].discard(callback)
+
+    def publish(self, topic: str, event: dict):
+        self.deliver(topic, event)
+        if self.forward is not None and topic in self.shared_topics:
+            self.forward(topic, event)
+
+    def deliver(self, topic: str, event: dict):
+        # Calls the subscribers of this process only, also used for the events received from other processes
+        for callback in list(self.subscribers[topic]):
+            try:
+                callback(event)
+            except Exception as e:
+                # One broken subscriber should not stop the others from being updated
+                logger.error(f"Event subscriber for {topic} failed: {str(e)}")
+
+
+event_bus = EventBus(shared_topics={GATEWAY_HEALTH, PROCESS_REPORT})
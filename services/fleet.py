@@ -0,0 +1,239 @@
+from sqlalchemy import select, delete
+from models.fleet import FleetManifest, GatewayProvisioning, DeviceProvisioning
+from models.add_nodes import NodeConfig, ProvisioningJobRecord
+from models.manage_nodes import AddDeviceSchema, DeviceDataSchema
+from services.gateway_client import gateway_clients
+from db.db_session import db_SessionLocal
+import services.nodes as nodes_service
+from collections import OrderedDict
+from datetime import datetime, timezone
+import httpx
+import asyncio
+import csv
+import io
+import json
+import logging
+import sys
+import time
+import uuid
+import os
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+
+logger = logging.getLogger(__name__)
+
+# Gateway endpoints for adding the device services
+device_service_endpoints = {
+    "S7Comm": "add_S7_device",
+    "USB": "add_USB_microphone"
+}
+
+default_concurrency = int(os.getenv("FLEET_CONCURRENCY", "10"))
+# Only the latest jobs are kept
+max_jobs = 20
+# Seconds between two saves of the progress of a running job
+job_save_interval = 1.0
+gateway_timeout = httpx.Timeout(300.0, connect=10.0)
+
+
+class ProvisioningError(Exception):
+    pass
+
+
+class ProvisioningJob:
+    # Progress of a fleet provisioning, one entry per gateway
+    def __init__(self, manifest: FleetManifest):
+        self.job_id = uuid.uuid4().hex
+        self.created = time.time()
+        self.finished: float | None = None
+        self.manifest = manifest
+        self.gateways = OrderedDict(
+            (gateway.node_id, {"status": "pending", "step": None, "error": None, "devices": {}})
+            for gateway in manifest.gateways
+        )
+
+    def to_dict(self):
+        return get_job_dict(self.job_id, self.created, self.finished, self.gateways)
+
+
+# The jobs are kept in the database, so a job started by one process can be followed through any other
+provisioning_tasks: set[asyncio.Task] = set()
+
+
+def get_job_dict(job_id: str, created: float, finished: float | None, gateways: dict) -> dict:
+    statuses = [gateway["status"] for gateway in gateways.values()]
+    return {
+        "job_id": job_id,
+        "created": created,
+        "finished": finished,
+        "total": len(statuses),
+        "succeeded": statuses.count("done"),
+        "failed": statuses.count("failed"),
+        "gateways": gateways
+    }
+
+def record_to_dict(record: ProvisioningJobRecord) -> dict:
+    return get_job_dict(record.job_id, record.created.timestamp(),
+                        record.finished.timestamp() if record.finished else None, record.gateways)
+
+def get_timestamp(seconds: float | None) -> datetime | None:
+    return datetime.fromtimestamp(seconds, timezone.utc) if seconds is not None else None
+
+async def save_job(job: ProvisioningJob):
+    async with db_SessionLocal() as db:
+        await db.merge(ProvisioningJobRecord(job_id=job.job_id, created=get_timestamp(job.created),
+                                             finished=get_timestamp(job.finished), gateways=dict(job.gateways)))
+        await db.commit()
+
+
+def parse_manifest(content: bytes, filename: str) -> FleetManifest:
+    # Manifest as YAML, JSON or CSV (gateways only, app_services separated by ';')
+    if filename.endswith(".csv"):
+        reader = csv.DictReader(io.StringIO(content.decode("utf-8-sig")))
+        gateways = []
+        for row in reader:
+            gateway = {key: value for key, value in row.items() if value}
+            if "app_services" in gateway:
+                gateway["app_services"] = [service.strip() for service in gateway["app_services"].split(";")]
+            gateways.append(gateway)
+        return FleetManifest(gateways=gateways)
+
+    if filename.endswith((".yaml", ".yml")):
+        # Imported when a YAML manifest is uploaded, not at startup
+        import yaml
+        try:
+            data = yaml.safe_load(content)
+        except yaml.YAMLError as e:
+            raise ValueError(str(e)) from e
+    else:
+        data = json.loads(content)
+
+    # A plain list of gateways is accepted as well
+    if isinstance(data, list):
+        data = {"gateways": data}
+    if not isinstance(data, dict):
+        raise ValueError("Manifest must be a mapping or a list of gateways")
+    return FleetManifest(**data)
+
+async def start_provisioning(manifest: FleetManifest) -> ProvisioningJob:
+    # Start provisioning in the background and return the job to follow the progress
+    job = ProvisioningJob(manifest)
+    async with db_SessionLocal() as db:
+        db.add(ProvisioningJobRecord(job_id=job.job_id, created=get_timestamp(job.created),
+                                     gateways=dict(job.gateways)))
+        latest = select(ProvisioningJobRecord.job_id).order_by(ProvisioningJobRecord.created.desc()).limit(max_jobs)
+        await db.flush()
+        await db.execute(delete(ProvisioningJobRecord).where(ProvisioningJobRecord.job_id.not_in(latest)))
+        await db.commit()
+
+    task = asyncio.create_task(run_job(job))
+    provisioning_tasks.add(task)
+    task.add_done_callback(provisioning_tasks.discard)
+    return job
+
+async def get_job(job_id: str) -> dict | None:
+    async with db_SessionLocal() as db:
+        record = await db.get(ProvisioningJobRecord, job_id)
+    return record_to_dict(record) if record else None
+
+async def get_jobs():
+    async with db_SessionLocal() as db:
+        records = await db.scalars(select(ProvisioningJobRecord).order_by(ProvisioningJobRecord.created.desc()))
+        return [record_to_dict(record) for record in records]
+
+async def run_job(job: ProvisioningJob):
+    # All gateways are provisioned at the same time, limited by the concurrency
+    semaphore = asyncio.Semaphore(job.manifest.concurrency or default_concurrency)
+
+    async def provision(gateway: GatewayProvisioning):
+        async with semaphore:
+            await provision_gateway(gateway, job.gateways[gateway.node_id])
+
+    async def save_progress():
+        while True:
+            await asyncio.sleep(job_save_interval)
+            try:
+                await save_job(job)
+            except Exception as e:
+                logger.error(f"Failed to save the progress of provisioning job {job.job_id}: {str(e)}")
+
+    saver = asyncio.create_task(save_progress())
+    try:
+        await asyncio.gather(*(provision(gateway) for gateway in job.manifest.gateways))
+    finally:
+        saver.cancel()
+    job.finished = time.time()
+    await save_job(job)
+    logger.info(f"Provisioning job {job.job_id} finished: {job.to_dict()['succeeded']} of "
+                f"{len(job.gateways)} gateways succeeded")
+
+async def provision_gateway(gateway: GatewayProvisioning, progress: dict):
+    # Same steps as adding a gateway on the add gateway page, followed by the device services
+    progress["status"] = "running"
+    node_data = {
+        "group_id": gateway.group_id,
+        "node_id": gateway.node_id,
+        "description": gateway.description,
+        "ip": gateway.ip,
+        "app_services": gateway.app_services,
+        "device_services": []
+    }
+    try:
+        progress["step"] = "configure_node"
+        await post_to_gateway(gateway.ip, "/api/configure_node/configure_node", node_data)
+
+        progress["step"] = "MQTT"
+        await post_to_gateway(gateway.ip, "/api/configure_node/MQTT", {"ip": get_broker_ip()})
+
+        progress["step"] = "create_node"
+        await nodes_service.create_node(NodeConfig(**node_data, storage_layout=gateway.storage_layout))
+
+        # Device services are added one at a time, the gateway starts a container for each of them
+        for device in gateway.devices:
+            progress["step"] = f"device {device.config.get('device', {}).get('device_id')}"
+            await provision_device(gateway, device, progress)
+
+        progress["status"] = "done"
+        progress["step"] = None
+    except Exception as e:
+        progress["status"] = "failed"
+        progress["error"] = str(getattr(e, "detail", e)) or type(e).__name__
+        logger.error(f"Provisioning of gateway {gateway.node_id} failed at {progress['step']}: {progress['error']}")
+
+async def provision_device(gateway: GatewayProvisioning, device: DeviceProvisioning, progress: dict):
+    endpoint = device_service_endpoints.get(device.protocol_type)
+    if endpoint is None:
+        raise ProvisioningError(f"Unsupported protocol: {device.protocol_type}")
+
+    device_config = device.config.get("device", {})
+    device_data = DeviceDataSchema(
+        group_id=gateway.group_id,
+        node_id=gateway.node_id,
+        device_id=device_config.get("device_id", ""),
+        protocol_type=device.protocol_type,
+        alias=device_config.get("alias"),
+        manufacturer=device_config.get("manufacturer"),
+        model=device_config.get("model"),
+        device_ip=device_config.get("ip"),
+        device_port=device_config.get("port")
+    )
+    request = AddDeviceSchema(device_data=device_data, triggers=device.config.get("triggers", []))
+
+    progress["devices"][device_data.device_id] = "running"
+    await post_to_gateway(gateway.ip, f"/api/add_devices/{endpoint}", device.config)
+    await nodes_service.add_device(request)
+    progress["devices"][device_data.device_id] = "done"
+
+async def post_to_gateway(node_ip: str, path: str, data: dict):
+    response = await gateway_clients.post(node_ip, path, json=data, timeout=gateway_timeout)
+    if response.status_code != 200:
+        error_detail = response.text if response.text else "No error details provided"
+        raise ProvisioningError(f"HTTP {response.status_code} from {path}: {error_detail}")
+
+def get_broker_ip():
+    # Same fallback as the add gateway page
+    return os.getenv("Backend_IP") or "192.168.0.152"
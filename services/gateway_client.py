@@ -0,0 +1,194 @@
+from services.metrics import gateway_request_duration, gateway_request_errors
+import httpx
+import asyncio
+import importlib.util
+import logging
+import random
+import sys
+import time
+import os
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+
+logger = logging.getLogger(__name__)
+
+
+class GatewayUnavailableError(httpx.ConnectError):
+    # Raised without contacting the gateway while its circuit breaker is open.
+    # Subclass of ConnectError so the pages handle it like any other unreachable gateway.
+    pass
+
+
+class CircuitBreaker:
+    # Stops calls to a gateway after repeated connection failures, until the reset timeout has passed
+    def __init__(self, failure_threshold: int, reset_timeout: float):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: float | None = None
+
+    @property
+    def is_open(self) -> bool:
+        return self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_timeout
+
+    def allow_request(self) -> bool:
+        # After the reset timeout one call is let through to test if the gateway is back (half open)
+        if self.opened_at is None:
+            return True
+        if not self.is_open:
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class GatewayClientRegistry:
+    # One pooled client per gateway, so connections to the gateways are kept alive and reused
+    def __init__(self, port: int, max_connections: int, keepalive_expiry: float, connect_timeout: float,
+                 retries: int, backoff_base: float, backoff_max: float,
+                 failure_threshold: int, reset_timeout: float, http2: bool):
+        self.port = port
+        self.max_connections = max_connections
+        self.keepalive_expiry = keepalive_expiry
+        self.connect_timeout = connect_timeout
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.http2 = http2
+
+        self.clients: dict[str, httpx.AsyncClient] = {}
+        self.breakers: dict[str, CircuitBreaker] = {}
+        # Gateways the health monitor found unreachable, with the time of the last answer (None for never)
+        self.unreachable: dict[str, float | None] = {}
+
+    def start(self):
+        # HTTP/2 needs the optional h2 package
+        if self.http2 and importlib.util.find_spec("h2") is None:
+            logger.warning("GATEWAY_HTTP2 is enabled but the h2 package is not installed, using HTTP/1.1")
+            self.http2 = False
+
+    async def close(self):
+        clients = list(self.clients.values())
+        self.clients.clear()
+        await asyncio.gather(*(client.aclose() for client in clients), return_exceptions=True)
+
+    def get_client(self, node_ip: str) -> httpx.AsyncClient:
+        client = self.clients.get(node_ip)
+        if client is None:
+            client = httpx.AsyncClient(
+                base_url=f"http://{node_ip}:{self.port}",
+                limits=httpx.Limits(
+                    max_connections=self.max_connections,
+                    max_keepalive_connections=self.max_connections,
+                    keepalive_expiry=self.keepalive_expiry
+                ),
+                timeout=httpx.Timeout(30.0, connect=self.connect_timeout),
+                http2=self.http2
+            )
+            self.clients[node_ip] = client
+        return client
+
+    def get_breaker(self, node_ip: str) -> CircuitBreaker:
+        breaker = self.breakers.get(node_ip)
+        if breaker is None:
+            breaker = self.breakers[node_ip] = CircuitBreaker(self.failure_threshold, self.reset_timeout)
+        return breaker
+
+    def is_available(self, node_ip: str) -> bool:
+        return not self.get_breaker(node_ip).is_open and node_ip not in self.unreachable
+
+    def set_unreachable(self, node_ip: str, unreachable: bool, last_seen: float | None = None):
+        # Set by the health monitor, calls to an unreachable gateway fail at once until a probe is answered again
+        if unreachable:
+            self.unreachable[node_ip] = last_seen
+        else:
+            self.unreachable.pop(node_ip, None)
+
+    async def request(self, node_ip: str, method: str, path: str, **kwargs) -> httpx.Response:
+        if node_ip in self.unreachable:
+            gateway_request_errors.inc(node_ip, "unreachable")
+            last_seen = self.unreachable[node_ip]
+            since = f"since {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(last_seen))}" if last_seen else "yet"
+            raise GatewayUnavailableError(f"Gateway {node_ip} has not answered the health probes {since}")
+
+        breaker = self.get_breaker(node_ip)
+        if not breaker.allow_request():
+            gateway_request_errors.inc(node_ip, "circuit_open")
+            raise GatewayUnavailableError(f"Gateway {node_ip} is unreachable, retrying in at most "
+                                          f"{self.reset_timeout:.0f} seconds")
+
+        client = self.get_client(node_ip)
+        attempt = 0
+        while True:
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                self.record_call(node_ip, method, start, e)
+                # Every failed attempt counts for the breaker, so a dead gateway opens it within one call
+                # instead of blocking several calls for all their retries
+                breaker.record_failure()
+                # The request never reached the gateway, so it is safe to send it again
+                if attempt < self.retries and not breaker.is_open:
+                    attempt += 1
+                    await asyncio.sleep(self.get_backoff(attempt))
+                    continue
+                raise
+            except httpx.TimeoutException as e:
+                self.record_call(node_ip, method, start, e)
+                # The gateway might still be working on the request, so it is not sent again
+                breaker.record_failure()
+                raise
+            except httpx.HTTPError as e:
+                self.record_call(node_ip, method, start, e)
+                raise
+            self.record_call(node_ip, method, start, status_code=response.status_code)
+            breaker.record_success()
+            return response
+
+    def record_call(self, node_ip: str, method: str, start: float, error: Exception | None = None,
+                    status_code: int | None = None):
+        # Latency of every attempt, errors counted by type (ConnectError, ReadTimeout, ...) or as server_error
+        gateway_request_duration.observe(time.perf_counter() - start, node_ip, method)
+        if error is not None:
+            gateway_request_errors.inc(node_ip, type(error).__name__)
+        elif status_code is not None and status_code >= 500:
+            gateway_request_errors.inc(node_ip, "server_error")
+
+    def get_backoff(self, attempt: int) -> float:
+        # Exponential backoff with full jitter
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def get(self, node_ip: str, path: str, **kwargs) -> httpx.Response:
+        return await self.request(node_ip, "GET", path, **kwargs)
+
+    async def post(self, node_ip: str, path: str, **kwargs) -> httpx.Response:
+        return await self.request(node_ip, "POST", path, **kwargs)
+
+
+gateway_clients = GatewayClientRegistry(
+    port=int(os.getenv("GATEWAY_PORT", "8000")),
+    max_connections=int(os.getenv("GATEWAY_MAX_CONNECTIONS", "4")),
+    keepalive_expiry=float(os.getenv("GATEWAY_KEEPALIVE_EXPIRY", "60")),
+    connect_timeout=float(os.getenv("GATEWAY_CONNECT_TIMEOUT", "5")),
+    retries=int(os.getenv("GATEWAY_RETRIES", "2")),
+    backoff_base=float(os.getenv("GATEWAY_BACKOFF_BASE", "0.25")),
+    backoff_max=float(os.getenv("GATEWAY_BACKOFF_MAX", "4")),
+    failure_threshold=int(os.getenv("GATEWAY_FAILURE_THRESHOLD", "3")),
+    reset_timeout=float(os.getenv("GATEWAY_RESET_TIMEOUT", "30")),
+    http2=os.getenv("GATEWAY_HTTP2", "false").lower() in ("1", "true", "yes")
+)
@@ -0,0 +1,201 @@
+from sqlalchemy import select
+from db.db_session import db_SessionLocal
+from db.change_tracking import change_tracker, NODES
+from models.add_nodes import EdgeNode
+from services.gateway_client import gateway_clients
+from services.events import event_bus, GATEWAY_HEALTH
+from collections import deque
+import statistics
+import asyncio
+import httpx
+import logging
+import time
+import os
+
+# Probes every gateway in the background, so the pages know an unreachable gateway before a call to it
+# has to time out. Any HTTP answer counts as alive, the probe only tests that the gateway answers.
+# Only one process probes, it publishes the results on the event bus and the API workers follow them.
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Gateway states
+UP = "up"
+DEGRADED = "degraded"
+DOWN = "down"
+UNKNOWN = "unknown"
+
+
+class GatewayHealth:
+    # Probe history of one gateway
+    def __init__(self, node_id: str, ip: str, history_size: int):
+        self.node_id = node_id
+        self.ip = ip
+        # (time, round trip seconds or None for a failed probe), oldest first
+        self.history: deque[tuple[float, float | None]] = deque(maxlen=history_size)
+        self.consecutive_failures = 0
+        self.last_seen: float | None = None
+        self.last_error: str | None = None
+        self.state = UNKNOWN
+
+    def get_latencies(self) -> list[float]:
+        return [latency for _, latency in self.history if latency is not None]
+
+    def to_dict(self) -> dict:
+        latencies = self.get_latencies()
+        return {
+            "node_id": self.node_id,
+            "ip": self.ip,
+            "state": self.state,
+            "last_latency": self.history[-1][1] if self.history else None,
+            "median_latency": statistics.median(latencies) if latencies else None,
+            "failed_probes": sum(1 for _, latency in self.history if latency is None),
+            "probes": len(self.history),
+            "consecutive_failures": self.consecutive_failures,
+            "last_seen": self.last_seen,
+            "last_error": self.last_error,
+            "history": list(self.history)
+        }
+
+
+class GatewayHealthMonitor:
+    def __init__(self, interval: float, timeout: float, max_concurrency: int, path: str, history_size: int,
+                 down_after: int, degraded_latency: float):
+        self.interval = interval
+        self.timeout = timeout
+        self.max_concurrency = max_concurrency
+        self.path = path
+        self.history_size = history_size
+        self.down_after = down_after
+        self.degraded_latency = degraded_latency
+
+        self.gateways: dict[str, GatewayHealth] = {}
+        self.nodes_version: str | None = None
+        # Health of the gateways probed by another process, node_id -> GatewayHealth.to_dict()
+        self.reported: dict[str, dict] = {}
+        self._task: asyncio.Task | None = None
+        self._unsubscribe = None
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._probe_loop())
+
+    def follow(self):
+        # Follow the probes of another process instead of probing
+        if self._unsubscribe is None:
+            self._unsubscribe = event_bus.subscribe(GATEWAY_HEALTH, self.on_gateway_health)
+
+    async def stop(self):
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+            self._unsubscribe = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _probe_loop(self):
+        while True:
+            try:
+                await self.probe_all()
+            except Exception as e:
+                logger.error(f"Gateway health probes failed: {str(e)}")
+            await asyncio.sleep(self.interval)
+
+    async def load_gateways(self):
+        # The probe history is kept for nodes that are still added with the same IP
+        nodes_version = change_tracker.get_version(NODES)
+        if nodes_version == self.nodes_version:
+            return
+        async with db_SessionLocal() as db:
+            nodes = (await db.execute(select(EdgeNode.node_id, EdgeNode.ip))).all()
+        gateways = {}
+        for node_id, ip in nodes:
+            if not ip:
+                continue
+            health = self.gateways.get(node_id)
+            gateways[node_id] = health if health and health.ip == ip else GatewayHealth(node_id, ip,
+                                                                                          self.history_size)
+        # Removed gateways are no longer failed fast
+        for node_id, health in self.gateways.items():
+            if gateways.get(node_id) is not health:
+                gateway_clients.set_unreachable(health.ip, False)
+                event_bus.publish(GATEWAY_HEALTH, {"node_id": node_id, "ip": health.ip, "removed": True})
+        self.gateways = gateways
+        self.nodes_version = nodes_version
+
+    async def probe_all(self):
+        await self.load_gateways()
+        slots = asyncio.Semaphore(self.max_concurrency)
+
+        async def probe_with_slot(health: GatewayHealth):
+            async with slots:
+                await self.probe(health)
+
+        await asyncio.gather(*(probe_with_slot(health) for health in list(self.gateways.values())))
+
+    async def probe(self, health: GatewayHealth):
+        # The pooled client of the gateway is used directly, without the retries of the calls
+        client = gateway_clients.get_client(health.ip)
+        start = time.perf_counter()
+        try:
+            await client.get(self.path, timeout=httpx.Timeout(self.timeout))
+        except httpx.HTTPError as e:
+            health.history.append((time.time(), None))
+            health.consecutive_failures += 1
+            health.last_error = f"{type(e).__name__}: {str(e)}" if str(e) else type(e).__name__
+        else:
+            health.history.append((time.time(), time.perf_counter() - start))
+            health.consecutive_failures = 0
+            health.last_seen = time.time()
+            health.last_error = None
+        self.update_state(health)
+
+    def update_state(self, health: GatewayHealth):
+        # Down after repeated failed probes, degraded while slow or after a failed probe in the history
+        previous = health.state
+        latencies = health.get_latencies()
+        if health.consecutive_failures >= self.down_after:
+            health.state = DOWN
+        elif health.consecutive_failures or len(latencies) < len(health.history) \
+                or statistics.median(latencies[-5:]) > self.degraded_latency:
+            health.state = DEGRADED
+        else:
+            health.state = UP
+
+        gateway_clients.set_unreachable(health.ip, health.state == DOWN, health.last_seen)
+        event_bus.publish(GATEWAY_HEALTH, health.to_dict())
+        if health.state != previous and previous != UNKNOWN:
+            logger.info(f"Gateway {health.node_id} ({health.ip}) changed from {previous} to {health.state}")
+
+    def on_gateway_health(self, event: dict):
+        # Probe result or removed gateway from the probing process
+        if event.get("removed"):
+            self.reported.pop(event["node_id"], None)
+            gateway_clients.set_unreachable(event["ip"], False)
+            return
+        self.reported[event["node_id"]] = event
+        gateway_clients.set_unreachable(event["ip"], event["state"] == DOWN, event["last_seen"])
+
+    def get_health(self, node_id: str) -> dict | None:
+        health = self.gateways.get(node_id)
+        return health.to_dict() if health else self.reported.get(node_id)
+
+    def get_all_health(self) -> list[dict]:
+        if self._task is None:
+            return list(self.reported.values())
+        return [health.to_dict() for health in self.gateways.values()]
+
+
+gateway_health_monitor = GatewayHealthMonitor(
+    interval=float(os.getenv("GATEWAY_PROBE_INTERVAL", "10")),
+    timeout=float(os.getenv("GATEWAY_PROBE_TIMEOUT", "2")),
+    max_concurrency=int(os.getenv("GATEWAY_PROBE_CONCURRENCY", "20")),
+    path=os.getenv("GATEWAY_PROBE_PATH", "/"),
+    history_size=int(os.getenv("GATEWAY_PROBE_HISTORY", "30")),
+    down_after=int(os.getenv("GATEWAY_PROBE_DOWN_AFTER", "2")),
+    degraded_latency=float(os.getenv("GATEWAY_DEGRADED_LATENCY", "1"))
+)
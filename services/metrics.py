@@ -0,0 +1,289 @@
+from collections import deque
+from sqlalchemy import event
+import asyncio
+import logging
+import math
+import time
+import os
+
+# Metrics in the Prometheus text format for /metrics. Everything is recorded on the event loop thread,
+# so the metrics are not locked.
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Seconds between two event loop lag measurements
+lag_interval = float(os.getenv("METRICS_LAG_INTERVAL", "0.5"))
+
+default_buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+lag_buckets = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0)
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def format_labels(names: tuple, values: tuple) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{name}="{escape_label_value(value)}"' for name, value in zip(names, values)) + "}"
+
+def format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    type_name = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+
+    def samples(self) -> list[tuple[str, tuple, tuple, float]]:
+        # (name suffix, label names, label values, value)
+        return []
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type_name}"]
+        for suffix, names, values, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(names, values)} {format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type_name = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple = ()):
+        super().__init__(name, help, labels)
+        self.values: dict[tuple, float] = {}
+        if not self.labels:
+            self.values[()] = 0.0
+
+    def inc(self, *label_values, amount: float = 1.0):
+        self.values[label_values] = self.values.get(label_values, 0.0) + amount
+
+    def samples(self):
+        return [("", self.labels, values, value) for values, value in self.values.items()]
+
+
+class Gauge(Metric):
+    # Either set directly or read from the collect function when the metrics are scraped,
+    # collect returns the value per tuple of label values
+    type_name = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), collect=None):
+        super().__init__(name, help, labels)
+        self.values: dict[tuple, float] = {}
+        self.collect = collect
+
+    def set(self, value: float, *label_values):
+        self.values[label_values] = value
+
+    def samples(self):
+        values = self.collect() if self.collect else self.values
+        return [("", self.labels, label_values, value) for label_values, value in values.items()]
+
+
+class CollectedCounter(Gauge):
+    # Counter kept elsewhere (for example by the telemetry ingest buffer), read when the metrics are scraped
+    type_name = "counter"
+
+
+class Histogram(Metric):
+    type_name = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple = (), buckets: tuple = default_buckets):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        # label values -> [count per bucket, sum]
+        self.values: dict[tuple, list] = {}
+
+    def observe(self, value: float, *label_values):
+        entry = self.values.get(label_values)
+        if entry is None:
+            entry = self.values[label_values] = [[0] * len(self.buckets), 0.0]
+        counts = entry[0]
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                counts[index] += 1
+                break
+        entry[1] += value
+
+    def samples(self):
+        samples = []
+        names = self.labels + ("le",)
+        for label_values, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                samples.append(("_bucket", names, label_values + (format_value(bound),), cumulative))
+            samples.append(("_sum", self.labels, label_values, total))
+            samples.append(("_count", self.labels, label_values, cumulative))
+        return samples
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.metrics: list[Metric] = []
+
+    def add(self, metric: Metric) -> Metric:
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        rendered = []
+        for metric in self.metrics:
+            try:
+                rendered.append(metric.render())
+            except Exception as e:
+                # One failing collector does not break the scrape
+                logger.error(f"Failed to collect metric {metric.name}: {str(e)}")
+        return "\n".join(rendered) + "\n"
+
+
+metrics = MetricsRegistry()
+
+# API
+http_request_duration = metrics.add(Histogram(
+    "http_request_duration_seconds", "Time until the response of an API request is sent",
+    ("router", "method", "status")))
+http_requests_in_progress = metrics.add(Gauge(
+    "http_requests_in_progress", "API requests being answered", ("router",)))
+
+# Database
+db_query_duration = metrics.add(Histogram(
+    "db_query_duration_seconds", "Time of the SQL statements sent through SQLAlchemy", ("statement",)))
+db_query_errors = metrics.add(Counter(
+    "db_query_errors_total", "SQL statements that failed", ("statement",)))
+db_pool_checkouts = metrics.add(Counter(
+    "db_pool_checkouts_total", "Connections taken from the pool"))
+db_pool_connects = metrics.add(Counter(
+    "db_pool_connects_total", "New database connections opened by the pool"))
+
+# Gateways
+gateway_request_duration = metrics.add(Histogram(
+    "gateway_request_duration_seconds", "Time of the calls to the gateways", ("gateway", "method")))
+gateway_request_errors = metrics.add(Counter(
+    "gateway_request_errors_total", "Calls to the gateways that failed", ("gateway", "error")))
+
+# Audio uploads
+audio_upload_bytes = metrics.add(Counter(
+    "audio_upload_bytes_total", "Bytes of audio received from the microphone services"))
+audio_upload_rate = metrics.add(Gauge(
+    "audio_upload_bytes_per_second", "Audio bytes received per second over the last minute"))
+
+# Event loop
+event_loop_lag = metrics.add(Histogram(
+    "event_loop_lag_seconds", "Delay of a timer on the event loop, time the loop was blocked",
+    buckets=lag_buckets))
+event_loop_lag_last = metrics.add(Gauge(
+    "event_loop_lag_last_seconds", "Event loop lag of the last measurement"))
+
+
+def get_statement_type(statement: str) -> str:
+    # First keyword of the statement, so the label only has a few values
+    keyword = statement.lstrip().split(None, 1)[0].upper() if statement.strip() else ""
+    return keyword if keyword in ("SELECT", "INSERT", "UPDATE", "DELETE", "WITH", "CREATE", "ALTER", "DROP",
+                                  "CALL", "LISTEN", "NOTIFY") else "OTHER"
+
+def instrument_engine(engine):
+    # Query timings and pool usage from the engine events. Statements sent on the raw asyncpg connection
+    # (the COPY of the telemetry ingest) are not seen by SQLAlchemy
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start_times", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start_times"].pop()
+        db_query_duration.observe(time.perf_counter() - start, get_statement_type(statement))
+
+    @event.listens_for(sync_engine, "handle_error")
+    def handle_error(context):
+        start_times = context.connection.info.get("query_start_times") if context.connection else None
+        if start_times:
+            start_times.pop()
+        db_query_errors.inc(get_statement_type(context.statement or ""))
+
+    @event.listens_for(sync_engine.pool, "checkout")
+    def checkout(dbapi_connection, connection_record, connection_proxy):
+        db_pool_checkouts.inc()
+
+    @event.listens_for(sync_engine.pool, "connect")
+    def connect(dbapi_connection, connection_record):
+        db_pool_connects.inc()
+
+    pool = sync_engine.pool
+    metrics.add(Gauge("db_pool_size", "Connections kept in the pool", collect=lambda: {(): pool.size()}))
+    metrics.add(Gauge("db_pool_checked_out", "Connections in use", collect=lambda: {(): pool.checkedout()}))
+    metrics.add(Gauge("db_pool_overflow", "Connections open above the pool size",
+                      collect=lambda: {(): max(pool.overflow(), 0)}))
+
+def instrument_telemetry_ingest(ingest):
+    metrics.add(CollectedCounter("ingest_rows_written_total", "Telemetry rows written to the group tables",
+                                 collect=lambda: {(): ingest.rows_written}))
+    metrics.add(CollectedCounter("ingest_rows_dropped_total", "Telemetry rows that could not be written",
+                                 collect=lambda: {(): ingest.rows_dropped}))
+    metrics.add(Gauge("ingest_rows_buffered", "Telemetry rows waiting to be written",
+                      collect=lambda: {(): ingest.buffered_rows}))
+    metrics.add(Gauge("ingest_last_flush_seconds", "Time of the last write of buffered telemetry",
+                      collect=lambda: {(): ingest.last_flush_seconds}))
+
+def instrument_gateway_clients(registry):
+    metrics.add(Gauge("gateway_circuit_open", "1 while calls to the gateway are paused after failures",
+                      ("gateway",),
+                      collect=lambda: {(node_ip,): int(breaker.is_open)
+                                       for node_ip, breaker in registry.breakers.items()}))
+
+def instrument_gateway_health(monitor):
+    metrics.add(Gauge("gateway_probe_latency_seconds", "Round trip of the last answered health probe",
+                      ("node_id", "gateway"),
+                      collect=lambda: {(health.node_id, health.ip): health.get_latencies()[-1]
+                                       for health in monitor.gateways.values() if health.get_latencies()}))
+    metrics.add(Gauge("gateway_up", "1 while the gateway answers the health probes, 0.5 while degraded",
+                      ("node_id", "gateway"),
+                      collect=lambda: {(health.node_id, health.ip): {"up": 1, "degraded": 0.5}.get(health.state, 0)
+                                       for health in monitor.gateways.values() if health.state != "unknown"}))
+
+
+class EventLoopMonitor:
+    # Measures how late a timer fires, which is the time the event loop was blocked by other work.
+    # Also samples the upload counter for the upload rate
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+        self._upload_samples = deque(maxlen=max(2, int(60 / interval)))
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, time.perf_counter() - start - self.interval)
+            event_loop_lag.observe(lag)
+            event_loop_lag_last.set(lag)
+
+            now = time.monotonic()
+            self._upload_samples.append((now, audio_upload_bytes.values.get((), 0.0)))
+            (first_time, first_bytes) = self._upload_samples[0]
+            if now > first_time:
+                audio_upload_rate.set((self._upload_samples[-1][1] - first_bytes) / (now - first_time))
+
+
+event_loop_monitor = EventLoopMonitor(lag_interval)
@@ -0,0 +1,189 @@
+import paho.mqtt.client as mqtt
+from db.db_session import db_SessionLocal
+import db.db_operations as db_op
+from services.events import event_bus, NODE_STATE, DEVICE_STATE, STATE_VALUE
+from db.change_tracking import change_tracker, NODE_STATES, DEVICE_STATES
+import asyncio
+import json
+import logging
+import sys
+import time
+import os
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+
+logger = logging.getLogger(__name__)
+
+# Sparkplug B topics with state information
+state_topics = [
+    "spBv1.0/+/NBIRTH/#",
+    "spBv1.0/+/NDEATH/#",
+    "spBv1.0/+/DBIRTH/#",
+    "spBv1.0/+/DDEATH/#",
+    "spBv1.0/+/STATE/#"
+]
+
+# Keys in a STATE payload that are not states
+payload_meta_keys = {"timestamp", "seq"}
+
+
+class NodeStateCache:
+    # In-memory latest state per node, device and state key
+    def __init__(self):
+        # node_id -> {"time", "state"}
+        self.node_states: dict[str, dict] = {}
+        # (node_id, device_id) -> {"time", "state", "message_type"}
+        self.device_states: dict[tuple[str, str], dict] = {}
+        # (node_id, device_id, state_key) -> {"time", "state"}
+        self.state_values: dict[tuple[str, str, str], dict] = {}
+        # The cache is only used once it has been loaded from the database
+        self.primed = False
+
+    async def load_from_db(self):
+        # Cold start from the latest states stored in the database
+        async with db_SessionLocal() as db:
+            node_states = await db_op.get_latest_node_state(db)
+            device_states = await db_op.get_latest_device_states(db)
+            state_values = await db_op.get_latest_state_values(db)
+
+        # Messages received while loading are newer than the database rows
+        for cache, rows in ((self.node_states, node_states),
+                            (self.device_states, device_states),
+                            (self.state_values, state_values)):
+            for key, value in rows.items():
+                if key not in cache or cache[key]["time"] < value["time"]:
+                    cache[key] = value
+        self.primed = True
+        change_tracker.bump(NODE_STATES, DEVICE_STATES)
+        logger.info(f"Loaded state cache with {len(self.node_states)} nodes and {len(self.device_states)} devices")
+
+    def update_node(self, node_id: str, state: str, timestamp: float) -> bool:
+        # Returns True when the state was newer than the cached state
+        current = self.node_states.get(node_id)
+        if current and current["time"] > timestamp:
+            return False
+        self.node_states[node_id] = {"time": timestamp, "state": state}
+        change_tracker.bump(NODE_STATES)
+        event_bus.publish(NODE_STATE, {"node_id": node_id, "time": timestamp, "state": state})
+        return True
+
+    def update_device(self, node_id: str, device_id: str, message_type: str, state: str, timestamp: float) -> bool:
+        current = self.device_states.get((node_id, device_id))
+        if current and current["time"] > timestamp:
+            return False
+        self.device_states[(node_id, device_id)] = {"time": timestamp, "state": state, "message_type": message_type}
+        change_tracker.bump(DEVICE_STATES)
+        event_bus.publish(DEVICE_STATE, {"node_id": node_id, "device_id": device_id, "time": timestamp,
+                                         "state": state, "message_type": message_type})
+        return True
+
+    def update_state_value(self, node_id: str, device_id: str, state_key: str, state: str, timestamp: float) -> bool:
+        current = self.state_values.get((node_id, device_id, state_key))
+        if current and current["time"] > timestamp:
+            return False
+        self.state_values[(node_id, device_id, state_key)] = {"time": timestamp, "state": state}
+        event_bus.publish(STATE_VALUE, {"node_id": node_id, "device_id": device_id, "state_key": state_key,
+                                        "time": timestamp, "state": state})
+        return True
+
+    def get_node_states(self):
+        return self.node_states
+
+    def get_device_state(self, node_id: str, device_id: str):
+        return self.device_states.get((node_id, device_id))
+
+
+class MQTTStateConsumer:
+    # Subscribes to the Sparkplug B state topics and keeps the state cache up to date
+    def __init__(self, cache: NodeStateCache, host: str, port: int):
+        self.cache = cache
+        self.host = host
+        self.port = port
+        self.client: mqtt.Client | None = None
+        self.loop: asyncio.AbstractEventLoop | None = None
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        await self.cache.load_from_db()
+
+        self.client = mqtt.Client(mqtt.CallbackAPIVersion.VERSION2, client_id=f"infrastructure_manager_{os.getpid()}")
+        self.client.on_connect = self.on_connect
+        self.client.on_message = self.on_message
+        self.client.reconnect_delay_set(min_delay=1, max_delay=30)
+        # Connects in the background and reconnects if the broker goes away
+        self.client.connect_async(self.host, self.port)
+        self.client.loop_start()
+        logger.info(f"MQTT state consumer connecting to {self.host}:{self.port}")
+
+    async def stop(self):
+        if self.client is not None:
+            self.client.disconnect()
+            self.client.loop_stop()
+            self.client = None
+
+    def on_connect(self, client, userdata, flags, reason_code, properties):
+        if reason_code.is_failure:
+            logger.error(f"MQTT state consumer failed to connect: {reason_code}")
+            return
+        # Subscribe again on every connect, so the subscriptions survive reconnects
+        client.subscribe([(topic, 1) for topic in state_topics])
+        logger.info("MQTT state consumer subscribed to Sparkplug B state topics")
+
+    def on_message(self, client, userdata, message):
+        # Called from the MQTT network thread, hand the message over to the event loop
+        self.loop.call_soon_threadsafe(self.handle_message, message.topic, message.payload)
+
+    def handle_message(self, topic: str, payload: bytes):
+        # Topic structure: spBv1.0/{group_id}/{message_type}/{node_id}/{device_id}
+        parts = topic.split("/")
+        if len(parts) < 4:
+            return
+        message_type = parts[2]
+        node_id = parts[3]
+        device_id = parts[4] if len(parts) > 4 else None
+
+        data = decode_payload(payload)
+        timestamp = get_timestamp(data)
+
+        match message_type:
+            case "NBIRTH" | "NDEATH":
+                self.cache.update_node(node_id, str(message_type == "NBIRTH"), timestamp)
+            case "DBIRTH" | "DDEATH" if device_id:
+                self.cache.update_device(node_id, device_id, message_type, str(message_type == "DBIRTH"), timestamp)
+            case "STATE" if device_id:
+                for state_key, state in get_state_values(data):
+                    self.cache.update_state_value(node_id, device_id, state_key, state, timestamp)
+
+
+def decode_payload(payload: bytes) -> dict:
+    # The gateways send JSON payloads, anything else is treated as an empty payload
+    try:
+        data = json.loads(payload)
+    except (ValueError, UnicodeDecodeError):
+        return {}
+    return data if isinstance(data, dict) else {}
+
+def get_timestamp(data: dict) -> float:
+    # Timestamp in seconds, Sparkplug timestamps are in milliseconds
+    timestamp = data.get("timestamp")
+    if not isinstance(timestamp, (int, float)):
+        return time.time()
+    return timestamp / 1000 if timestamp > 1e11 else float(timestamp)
+
+def get_state_values(data: dict):
+    # A STATE payload either names the state key or carries one key per state
+    if "state_key" in data:
+        return [(str(data["state_key"]), str(data.get("state")))]
+    return [(str(key), str(value)) for key, value in data.items() if key not in payload_meta_keys]
+
+
+node_state_cache = NodeStateCache()
+mqtt_state_consumer = MQTTStateConsumer(
+    node_state_cache,
+    host=os.getenv("MQTT_BROKER_HOST", "localhost"),
+    port=int(os.getenv("MQTT_BROKER_PORT", "1883"))
+)
@@ -0,0 +1,131 @@
+from db.db_session import db_SessionLocal
+from models.add_nodes import NodeConfig, EdgeNode, Trigger
+from models.manage_nodes import AddDeviceSchema
+from services.mqtt_state import node_state_cache
+from db.change_tracking import change_tracker, NODES, NODE_STATES, DEVICE_STATES
+import db.db_operations as db_op
+from datetime import datetime, timezone
+import base64
+import binascii
+
+# Service layer for the nodes, shared by the API routers and the pages
+
+default_page_size = 100
+max_page_size = 1000
+
+
+def node_to_dict(node: EdgeNode) -> dict:
+    return {
+        "node_id": node.node_id,
+        "group_id": node.group_id,
+        "description": node.description,
+        "ip": node.ip,
+        "app_services": list(node.app_services or []),
+        "device_services": list(node.device_services or [])
+    }
+
+async def get_all_nodes():
+    # Get all nodes
+    async with db_SessionLocal() as db:
+        nodes = await db_op.get_all_nodes(db)
+    return [node_to_dict(node) for node in nodes]
+
+async def get_nodes(limit: int = default_page_size, cursor: str | None = None, group_id: str | None = None,
+                    state: str | None = None, app_service: str | None = None, search: str | None = None):
+    # Get a page of the nodes, next_cursor is passed as cursor to get the following page
+    after = decode_cursor(cursor) if cursor else None
+    async with db_SessionLocal() as db:
+        # One extra node tells if there is a next page
+        nodes = await db_op.get_all_nodes(db, limit=limit + 1, after=after, group_id=group_id, state=state,
+                                          app_service=app_service, search=search)
+
+    next_cursor = encode_cursor(nodes[limit - 1].node_id) if len(nodes) > limit else None
+    return {"items": [node_to_dict(node) for node in nodes[:limit]], "next_cursor": next_cursor}
+
+async def get_node_filter_options():
+    async with db_SessionLocal() as db:
+        return await db_op.get_node_filter_options(db)
+
+def encode_cursor(node_id: str) -> str:
+    return base64.urlsafe_b64encode(node_id.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> str:
+    # Raises ValueError for a cursor that was not made by encode_cursor
+    try:
+        return base64.b64decode(cursor + "=" * (-len(cursor) % 4), altchars=b"-_", validate=True).decode()
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+async def get_node_states():
+    # Get the latest state of the nodes
+    # Served from the MQTT state cache, the database is only used until the cache has been loaded
+    if node_state_cache.primed:
+        return node_state_cache.get_node_states()
+    async with db_SessionLocal() as db:
+        return await db_op.get_latest_node_state(db)
+
+def get_nodes_version(state: str | None = None) -> str | None:
+    # The state filter reads the states from the database, which change without the manager knowing
+    if state:
+        return None
+    return change_tracker.get_version(NODES)
+
+def get_node_states_version() -> str | None:
+    # States read from the database change without the manager knowing, so they only have a version once
+    # they are served from the state cache
+    if not node_state_cache.primed:
+        return None
+    return change_tracker.get_version(NODE_STATES)
+
+def get_node_details_version() -> str | None:
+    if not node_state_cache.primed:
+        return None
+    return change_tracker.get_version(NODES, DEVICE_STATES)
+
+async def get_node_details(node_id: str):
+    # Get the node with its devices and triggers
+    async with db_SessionLocal() as db:
+        node_details = await db_op.get_node_details(node_id, db)
+
+    # Device states from the state cache, so they match the version of the details
+    if node_state_cache.primed:
+        for device in node_details["device_data"]:
+            device_state = node_state_cache.get_device_state(node_id, device["device_id"])
+            if device_state:
+                device["state"] = device_state["state"]
+                device["last_updated"] = datetime.fromtimestamp(device_state["time"], timezone.utc).isoformat()
+    return node_details
+
+async def create_node(config: NodeConfig):
+    # Add the node information to the table edge_nodes
+    async with db_SessionLocal() as db:
+        new_node = await db_op.create_edge_node(db, config)
+    return {"status": "success", "node_id": new_node.node_id}
+
+async def add_device(request: AddDeviceSchema):
+    # Add the device and its triggers to the database in one transaction
+    async with db_SessionLocal() as db:
+        async with db.begin():
+            #Add to edge_nodes
+            await db_op.add_device_to_node(request.device_data.node_id, request.device_data.device_id, db)
+
+            #Add to devices
+            await db_op.insert_device_data(request.device_data.model_dump(), db)
+
+            #Bulk insert triggers
+            trigger_dicts = [trigger.model_dump() for trigger in request.triggers]
+            if trigger_dicts:
+                await db.execute(Trigger.__table__.insert(), trigger_dicts)
+
+    change_tracker.bump(NODES)
+    return {"status": "success"}
+
+async def delete_node(node_id: str):
+    # Delete the edge node and all its devices and triggers from the database
+    async with db_SessionLocal() as db:
+        return await db_op.delete_node(node_id, db)
+
+async def delete_device(node_id: str, device_id: str):
+    # Delete a specific device on an edge node and its triggers
+    async with db_SessionLocal() as db:
+        return await db_op.delete_device(device_id, node_id, db)
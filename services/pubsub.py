@@ -0,0 +1,129 @@
+from sqlalchemy.engine import make_url
+from db.db_session import db_url
+from db.change_tracking import change_tracker
+from services.events import event_bus
+import asyncpg
+import asyncio
+import json
+import logging
+import os
+
+# Shares the changes of this process with the other processes of a multi-process deployment (API workers next
+# to the UI process) through Postgres LISTEN/NOTIFY: the versions of the shared change tracking scopes, so the
+# other processes stop serving cached responses and ETags of the old data, and the events of the shared topics.
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Postgres refuses notifications with a payload of 8000 bytes or more
+max_payload_size = 7999
+
+
+class PostgresPubSub:
+    def __init__(self, dsn: str, channel: str, reconnect_delay: float):
+        self.dsn = dsn
+        self.channel = channel
+        self.reconnect_delay = reconnect_delay
+        # Events sent by this process are delivered here already, they are skipped when they come back
+        self.origin = change_tracker.instance
+
+        self.connected = False
+        self.sent = 0
+        self.received = 0
+        self.dropped = 0
+        self._queue: asyncio.Queue[str] = asyncio.Queue()
+        self._task: asyncio.Task | None = None
+
+    async def start(self):
+        if self._task is None:
+            change_tracker.forward = self.publish_change
+            event_bus.forward = self.publish_event
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        change_tracker.forward = None
+        event_bus.forward = None
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def publish_change(self, scopes: list[str], version: str):
+        self.send({"type": "change", "scopes": scopes, "version": version})
+
+    def publish_event(self, topic: str, event: dict):
+        self.send({"type": "event", "topic": topic, "event": event})
+
+    def send(self, message: dict):
+        # Called from synchronous code, the notifications are sent in order by the connection task
+        payload = json.dumps({"origin": self.origin, **message}, default=str)
+        if not self.connected or len(payload.encode()) > max_payload_size:
+            self.dropped += 1
+            return
+        self._queue.put_nowait(payload)
+
+    async def _run(self):
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                await connection.add_listener(self.channel, self.on_notification)
+                self.connected = True
+                logger.info(f"Sharing changes with the other processes on channel {self.channel}")
+                # Changes of the other processes may have been missed while not listening, so the shared scopes
+                # are changed again. This also makes the other processes forget their cached responses.
+                change_tracker.bump(*change_tracker.shared_scopes)
+                await self._send_loop(connection)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Pub/sub connection failed, reconnecting in {self.reconnect_delay} s: {str(e)}")
+            finally:
+                self.connected = False
+                if connection is not None and not connection.is_closed():
+                    connection.terminate()
+            await asyncio.sleep(self.reconnect_delay)
+
+    async def _send_loop(self, connection: asyncpg.Connection):
+        while True:
+            try:
+                payload = await asyncio.wait_for(self._queue.get(), timeout=1)
+            except TimeoutError:
+                # Notice a lost connection even when nothing is sent
+                if connection.is_closed():
+                    raise ConnectionError("Connection closed")
+                continue
+            await connection.execute("SELECT pg_notify($1, $2)", self.channel, payload)
+            self.sent += 1
+
+    def on_notification(self, connection, pid: int, channel: str, payload: str):
+        try:
+            message = json.loads(payload)
+        except ValueError:
+            return
+        self.received += 1
+        match message.get("type"):
+            case "change":
+                change_tracker.apply(message["scopes"], message["version"])
+            case "event" if message.get("origin") != self.origin:
+                event_bus.deliver(message["topic"], message["event"])
+
+    def get_status(self) -> dict:
+        return {
+            "channel": self.channel,
+            "connected": self.connected,
+            "sent": self.sent,
+            "received": self.received,
+            "dropped": self.dropped
+        }
+
+
+pubsub = PostgresPubSub(
+    # asyncpg takes the plain postgresql:// URL of the database
+    dsn=make_url(db_url).set(drivername="postgresql").render_as_string(hide_password=False),
+    channel=os.getenv("PUBSUB_CHANNEL", "infrastructure_manager"),
+    reconnect_delay=float(os.getenv("PUBSUB_RECONNECT_DELAY", "2"))
+)
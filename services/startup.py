@@ -0,0 +1,143 @@
+from db.db_session import db_SessionLocal
+from db.db_operations import check_database_tables
+from db.telemetry_ingest import telemetry_ingest
+from services.mqtt_state import mqtt_state_consumer
+from services.dashboard import fleet_status
+from services.gateway_health import gateway_health_monitor
+from services.pubsub import pubsub
+import asyncio
+import logging
+import random
+import time
+import os
+
+# The database is checked in the background after the server has started, so the UI shell is served
+# while the database is still coming up. The services that need the database are started once it is ready.
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Role of this process. ALL runs everything in one process. In a multi-process deployment one UI process serves
+# the pages and probes the gateways, next to API worker processes that only serve the API.
+ALL = "all"
+UI = "ui"
+API = "api"
+manager_role = os.getenv("MANAGER_ROLE", ALL)
+if manager_role not in (ALL, UI, API):
+    raise ValueError(f"Invalid MANAGER_ROLE: {manager_role}, expected one of {ALL}, {UI}, {API}")
+
+# "postgres" shares the changes with the other processes through LISTEN/NOTIFY, "local" keeps them in this process
+pubsub_backend = os.getenv("PUBSUB_BACKEND", "local" if manager_role == ALL else "postgres")
+
+
+class Startup:
+    def __init__(self, role: str, backoff_base: float, backoff_max: float):
+        self.role = role
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self.started_at = time.monotonic()
+        self.db_ready = False
+        self.attempts = 0
+        self.last_error: str | None = None
+        # Seconds per startup step, in the order they ran
+        self.timings: dict[str, float] = {}
+        self._task: asyncio.Task | None = None
+        self._services_started = False
+
+    def start(self):
+        if self._task is None:
+            self.started_at = time.monotonic()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._services_started:
+            await pubsub.stop()
+            await fleet_status.stop()
+            await gateway_health_monitor.stop()
+            await mqtt_state_consumer.stop()
+            await telemetry_ingest.stop()
+
+    async def _timed(self, name: str, step):
+        start = time.perf_counter()
+        try:
+            return await step()
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    async def _run(self):
+        await self._timed("database", self.wait_for_database)
+        self.timings["database_ready_after"] = time.monotonic() - self.started_at
+        await self._timed("services", self.start_services)
+
+    async def wait_for_database(self):
+        # Retries with exponential backoff until the tables are checked, instead of exiting while
+        # the database container is still starting or another worker process creates the same tables
+        while True:
+            self.attempts += 1
+            try:
+                async with db_SessionLocal() as db:
+                    await check_database_tables(db)
+            except Exception as e:
+                self.last_error = str(e) or type(e).__name__
+                # Exponential backoff, half of it jittered so restarted managers do not retry together
+                backoff = min(self.backoff_max, self.backoff_base * 2 ** self.attempts)
+                delay = backoff / 2 + random.uniform(0, backoff / 2)
+                logger.error(f"Database not ready (attempt {self.attempts}), retrying in {delay:.1f} s: "
+                             f"{self.last_error}")
+                await asyncio.sleep(delay)
+                continue
+            self.db_ready = True
+            self.last_error = None
+            logger.info(f"Database verified successfully after {self.attempts} attempt(s)")
+            return
+
+    async def start_services(self):
+        self._services_started = True
+        # Share the changes with the other processes of a multi-process deployment
+        if pubsub_backend == "postgres":
+            await self._timed("pubsub", pubsub.start)
+        # Start writing buffered telemetry to the group tables
+        await self._timed("telemetry_ingest", telemetry_ingest.start)
+        # Probe the gateways in the background, so calls to unreachable gateways fail at once.
+        # The API workers follow the probes of the UI process.
+        if self.role == API:
+            gateway_health_monitor.follow()
+        else:
+            await self._timed("gateway_health", gateway_health_monitor.start)
+        # Every process follows the node and device states from the MQTT broker
+        try:
+            await self._timed("mqtt_state", mqtt_state_consumer.start)
+        except Exception as e:
+            logger.error(f"Failed to start the MQTT state consumer: {str(e)}")
+        # Keep the fleet status of the dashboard up to date
+        await self._timed("fleet_status", fleet_status.start)
+
+    def get_status(self) -> dict:
+        return {
+            "status": "ready" if self.db_ready else "starting",
+            "role": self.role,
+            "pid": os.getpid(),
+            "database": {
+                "ready": self.db_ready,
+                "attempts": self.attempts,
+                "last_error": self.last_error
+            },
+            "pubsub": pubsub.get_status() if pubsub_backend == "postgres" else {"backend": pubsub_backend},
+            "uptime": time.monotonic() - self.started_at,
+            "timings": self.timings
+        }
+
+
+startup = Startup(
+    role=manager_role,
+    backoff_base=float(os.getenv("DB_STARTUP_BACKOFF_BASE", "0.5")),
+    backoff_max=float(os.getenv("DB_STARTUP_BACKOFF_MAX", "10"))
+)
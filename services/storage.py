@@ -0,0 +1,34 @@
+from db.db_session import db_engine, db_SessionLocal
+from db.schema_registry import schema_registry
+from models.storage import StoragePolicy
+import db.db_operations as db_op
+import db.storage_policies as storage_policies
+
+# Service layer for the storage of the group tables, shared by the storage API and the storage page
+
+
+async def get_group_ids() -> list[str]:
+    # Groups of the nodes that have a group table
+    async with db_SessionLocal() as db:
+        group_ids = (await db_op.get_node_filter_options(db))["group_ids"]
+    return [group_id for group_id in group_ids if group_id and await schema_registry.group_table_exists(group_id)]
+
+async def get_storage_overview() -> list[dict]:
+    # Size, compression and policies of every group table
+    group_ids = await get_group_ids()
+    async with db_engine.connect() as conn:
+        return [await storage_policies.get_storage_stats(conn, group_id) for group_id in group_ids]
+
+async def get_group_storage(group_id: str) -> dict | None:
+    # Same as the overview for one group, with the size of every chunk. None for an unknown group
+    if not await schema_registry.group_table_exists(group_id):
+        return None
+    async with db_engine.connect() as conn:
+        return await storage_policies.get_storage_stats(conn, group_id, chunks=True)
+
+async def set_storage_policy(group_id: str, policy: StoragePolicy) -> StoragePolicy:
+    # Raises LookupError for an unknown group, ValueError for an invalid interval and StoragePolicyError
+    # when the policy can not be applied
+    if not await schema_registry.group_table_exists(group_id):
+        raise LookupError(f"Group {group_id} not found")
+    return await storage_policies.set_policy(group_id, policy)